@@ -0,0 +1,5 @@
+"""Tools for measuring the bot's performance.
+
+python -m bench plays whole games against a local fake IRC server (see bench/__main__.py);
+the other modules are microbenchmarks for single parts of the bot, run as python -m bench.<name>.
+"""
@@ -0,0 +1,150 @@
+"""Run full games through the bot against a local fake server and report how it performed.
+
+Usage: python -m bench [--players 24] [--games 1] [--fakelag 2 --fakelag-burst 5] ...
+
+The bot is started from wolfbot.py in a scratch directory with its own botconfig.py,
+so it doesn't touch the database or logs of an existing install. Run with --help for
+all options.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.ircd import FakeIRCd
+from bench.swarm import Swarm
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+BOT_NICK = "wolfbot"
+BOT_PASS = "wolfbot-password"
+CHANNEL = "#werewolf"
+
+# import the bot from this checkout, but pick up botconfig.py from the scratch directory we run in
+_bootstrap = """
+import runpy, sys
+sys.path[:0] = [".", {root!r}]
+sys.argv = ["wolfbot.py"] + sys.argv[1:]
+runpy.run_path({script!r}, run_name="__main__")
+"""
+
+def write_config(path, port, args):
+    with open(os.path.join(ROOT_DIR, "botconfig.py.example"), encoding="utf-8") as f:
+        config = f.read()
+    overrides = {
+        "HOST": "127.0.0.1",
+        "PORT": port,
+        "NICK": BOT_NICK,
+        "IDENT": BOT_NICK,
+        "REALNAME": BOT_NICK,
+        "USERNAME": "",
+        "PASS": BOT_PASS,
+        "SASL_AUTHENTICATION": True,
+        "USE_SSL": False,
+        "CHANNEL": CHANNEL,
+        "CMD_CHAR": "!",
+        "OWNERS": (),
+        "OWNERS_ACCOUNTS": ("admin",),
+        "IRC_CLIENT": args.client,
+        "NIGHT_TIME_LIMIT": args.night,
+        "NIGHT_TIME_WARN": args.night // 2,
+        "DAY_TIME_LIMIT": args.day,
+        "DAY_TIME_WARN": args.day // 2,
+        "SHORT_DAY_LIMIT": args.day,
+        "SHORT_DAY_WARN": args.day // 2,
+    }
+    lines = [config, "", "# Added by bench"]
+    for key, value in overrides.items():
+        lines.append("{0} = {1!r}".format(key, value))
+    with open(os.path.join(path, "botconfig.py"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(statistics.median(values), 4),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 4),
+        "max": round(values[-1], 4),
+    }
+
+async def run(args):
+    server = FakeIRCd(accounts={BOT_NICK: BOT_PASS}, fakelag=args.fakelag, fakelag_burst=args.fakelag_burst)
+    await server.start()
+    workdir = tempfile.mkdtemp(prefix="lykos-bench-")
+    write_config(workdir, server.port, args)
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, "-u", "-c", _bootstrap.format(root=ROOT_DIR, script=os.path.join(ROOT_DIR, "wolfbot.py")),
+        *(["--verbose"] if args.verbose else []), cwd=workdir, stdout=log, stderr=asyncio.subprocess.STDOUT)
+
+    results = {"players": args.players, "fakelag": args.fakelag, "fakelag_burst": args.fakelag_burst,
+               "client": args.client, "seed": args.seed, "games": []}
+    try:
+        started = time.monotonic()
+        conn = await asyncio.wait_for(server.wait_registered(), args.timeout)
+        swarm = Swarm(server, conn.nick, CHANNEL, args.players, seed=args.seed)
+        await swarm.wait_ready(args.timeout)
+        results["startup"] = round(time.monotonic() - started, 3)
+
+        for _ in range(args.games):
+            lines_before, lag_before = conn.lines_in, conn.lag
+            game_start = time.monotonic()
+            await swarm.play(args.gamemode, args.timeout)
+            elapsed = time.monotonic() - game_start
+            lines = conn.lines_in - lines_before
+            results["games"].append({
+                "duration": round(elapsed, 3),
+                "days": swarm.days,
+                "nights": swarm.nights,
+                "bot_lines": lines,
+                "bot_lines_per_second": round(lines / elapsed, 3),
+                "fakelag": round(conn.lag - lag_before, 3),
+            })
+            # let the bot settle back into the "none" phase before the next game
+            await asyncio.sleep(2)
+
+        results["latency"] = {kind: summarize(values) for kind, values in swarm.latencies.items()}
+        results["max_fakelag"] = round(server.stats["max_lag"], 3)
+    finally:
+        if bot.returncode is None:
+            bot.terminate()
+            try:
+                await asyncio.wait_for(bot.wait(), 10)
+            except asyncio.TimeoutError:
+                bot.kill()
+        log.close()
+        await server.close()
+        if args.keep:
+            print("Bot directory kept at {0}".format(workdir), file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=24, help="number of simulated players")
+    parser.add_argument("--games", type=int, default=1, help="number of games to play")
+    parser.add_argument("--gamemode", default="default", help="game mode to force for each game")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the simulated players' choices")
+    parser.add_argument("--fakelag", type=float, default=0.0, help="seconds of penalty per line the bot sends")
+    parser.add_argument("--fakelag-burst", type=int, default=5, help="lines the bot can send before being lagged")
+    parser.add_argument("--client", choices=("blocking", "asyncio"), default="blocking", help="IRC client to use")
+    parser.add_argument("--night", type=int, default=60, help="night time limit in seconds")
+    parser.add_argument("--day", type=int, default=60, help="day time limit in seconds")
+    parser.add_argument("--timeout", type=float, default=900, help="give up if a step takes longer than this")
+    parser.add_argument("--keep", action="store_true", help="keep the bot's directory (with its log) afterwards")
+    parser.add_argument("--verbose", action="store_true", help="run the bot in verbose mode, logging all traffic")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
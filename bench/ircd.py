@@ -0,0 +1,734 @@
+"""A small IRC server for running the bot locally.
+
+This speaks just enough of the protocol for the bot to connect, authenticate,
+join its channel and run games: CAP negotiation (including SASL PLAIN),
+ISUPPORT, JOIN/PART/KICK/QUIT, channel and user MODEs, WHO and WHOX, WHOIS,
+NAMES, PING/PONG and message delivery. It is not a general purpose ircd;
+there is only a single server, channels are never +k or +l, and bans are
+accepted but not enforced.
+
+Besides real connections over TCP, the server can host simulated users
+(see SimUser) which live in the same event loop and are driven by a script.
+
+Clients can be subjected to fakelag much like on a real network: each line
+received adds to a per-client penalty, and once the penalty goes over the
+configured burst, the server stops reading from that client until enough
+time has passed. How much lag this caused is tracked in FakeIRCd.stats.
+"""
+
+import asyncio
+import base64
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+
+from oyoyo.parse import parse_irc_line
+
+__all__ = ["FakeIRCd", "Member", "Connection", "SimUser", "Channel", "SERVER_NAME"]
+
+SERVER_NAME = "irc.test"
+NETWORK_NAME = "FakeNet"
+
+CAPABILITIES = ("account-notify", "account-tag", "batch", "chghost", "extended-join",
+                "message-tags", "multi-prefix", "sasl")
+
+ISUPPORT = ("CASEMAPPING=rfc1459", "CHANTYPES=#", "PREFIX=(ov)@+", "STATUSMSG=@+",
+            "CHANMODES=beI,k,l,imnpst", "MODES=4", "NICKLEN=30", "CHANNELLEN=50",
+            "NETWORK=" + NETWORK_NAME, "EXCEPTS", "INVEX", "WHOX", "CPRIVMSG", "CNOTICE",
+            "TARGMAX=NAMES:1,LIST:1,KICK:1,WHOIS:1,PRIVMSG:4,NOTICE:4,ACCEPT:,MONITOR:")
+
+_PREFIX_MODES = {"o": "@", "v": "+"}
+_LIST_MODES = {"b": ("367", "368"), "e": ("348", "349"), "I": ("346", "347")}
+
+_lower_table = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\^", "abcdefghijklmnopqrstuvwxyz{}|~")
+
+def irc_lower(name: str) -> str:
+    return name.translate(_lower_table)
+
+def format_line(prefix: Optional[str], command: str, *params: str) -> str:
+    """Build a line from its parts; the final parameter is sent as a trailing parameter if needed."""
+    parts = []
+    if prefix:
+        parts.append(":" + prefix)
+    parts.append(command)
+    if params:
+        parts.extend(params[:-1])
+        last = params[-1]
+        if not last or " " in last or last.startswith(":"):
+            last = ":" + last
+        parts.append(last)
+    return " ".join(parts)
+
+class Member:
+    """A user connected to the server, either over the network or simulated."""
+
+    def __init__(self, server: "FakeIRCd"):
+        self.server = server
+        self.nick = "*"
+        self.ident = None # type: Optional[str]
+        self.host = "127.0.0.1"
+        self.realname = ""
+        self.account = None # type: Optional[str]
+        self.caps = set() # type: Set[str]
+        self.channels = OrderedDict() # type: OrderedDict[str, Channel]
+        self.registered = False
+        self.away = False
+        self.cap_negotiating = False
+        self.sasl_pending = False
+
+    @property
+    def prefix(self) -> str:
+        return "{0}!{1}@{2}".format(self.nick, self.ident, self.host)
+
+    def deliver(self, line: str):
+        raise NotImplementedError
+
+    def send(self, source: Optional[str], command: str, *params: str, sender: Optional["Member"] = None):
+        """Send a line to this member, adding any message tags it asked for."""
+        line = format_line(source, command, *params)
+        if sender is not None and sender.account and "account-tag" in self.caps:
+            line = "@account={0} {1}".format(sender.account, line)
+        self.server.stats["lines_out"] += 1
+        self.deliver(line)
+
+    def numeric(self, code: str, *params: str):
+        self.send(SERVER_NAME, code, self.nick, *params)
+
+    def close(self):
+        pass
+
+class Connection(Member):
+    """A client connected over TCP, such as the bot."""
+
+    def __init__(self, server, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(server)
+        self.reader = reader
+        self.writer = writer
+        peer = writer.get_extra_info("peername")
+        if peer:
+            self.host = peer[0]
+        self.penalty = 0.0
+        self.lines_in = 0
+        self.lag = 0.0
+
+    def deliver(self, line):
+        if not self.writer.is_closing():
+            self.writer.write(line.encode("utf-8") + b"\r\n")
+
+    def close(self):
+        self.writer.close()
+
+    async def _fakelag(self):
+        cost, burst = self.server.fakelag, self.server.fakelag_burst
+        if not cost:
+            return
+        now = time.monotonic()
+        self.penalty = max(self.penalty, now) + cost
+        delay = self.penalty - now - cost * burst
+        if delay > 0:
+            self.lag += delay
+            self.server.stats["lag"] += delay
+            self.server.stats["max_lag"] = max(self.server.stats["max_lag"], delay)
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        try:
+            while not self.writer.is_closing():
+                try:
+                    raw = await self.reader.readuntil(b"\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                self.lines_in += 1
+                self.server.stats["lines_in"] += 1
+                await self._fakelag()
+                self.server.process(self, raw)
+                try:
+                    await self.writer.drain()
+                except ConnectionError:
+                    break
+        finally:
+            self.server.disconnect(self, "Connection closed")
+            self.writer.close()
+
+class SimUser(Member):
+    """A simulated user living inside of the server.
+
+    Lines sent to the user are parsed and passed to every registered listener as
+    (tags, prefix, command, params), with the command named the same way as for the bot
+    (lowercase, and numerics by their name); they are also kept in history for inspection.
+    """
+
+    def __init__(self, server, nick: str, *, ident: str = "sim", host: Optional[str] = None,
+                 account: Optional[str] = None, realname: str = ""):
+        super().__init__(server)
+        self.nick = nick
+        self.ident = ident
+        self.host = host or "sim/" + nick
+        self.account = account
+        self.realname = realname or nick
+        self.caps = {"account-tag", "extended-join", "multi-prefix"}
+        self.registered = True
+        self.listeners = [] # type: List[Callable]
+        self.history = [] # type: List[tuple]
+
+    def deliver(self, line):
+        tags, prefix, command, params = parse_irc_line(line.encode("utf-8"))
+        item = (tags, prefix, command, params)
+        self.history.append(item)
+        for listener in list(self.listeners):
+            listener(self, *item)
+
+    def raw(self, line: str):
+        self.server.process(self, line.encode("utf-8"))
+
+    def join(self, channel: str):
+        self.raw("JOIN " + channel)
+
+    def part(self, channel: str, reason: str = ""):
+        self.raw(format_line(None, "PART", channel, reason))
+
+    def privmsg(self, target: str, text: str):
+        self.raw(format_line(None, "PRIVMSG", target, text))
+
+    def quit(self, reason: str = ""):
+        self.raw(format_line(None, "QUIT", reason))
+
+class Channel:
+    def __init__(self, name: str):
+        self.name = name
+        self.created = int(time.time())
+        self.members = OrderedDict() # type: OrderedDict[str, Member]
+        self.modes = {"n", "t"}
+        self.ops = set() # type: Set[Member]
+        self.voices = set() # type: Set[Member]
+        self.lists = {"b": [], "e": [], "I": []} # type: Dict[str, List[str]]
+        self.topic = ""
+
+    def prefixes(self, member: Member, multi: bool) -> str:
+        prefixes = ""
+        if member in self.ops:
+            prefixes += "@"
+        if member in self.voices and (multi or not prefixes):
+            prefixes += "+"
+        return prefixes
+
+    def broadcast(self, source: Member, command: str, *params: str, skip: Optional[Member] = None):
+        for member in list(self.members.values()):
+            if member is not skip:
+                member.send(source.prefix, command, *params, sender=source)
+
+class FakeIRCd:
+    """The server itself. Call start() from within a running event loop.
+
+    :param host: Address to listen on
+    :param port: Port to listen on; 0 picks a free one, see the port attribute once started
+    :param accounts: Account name -> password, for SASL PLAIN
+    :param fakelag: Seconds of penalty each line from a network client adds (0 to disable)
+    :param fakelag_burst: How many lines a client can send in quick succession before being lagged
+    """
+
+    def __init__(self, *, host: str = "127.0.0.1", port: int = 0, accounts: Optional[Dict[str, str]] = None,
+                 fakelag: float = 0.0, fakelag_burst: int = 5):
+        self.host = host
+        self.port = port
+        self.accounts = dict(accounts or {})
+        self.fakelag = fakelag
+        self.fakelag_burst = fakelag_burst
+        self.members = {} # type: Dict[str, Member]
+        self.channels = {} # type: Dict[str, Channel]
+        self.connections = [] # type: List[Connection]
+        self._tasks = set() # type: Set[asyncio.Task]
+        self.stats = {"lines_in": 0, "lines_out": 0, "lag": 0.0, "max_lag": 0.0}
+        self.started = time.time()
+        self._server = None # type: Optional[asyncio.AbstractServer]
+        self._registered = [] # type: List[asyncio.Future]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for conn in list(self.connections):
+            conn.close()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=5)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _accept(self, reader, writer):
+        conn = Connection(self, reader, writer)
+        self.connections.append(conn)
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await conn.run()
+        finally:
+            self._tasks.discard(task)
+
+    async def wait_registered(self) -> Connection:
+        """Wait for the next network client to finish registering."""
+        fut = asyncio.get_event_loop().create_future()
+        self._registered.append(fut)
+        return await fut
+
+    def add_user(self, nick: str, **kwargs) -> SimUser:
+        """Add a simulated user; see SimUser for the keyword arguments."""
+        if irc_lower(nick) in self.members:
+            raise ValueError("Nick {0} is already in use".format(nick))
+        user = SimUser(self, nick, **kwargs)
+        self.members[irc_lower(nick)] = user
+        return user
+
+    def get_channel(self, name: str) -> Optional[Channel]:
+        return self.channels.get(irc_lower(name))
+
+    def get_member(self, nick: str) -> Optional[Member]:
+        return self.members.get(irc_lower(nick))
+
+    def netsplit(self, users: List[Member], reason: str = "irc.test other.test"):
+        """Split the given simulated users off, in a netsplit batch for those who support it."""
+        peers = set()
+        for user in users:
+            for chan in user.channels.values():
+                peers.update(chan.members.values())
+        peers.difference_update(users)
+        ref = "split{0}".format(int(time.monotonic() * 1000))
+        for peer in peers:
+            if "batch" in peer.caps:
+                peer.send(SERVER_NAME, "BATCH", "+" + ref, "netsplit", *reason.split())
+        for user in users:
+            for chan in list(user.channels.values()):
+                for peer in chan.members.values():
+                    if peer in peers:
+                        line = format_line(user.prefix, "QUIT", reason)
+                        if "batch" in peer.caps:
+                            line = "@batch={0} {1}".format(ref, line)
+                        self.stats["lines_out"] += 1
+                        peer.deliver(line)
+            self._remove(user)
+        for peer in peers:
+            if "batch" in peer.caps:
+                peer.send(SERVER_NAME, "BATCH", "-" + ref)
+
+    ### Line processing
+
+    def process(self, member: Member, raw: bytes):
+        tags, prefix, command, params = parse_irc_line(raw)
+        if not command:
+            return
+        command = command.upper()
+        handler = getattr(self, "on_" + command.lower(), None)
+        if handler is None:
+            if member.registered:
+                member.numeric("421", command, "Unknown command")
+            return
+        if not member.registered and command not in ("CAP", "NICK", "USER", "PASS", "AUTHENTICATE", "PING", "QUIT"):
+            member.numeric("451", "You have not registered")
+            return
+        handler(member, params)
+
+    def disconnect(self, member: Member, reason: str):
+        if member in self.connections:
+            self.connections.remove(member)
+        if self.members.get(irc_lower(member.nick)) is member:
+            notified = set()
+            for chan in member.channels.values():
+                for peer in chan.members.values():
+                    if peer is not member and peer not in notified:
+                        notified.add(peer)
+                        peer.send(member.prefix, "QUIT", reason, sender=member)
+            self._remove(member)
+
+    def _remove(self, member: Member):
+        for chan in list(member.channels.values()):
+            self._leave(member, chan)
+        if self.members.get(irc_lower(member.nick)) is member:
+            del self.members[irc_lower(member.nick)]
+
+    def _leave(self, member: Member, chan: Channel):
+        chan.members.pop(irc_lower(member.nick), None)
+        chan.ops.discard(member)
+        chan.voices.discard(member)
+        member.channels.pop(irc_lower(chan.name), None)
+        if not chan.members:
+            del self.channels[irc_lower(chan.name)]
+
+    def _try_register(self, member: Member):
+        if member.registered or member.ident is None or member.nick == "*" or member.cap_negotiating:
+            return
+        member.registered = True
+        self.members[irc_lower(member.nick)] = member
+        member.numeric("001", "Welcome to the {0} IRC Network {1}".format(NETWORK_NAME, member.prefix))
+        member.numeric("002", "Your host is {0}, running a fake ircd".format(SERVER_NAME))
+        member.numeric("003", "This server was created for testing")
+        member.numeric("004", SERVER_NAME, "fakeircd", "iow", "beIklmnopstv")
+        tokens = list(ISUPPORT)
+        while tokens:
+            chunk, tokens = tokens[:12], tokens[12:]
+            member.numeric("005", *chunk, "are supported by this server")
+        member.numeric("375", "- {0} Message of the day -".format(SERVER_NAME))
+        member.numeric("372", "- Nothing to see here")
+        member.numeric("376", "End of /MOTD command.")
+        while self._registered and isinstance(member, Connection):
+            fut = self._registered.pop(0)
+            if not fut.done():
+                fut.set_result(member)
+                break
+
+    def on_cap(self, member, params):
+        if not params:
+            return
+        sub = params[0].upper()
+        if sub == "LS":
+            member.cap_negotiating = not member.registered
+            caps = []
+            for cap in CAPABILITIES:
+                if cap == "sasl" and len(params) > 1 and params[1] >= "302":
+                    cap = "sasl=PLAIN"
+                caps.append(cap)
+            member.send(SERVER_NAME, "CAP", member.nick, "LS", " ".join(caps))
+        elif sub == "LIST":
+            member.send(SERVER_NAME, "CAP", member.nick, "LIST", " ".join(sorted(member.caps)))
+        elif sub == "REQ" and len(params) > 1:
+            requested = params[1].split()
+            if all(cap.lstrip("-") in CAPABILITIES for cap in requested):
+                for cap in requested:
+                    if cap.startswith("-"):
+                        member.caps.discard(cap[1:])
+                    else:
+                        member.caps.add(cap)
+                member.send(SERVER_NAME, "CAP", member.nick, "ACK", params[1])
+            else:
+                member.send(SERVER_NAME, "CAP", member.nick, "NAK", params[1])
+        elif sub == "END":
+            member.cap_negotiating = False
+            self._try_register(member)
+
+    def on_authenticate(self, member, params):
+        if not params or "sasl" not in member.caps:
+            member.numeric("904", "SASL authentication failed")
+            return
+        if params[0].upper() == "PLAIN":
+            member.sasl_pending = True
+            member.send(None, "AUTHENTICATE", "+")
+            return
+        if params[0] == "*" or not member.sasl_pending:
+            member.sasl_pending = False
+            member.numeric("904", "SASL authentication failed")
+            return
+        member.sasl_pending = False
+        try:
+            authzid, authcid, password = base64.b64decode(params[0]).decode("utf-8").split("\0")
+        except ValueError:
+            member.numeric("904", "SASL authentication failed")
+            return
+        if self.accounts.get(authcid) != password:
+            member.numeric("904", "SASL authentication failed")
+            return
+        member.account = authcid
+        member.numeric("900", member.prefix, authcid, "You are now logged in as {0}".format(authcid))
+        member.numeric("903", "SASL authentication successful")
+
+    def on_pass(self, member, params):
+        pass
+
+    def on_nick(self, member, params):
+        if not params:
+            member.numeric("431", "No nickname given")
+            return
+        nick = params[0]
+        other = self.members.get(irc_lower(nick))
+        if other is not None and other is not member:
+            member.numeric("433", nick, "Nickname is already in use")
+            return
+        if not member.registered:
+            member.nick = nick
+            self._try_register(member)
+            return
+        old_prefix = member.prefix
+        del self.members[irc_lower(member.nick)]
+        notified = {member}
+        member.send(old_prefix, "NICK", nick)
+        for chan in member.channels.values():
+            for peer in chan.members.values():
+                if peer not in notified:
+                    notified.add(peer)
+                    peer.send(old_prefix, "NICK", nick, sender=member)
+            del chan.members[irc_lower(member.nick)]
+            chan.members[irc_lower(nick)] = member
+        member.nick = nick
+        self.members[irc_lower(nick)] = member
+
+    def on_user(self, member, params):
+        if member.registered or len(params) < 4:
+            return
+        member.ident = params[0]
+        member.realname = params[3]
+        self._try_register(member)
+
+    def on_ping(self, member, params):
+        member.send(SERVER_NAME, "PONG", SERVER_NAME, params[0] if params else "")
+
+    def on_pong(self, member, params):
+        pass
+
+    def on_away(self, member, params):
+        member.away = bool(params and params[0])
+
+    def on_quit(self, member, params):
+        reason = "Quit: " + params[0] if params and params[0] else "Client Quit"
+        member.send(None, "ERROR", "Closing Link: {0} ({1})".format(member.host, reason))
+        self.disconnect(member, reason)
+        member.close()
+
+    def on_join(self, member, params):
+        if not params:
+            return
+        for name in params[0].split(","):
+            if not name.startswith("#"):
+                member.numeric("403", name, "No such channel")
+                continue
+            chan = self.get_channel(name)
+            if chan is None:
+                chan = self.channels[irc_lower(name)] = Channel(name)
+                chan.ops.add(member)
+            elif irc_lower(member.nick) in chan.members:
+                continue
+            chan.members[irc_lower(member.nick)] = member
+            member.channels[irc_lower(chan.name)] = chan
+            for peer in chan.members.values():
+                if "extended-join" in peer.caps:
+                    peer.send(member.prefix, "JOIN", chan.name, member.account or "*", member.realname, sender=member)
+                else:
+                    peer.send(member.prefix, "JOIN", chan.name, sender=member)
+            if chan.topic:
+                member.numeric("332", chan.name, chan.topic)
+            self._names(member, chan)
+
+    def on_part(self, member, params):
+        if not params:
+            return
+        reason = params[1] if len(params) > 1 else ""
+        for name in params[0].split(","):
+            chan = self.get_channel(name)
+            if chan is None or irc_lower(member.nick) not in chan.members:
+                member.numeric("442", name, "You're not on that channel")
+                continue
+            if reason:
+                chan.broadcast(member, "PART", chan.name, reason)
+            else:
+                chan.broadcast(member, "PART", chan.name)
+            self._leave(member, chan)
+
+    def on_kick(self, member, params):
+        if len(params) < 2:
+            return
+        chan = self.get_channel(params[0])
+        target = self.get_member(params[1])
+        if chan is None or target is None or irc_lower(target.nick) not in chan.members:
+            member.numeric("441", params[1], params[0], "They aren't on that channel")
+            return
+        if member not in chan.ops:
+            member.numeric("482", chan.name, "You're not a channel operator")
+            return
+        chan.broadcast(member, "KICK", chan.name, target.nick, params[2] if len(params) > 2 else member.nick)
+        self._leave(target, chan)
+
+    def on_topic(self, member, params):
+        chan = self.get_channel(params[0]) if params else None
+        if chan is None:
+            return
+        if len(params) == 1:
+            if chan.topic:
+                member.numeric("332", chan.name, chan.topic)
+            else:
+                member.numeric("331", chan.name, "No topic is set")
+            return
+        chan.topic = params[1]
+        chan.broadcast(member, "TOPIC", chan.name, chan.topic)
+
+    def _names(self, member, chan):
+        multi = "multi-prefix" in member.caps
+        names = [chan.prefixes(m, multi) + m.nick for m in chan.members.values()]
+        while names:
+            chunk, names = names[:40], names[40:]
+            member.numeric("353", "=", chan.name, " ".join(chunk))
+        member.numeric("366", chan.name, "End of /NAMES list.")
+
+    def on_names(self, member, params):
+        chan = self.get_channel(params[0]) if params else None
+        if chan is None:
+            member.numeric("366", params[0] if params else "*", "End of /NAMES list.")
+            return
+        self._names(member, chan)
+
+    def on_mode(self, member, params):
+        if not params:
+            return
+        chan = self.get_channel(params[0])
+        if chan is None:
+            target = self.get_member(params[0])
+            if target is member and len(params) > 1:
+                member.send(member.prefix, "MODE", member.nick, params[1])
+            elif target is member:
+                member.numeric("221", "+i")
+            else:
+                member.numeric("403", params[0], "No such channel")
+            return
+        if len(params) == 1:
+            member.numeric("324", chan.name, "+" + "".join(sorted(chan.modes)))
+            member.numeric("329", chan.name, str(chan.created))
+            return
+
+        args = list(params[2:])
+        adding = True
+        applied = [] # type: List[tuple]
+        for c in params[1]:
+            if c in "+-":
+                adding = c == "+"
+            elif c in _LIST_MODES:
+                if not args:
+                    numeric, end = _LIST_MODES[c]
+                    for mask in chan.lists[c]:
+                        member.numeric(numeric, chan.name, mask)
+                    member.numeric(end, chan.name, "End of list")
+                    continue
+                mask = args.pop(0)
+                if member not in chan.ops:
+                    member.numeric("482", chan.name, "You're not a channel operator")
+                    continue
+                if adding and mask not in chan.lists[c]:
+                    chan.lists[c].append(mask)
+                elif not adding and mask in chan.lists[c]:
+                    chan.lists[c].remove(mask)
+                else:
+                    continue
+                applied.append((adding, c, mask))
+            elif c in _PREFIX_MODES:
+                if not args:
+                    continue
+                target = self.get_member(args.pop(0))
+                if member not in chan.ops:
+                    member.numeric("482", chan.name, "You're not a channel operator")
+                    continue
+                if target is None or irc_lower(target.nick) not in chan.members:
+                    continue
+                group = chan.ops if c == "o" else chan.voices
+                if adding:
+                    group.add(target)
+                else:
+                    group.discard(target)
+                applied.append((adding, c, target.nick))
+            else:
+                if c in "kl" and adding:
+                    args and args.pop(0)
+                if member not in chan.ops:
+                    member.numeric("482", chan.name, "You're not a channel operator")
+                    continue
+                if adding:
+                    chan.modes.add(c)
+                else:
+                    chan.modes.discard(c)
+                applied.append((adding, c, None))
+
+        # send applied changes back out, a few at a time like a real server
+        while applied:
+            chunk, applied = applied[:4], applied[4:]
+            modes, mode_args, sign = "", [], None
+            for adding, c, arg in chunk:
+                if sign is not adding:
+                    modes += "+" if adding else "-"
+                    sign = adding
+                modes += c
+                if arg is not None:
+                    mode_args.append(arg)
+            for peer in chan.members.values():
+                peer.send(member.prefix, "MODE", chan.name, modes, *mode_args)
+
+    def _who_reply(self, member, chan, target, fields, token):
+        status = "G" if target.away else "H"
+        if chan is not None:
+            status += chan.prefixes(target, "multi-prefix" in member.caps)
+        channame = chan.name if chan is not None else "*"
+        if fields is None:
+            member.numeric("352", channame, target.ident, target.host, SERVER_NAME, target.nick, status,
+                           "0 " + target.realname)
+            return
+        values = {"t": token, "c": channame, "u": target.ident, "i": "255.255.255.255", "h": target.host,
+                  "s": SERVER_NAME, "n": target.nick, "f": status, "d": "0", "l": "0",
+                  "a": target.account or "0", "o": "n/a", "r": target.realname}
+        reply = [values[f] for f in "tcuihsnfdlaor" if f in fields]
+        member.numeric("354", *reply)
+
+    def on_who(self, member, params):
+        if not params:
+            return
+        mask = params[0]
+        fields = token = None
+        if len(params) > 1 and params[1].startswith("%"):
+            fields, _, token = params[1][1:].partition(",")
+            token = token or "0"
+        chan = self.get_channel(mask)
+        if chan is not None:
+            for target in list(chan.members.values()):
+                self._who_reply(member, chan, target, fields, token)
+        else:
+            target = self.get_member(mask)
+            if target is not None:
+                shared = next(iter(target.channels.values()), None)
+                self._who_reply(member, shared, target, fields, token)
+        member.numeric("315", mask, "End of /WHO list.")
+
+    def on_whois(self, member, params):
+        if not params:
+            return
+        nick = params[-1]
+        target = self.get_member(nick)
+        if target is None:
+            member.numeric("401", nick, "No such nick/channel")
+        else:
+            member.numeric("311", target.nick, target.ident, target.host, "*", target.realname)
+            if target.channels:
+                multi = "multi-prefix" in member.caps
+                member.numeric("319", target.nick, " ".join(c.prefixes(target, multi) + c.name for c in target.channels.values()))
+            member.numeric("312", target.nick, SERVER_NAME, "Fake server")
+            if target.account:
+                member.numeric("330", target.nick, target.account, "is logged in as")
+        member.numeric("318", nick, "End of /WHOIS list.")
+
+    def _message(self, member, command, params, *, channel_target=None):
+        if len(params) < 2:
+            if command in ("PRIVMSG", "CPRIVMSG"):
+                member.numeric("412", "No text to send")
+            return
+        for target in params[0].split(","):
+            name = target.lstrip("@+")
+            chan = self.get_channel(name)
+            if chan is not None:
+                if irc_lower(member.nick) not in chan.members and "n" in chan.modes:
+                    member.numeric("404", chan.name, "Cannot send to channel")
+                    continue
+                chan.broadcast(member, command, target, params[-1], skip=member)
+                continue
+            peer = self.get_member(target)
+            if peer is None:
+                if command == "PRIVMSG":
+                    member.numeric("401", target, "No such nick/channel")
+                continue
+            peer.send(member.prefix, command, peer.nick, params[-1], sender=member)
+
+    def on_privmsg(self, member, params):
+        self._message(member, "PRIVMSG", params)
+
+    def on_notice(self, member, params):
+        self._message(member, "NOTICE", params)
+
+    def on_cprivmsg(self, member, params):
+        # CPRIVMSG nick #channel :text; the channel only serves to bypass flood limits on real networks
+        if len(params) > 2:
+            self._message(member, "PRIVMSG", [params[0], params[2]])
+
+    def on_cnotice(self, member, params):
+        if len(params) > 2:
+            self._message(member, "NOTICE", [params[0], params[2]])
@@ -0,0 +1,117 @@
+"""Replay a large burst of server lines through the IRC client's line framing.
+
+Usage: python -m bench.linebuffer [--lines 50000] [--repeat 5]
+
+The burst is a mix of WHO replies, NAMES replies and JOINs, like the bot gets
+when joining a big channel. It is read both from a fake socket which returns
+a fixed number of bytes per read and from a real socketpair, once with
+LineBuffer and once by appending each read to a bytes object and splitting it,
+as the blocking client used to. Both must produce the same lines; the best of
+a few runs is printed for each.
+"""
+
+import argparse
+import random
+import socket
+import threading
+import time
+
+from oyoyo.client import LineBuffer
+
+def make_burst(count, seed=13):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        k = rng.random()
+        if k < 0.5:
+            lines.append(b":irc.example.net 352 bot #lykos ~id%d host%d.example.org irc.example.net Nick%d H :0 Real Name %d" % (i, i, i, i))
+        elif k < 0.8:
+            lines.append(b":irc.example.net 353 bot = #lykos :" + b" ".join(b"@Nick%d" % j for j in range(i % 40)))
+        else:
+            lines.append(b":Nick%d!~id@host JOIN #lykos acct%d :Real Name" % (i, i))
+    return lines
+
+class FakeSocket:
+    """Hands out data at most chunk bytes at a time, like a socket whose peer sends in pieces."""
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+
+    def recv(self, size):
+        data = bytes(self.data[self.pos:self.pos + min(size, self.chunk)])
+        self.pos += len(data)
+        return data
+
+    def recv_into(self, buf):
+        count = min(len(buf), self.chunk, len(self.data) - self.pos)
+        buf[:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+def read_split(sock, out):
+    """Frame lines the way the blocking client did before LineBuffer."""
+    buffer = bytes()
+    while True:
+        data = sock.recv(1024)
+        if not data:
+            return
+        buffer += data
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        out.extend(lines)
+
+def read_linebuffer(sock, out):
+    buffer = LineBuffer()
+    while buffer.recv_from(sock):
+        out.extend(buffer.lines())
+
+def best_of(repeat, run):
+    return min(run() for _ in range(repeat))
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.linebuffer", description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=50000, help="number of lines in the burst")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the best time of")
+    args = parser.parse_args()
+
+    lines = make_burst(args.lines)
+    burst = b"".join(line + b"\r\n" for line in lines)
+    expected = [line + b"\r" for line in lines]
+    print("{0} lines, {1} bytes".format(len(lines), len(burst)))
+
+    readers = (("split", read_split), ("LineBuffer", read_linebuffer))
+
+    for chunk in (1024, 16384, 65536):
+        results = []
+        for name, reader in readers:
+            def run():
+                out = []
+                start = time.perf_counter()
+                reader(FakeSocket(burst, chunk), out)
+                elapsed = time.perf_counter() - start
+                assert out == expected, name
+                return elapsed
+            results.append("{0} {1:.1f}ms".format(name, best_of(args.repeat, run) * 1000))
+        print("{0:>5}-byte reads: {1}".format(chunk, ", ".join(results)))
+
+    results = []
+    for name, reader in readers:
+        def run():
+            a, b = socket.socketpair()
+            a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+            sender = threading.Thread(target=lambda: (a.sendall(burst), a.close()))
+            out = []
+            start = time.perf_counter()
+            sender.start()
+            reader(b, out)
+            elapsed = time.perf_counter() - start
+            sender.join()
+            b.close()
+            assert out == expected, name
+            return elapsed
+        results.append("{0} {1:.1f}ms".format(name, best_of(args.repeat, run) * 1000))
+    print("socketpair: {0}".format(", ".join(results)))
+
+if __name__ == "__main__":
+    main()
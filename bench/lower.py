@@ -0,0 +1,57 @@
+"""Time src.context.lower() against the way it used to build its translation table on every call.
+
+Usage: python -m bench.lower [--calls 200000]
+
+This imports the bot's src package, so it needs a botconfig.py like running the
+bot does. Before timing anything, lower() is checked against the old version for
+random nicks under every casemapping.
+"""
+
+import argparse
+import random
+import string
+import sys
+import timeit
+
+def old_lower(nick, casemapping):
+    mapping = {"[": "{", "]": "}", "\\": "|", "^": "~"}
+    if casemapping == "strict-rfc1459":
+        mapping.pop("^")
+    elif casemapping == "ascii":
+        mapping.clear()
+    return nick.lower().translate(str.maketrans(mapping))
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.lower", description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000, help="calls to time each version over")
+    args = parser.parse_args()
+
+    # src parses the command line itself
+    sys.argv = sys.argv[:1]
+    from src import context
+    from src.context import lower, Features
+
+    rng = random.Random(8)
+    chars = string.ascii_letters + "[]\\^{}|~_-`"
+    nicks = ["".join(rng.choice(chars) for _ in range(rng.randint(1, 16))) for _ in range(5000)]
+    for casemapping in ("rfc1459", "strict-rfc1459", "ascii"):
+        Features["CASEMAPPING"] = casemapping
+        for nick in nicks:
+            assert lower(nick) == old_lower(nick, casemapping), (casemapping, nick)
+            assert lower(nick, casemapping=casemapping) == old_lower(nick, casemapping), (casemapping, nick)
+    Features["CASEMAPPING"] = "rfc1459"
+    print("{0} nicks match under every casemapping".format(len(nicks)))
+
+    nick = nicks[0]
+    baseline = timeit.timeit(lambda: None, number=args.calls)
+    timings = (
+        ("old", lambda: old_lower(nick, "rfc1459")),
+        ("new, memo miss", lambda: (context._lower_state[1].clear(), lower(nick))),
+        ("new, memo hit", lambda: lower(nick)),
+    )
+    for name, func in timings:
+        elapsed = timeit.timeit(func, number=args.calls) - baseline
+        print("{0:<16} {1:.0f} ns/call".format(name, elapsed / args.calls * 1e9))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Simulated players for running whole games against the bot.
+
+The players keep things simple so that games finish quickly: during the day
+everyone votes for the same randomly chosen player, and at night every player
+who was told they can kill goes after a random player who isn't one of them.
+Everything else (seeing, guarding, ...) is left to time out. Choices are made
+from a seeded random number generator, so the players' side of a run is
+reproducible; the roles the bot hands out are still up to the bot.
+
+Who is alive is read straight from the server: the bot voices everyone
+playing when the game starts and devoices them as they die.
+"""
+
+import asyncio
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+from bench.ircd import FakeIRCd, SimUser, irc_lower
+
+__all__ = ["Swarm"]
+
+_formatting = re.compile(r"\x03(\d{1,2}(,\d{1,2})?)?|[\x02\x0f\x16\x1d\x1f]")
+
+class Swarm:
+    """A group of simulated players, plus an admin account to start games.
+
+    :param server: Server the players live on
+    :param bot: Nick of the bot
+    :param channel: Channel games are played in
+    :param count: Number of players
+    :param seed: Seed for every random choice the players make
+    """
+
+    def __init__(self, server: FakeIRCd, bot: str, channel: str, count: int, *, seed: int = 0):
+        self.server = server
+        self.bot = bot
+        self.channel = channel
+        self.rng = random.Random(seed)
+        self.admin = server.add_user("admin", account="admin")
+        self.players = [server.add_user("player{0:02}".format(i), account="player{0:02}".format(i))
+                        for i in range(1, count + 1)]
+        self.killers = set() # type: set
+        self.phase = "none"
+        self.days = 0
+        self.nights = 0
+        self.game_over = asyncio.Event()
+        self.ready = asyncio.Event()
+        # kind -> list of seconds between a player's command and the bot acting on it
+        self.latencies = {"join": [], "vote": []} # type: Dict[str, List[float]]
+        self._pending = {} # type: Dict[tuple, float]
+        self._night_target = None # type: Optional[SimUser]
+
+        self.admin.listeners.append(self._on_admin_line)
+        for player in self.players:
+            player.listeners.append(self._on_player_line)
+
+    def _channel_members(self) -> list:
+        chan = self.server.get_channel(self.channel)
+        return list(chan.members.values()) if chan is not None else []
+
+    def living(self) -> List[SimUser]:
+        chan = self.server.get_channel(self.channel)
+        if chan is None:
+            return []
+        return [p for p in self.players if p in chan.voices]
+
+    def _command(self, player: SimUser, kind: str, text: str, target: Optional[str] = None):
+        self._pending[(kind, player.nick.lower())] = time.monotonic()
+        player.privmsg(target or self.channel, text)
+
+    def _acted(self, kind: str, nick: str):
+        sent = self._pending.pop((kind, nick.lower()), None)
+        if sent is not None:
+            self.latencies[kind].append(time.monotonic() - sent)
+
+    ### Driving the game
+
+    async def wait_ready(self, timeout: float):
+        """Wait for the bot to join the channel, then join the admin and wait until the bot answers commands."""
+        deadline = time.monotonic() + timeout
+        # the first to join gets ops, and the bot needs those to voice players
+        while self.server.get_member(self.bot) not in self._channel_members():
+            if time.monotonic() > deadline:
+                raise TimeoutError("The bot did not join {0}".format(self.channel))
+            await asyncio.sleep(0.1)
+        self.admin.join(self.channel)
+        while not self.ready.is_set():
+            if time.monotonic() > deadline:
+                raise TimeoutError("The bot did not start answering commands")
+            self.admin.privmsg(self.channel, "!ping")
+            try:
+                await asyncio.wait_for(self.ready.wait(), 2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def play(self, gamemode: str = "default", timeout: float = 900):
+        """Play one game from start to finish."""
+        self.game_over.clear()
+        self.killers.clear()
+        self.days = self.nights = 0
+        for player in self.players:
+            if irc_lower(self.channel) not in player.channels:
+                player.join(self.channel)
+        for player in self.players:
+            self._command(player, "join", "!join")
+            await asyncio.sleep(0)
+        # give the bot a moment to catch up before forcing the game mode and starting
+        deadline = time.monotonic() + 60
+        while any(kind == "join" for kind, nick in self._pending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.admin.privmsg(self.channel, "!fgame " + gamemode)
+        self.admin.privmsg(self.channel, "!fstart")
+        await asyncio.wait_for(self.game_over.wait(), timeout)
+
+    def _day(self):
+        self.days += 1
+        living = self.living()
+        if len(living) < 2:
+            return
+        target = self.rng.choice(living)
+        others = [p for p in living if p is not target]
+        for player in living:
+            victim = target if player is not target else self.rng.choice(others)
+            self._command(player, "vote", "!vote " + victim.nick)
+
+    def _night(self):
+        self.nights += 1
+        living = self.living()
+        victims = [p for p in living if p not in self.killers]
+        self._night_target = self.rng.choice(victims) if victims else None
+        for player in living:
+            if player in self.killers:
+                self._kill(player)
+
+    def _kill(self, player: SimUser):
+        target = self._night_target
+        if target is not None and target is not player and target not in self.killers:
+            player.privmsg(self.bot, "kill " + target.nick)
+
+    ### Watching what the bot says
+
+    def _from_bot(self, prefix: Optional[str]) -> bool:
+        return prefix is not None and prefix.split("!")[0].lower() == self.bot.lower()
+
+    def _on_admin_line(self, user, tags, prefix, command, params):
+        if self._from_bot(prefix) and command in ("privmsg", "notice"):
+            self.ready.set()
+
+    def _on_player_line(self, player, tags, prefix, command, params):
+        if not self._from_bot(prefix):
+            return
+        if command == "mode" and params[0].lower() == self.channel.lower():
+            adding = True
+            args = iter(params[2:])
+            for c in params[1]:
+                if c in "+-":
+                    adding = c == "+"
+                elif c in "ov":
+                    nick = next(args, None)
+                    if c == "v" and adding and nick is not None and nick.lower() == player.nick.lower():
+                        self._acted("join", nick)
+            return
+        if command not in ("privmsg", "notice") or len(params) < 2:
+            return
+        text = _formatting.sub("", params[1])
+        if params[0].lower() == player.nick.lower():
+            # the bot tells players who can kill at night how to do so in their role PM,
+            # which is sent right after announcing the night
+            if "\"kill <nick>\"" in text and player not in self.killers:
+                self.killers.add(player)
+                if self.phase == "night":
+                    self._kill(player)
+            return
+        # only react to channel messages once, through the first player
+        if player is not self.players[0]:
+            return
+        for voter in re.findall(r"(\S+) (?:impatiently )?votes for ", text):
+            self._acted("vote", voter)
+        if "It is now nighttime" in text:
+            self.phase = "night"
+            asyncio.get_event_loop().call_soon(self._night)
+        elif "It is now daytime" in text:
+            self.phase = "day"
+            self._night_target = None
+            asyncio.get_event_loop().call_soon(self._day)
+        elif "Game lasted" in text:
+            self.phase = "none"
+            self.game_over.set()
@@ -15,6 +15,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import asyncio
 import socket
 import ssl
 import sys
@@ -24,8 +25,9 @@ import traceback
 import os
 import hashlib
 import hmac
+from collections import OrderedDict, deque
 
-from oyoyo.parse import parse_raw_irc_command
+from oyoyo.parse import parse_irc_line
 
 
 # Adapted from http://code.activestate.com/recipes/511490-implementation-of-the-token-bucket-algorithm/
@@ -63,9 +65,356 @@ class TokenBucket(object):
         self.timestamp = now
         return self._tokens
 
+    def fill(self):
+        """Fill the bucket up to capacity, e.g. for a new connection
+        the server has yet to count anything against."""
+        self._tokens = self.capacity
+        self.timestamp = time.time()
+
+    def time_until(self, tokens=1):
+        """Return how many seconds it will take until the given number
+        of tokens are available (0 if they already are)."""
+        return max(0.0, (tokens - self.tokens) * self.fill_rate)
+
     def __repr__(self):
         return "{self.__class__.__name__}(capacity={self.capacity}, fill rate={self.fill_rate}, tokens={self.tokens})".format(self=self)
 
+class RateController(object):
+    """Tune a TokenBucket at runtime from the round-trip time of our PINGs.
+
+    Servers with fakelag delay processing of a client's lines once it sends
+    faster than allowed, which shows up as a PING taking noticeably longer
+    than usual to be answered. Each sample is compared against the lowest
+    round-trip time seen recently: when it is well above that, the bucket is
+    tightened straight away (longer delay, smaller burst), and once several
+    samples in a row taken while we were actually using the bucket come back
+    clean it is loosened again a step at a time. The bucket is never moved
+    outside of the given delay and burst limits.
+
+    >>> ctl = RateController(bucket, min_delay=0.5, max_delay=4, min_burst=4, max_burst=30)
+    >>> ctl.sent(b"PING :1234\\r\\n")  # called by the writer as each line goes out
+    >>> ctl.pong("1234")               # called when the matching PONG arrives
+    """
+    gain = 0.125         # weight of a new sample in the smoothed round-trip time
+    margin = 0.25        # extra seconds over the baseline tolerated before backing off
+    patience = 3         # clean samples in a row needed before loosening the bucket
+    backoff = 1.5        # factor the delay grows by when we are being throttled
+    step = 0.9           # factor the delay shrinks by when loosening
+    max_pending = 16     # PINGs we keep track of before forgetting the oldest
+
+    def __init__(self, bucket, *, min_delay, max_delay, min_burst, max_burst):
+        self.bucket = bucket
+        self.min_delay = float(min_delay)
+        self.max_delay = float(max_delay)
+        self.min_burst = int(min_burst)
+        self.max_burst = int(max_burst)
+        self.rtt = None
+        self.srtt = None
+        self.baseline = None
+        self.throttled = 0
+        self._pending = OrderedDict()
+        self._starved = False
+        self._clean = 0
+        self._backed_off = 0.0
+        self._set_bucket(bucket.fill_rate, bucket.capacity)
+
+    def _set_bucket(self, delay, burst):
+        delay = min(self.max_delay, max(self.min_delay, delay))
+        burst = min(self.max_burst, max(self.min_burst, int(burst)))
+        self.bucket.fill_rate = delay
+        self.bucket.capacity = float(burst)
+        self.bucket._tokens = min(self.bucket._tokens, self.bucket.capacity)
+
+    def sent(self, line):
+        """Note that a line was written to the server."""
+        if self.bucket._tokens < 1:
+            # we're sending as fast as the bucket lets us, so samples now tell us whether it could go faster
+            self._starved = True
+        if line.startswith(b"PING :"):
+            self._pending[line[6:].rstrip()] = time.time()
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+    def pong(self, payload):
+        """Handle the PONG for one of our PINGs, returning its round-trip time
+        or None if we did not send it."""
+        if isinstance(payload, str):
+            payload = payload.encode("utf_8")
+        sent = self._pending.pop(payload, None)
+        if sent is None:
+            return None
+        rtt = time.time() - sent
+        self.rtt = rtt
+        if self.srtt is None:
+            self.srtt = self.baseline = rtt
+        else:
+            self.srtt += self.gain * (rtt - self.srtt)
+            if rtt < self.baseline:
+                self.baseline = rtt
+            else:
+                # let the baseline creep upwards so a lasting route change isn't mistaken for throttling
+                self.baseline += (rtt - self.baseline) / 64
+
+        busy = self._starved
+        self._starved = False
+        delay, burst = self.bucket.fill_rate, self.bucket.capacity
+        limit = self.baseline + max(self.baseline, self.margin)
+        if rtt > limit:
+            self._clean = 0
+            if sent >= self._backed_off:
+                # only back off once for lag caused before the last time we did so, as the
+                # server takes a while to work through the backlog we built up
+                self.throttled += 1
+                self._backed_off = time.time()
+                self._set_bucket(delay * self.backoff, burst // 2)
+        elif busy:
+            self._clean += 1
+            if self._clean >= self.patience:
+                self._clean = 0
+                self._set_bucket(delay * self.step, burst + 1)
+        return rtt
+
+# Priorities for outgoing lines, most urgent first
+PRIORITY_URGENT = 0   # PONG, connection registration and authentication
+PRIORITY_GAME = 1     # channel messages and other commands that affect the game
+PRIORITY_PRIVATE = 2  # private messages and notices, such as role PMs
+PRIORITY_LOW = 3      # relayed chatter, help text and anything else that can wait
+PRIORITY_QUIT = 4     # QUIT goes out after everything else that has been queued
+
+_urgent_commands = frozenset((b"PONG", b"PING", b"PASS", b"CAP", b"AUTHENTICATE", b"NICK", b"USER"))
+_message_commands = frozenset((b"PRIVMSG", b"NOTICE", b"CPRIVMSG", b"CNOTICE"))
+# commands whose first parameter may be a channel, and which have to stay in order with messages to it
+_channel_commands = frozenset((b"MODE", b"KICK"))
+
+def classify_line(line):
+    """ Return the default (priority, target) for an encoded line. """
+    parts = line.split(b" ", 2)
+    command = parts[0].upper()
+    if command in _urgent_commands:
+        return PRIORITY_URGENT, None
+    if command == b"QUIT":
+        return PRIORITY_QUIT, None
+    if command in _message_commands and len(parts) > 1:
+        target = parts[1]
+        # nicks can't contain either of these, but channel names (and STATUSMSG targets) will
+        if b"#" in target or b"&" in target:
+            return PRIORITY_GAME, target
+        return PRIORITY_PRIVATE, target
+    if command in _channel_commands and len(parts) > 1 and (b"#" in parts[1] or b"&" in parts[1]):
+        # queue +v/-v and kicks behind the announcements that go with them
+        return PRIORITY_GAME, parts[1]
+    return PRIORITY_GAME, None
+
+class OutboundQueue:
+    """ Thread-safe queue of lines waiting to be sent to the server.
+
+    Lines are sent in priority order. Within a priority, targets take turns, so that
+    a long reply to one user doesn't hold up messages to everyone else.
+
+    Lines queued with pack=True are PRIVMSGs or NOTICEs whose text may be joined to the
+    text of the line before it with a single space. When such lines to the same target
+    are waiting back to back, they are sent as one line where they fit, which costs a
+    single token instead of one each.
+    """
+    def __init__(self):
+        self._lanes = [OrderedDict() for _ in range(PRIORITY_QUIT + 1)]
+        self._count = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    def put(self, line, priority, target=None, pack=False):
+        with self._cond:
+            lane = self._lanes[priority]
+            if target not in lane:
+                lane[target] = deque()
+            lane[target].append((time.monotonic(), line, pack))
+            self._count += 1
+            self._cond.notify()
+
+    def _peek(self):
+        for lane in self._lanes:
+            if lane:
+                return next(iter(lane.values()))[0]
+        return None
+
+    def _pop(self, limit):
+        for lane in self._lanes:
+            if lane:
+                target, lines = next(iter(lane.items()))
+                queued, line, pack = lines.popleft()
+                self._count -= 1
+                if pack and limit:
+                    line = self._pack(line, lines, limit)
+                if lines:
+                    lane.move_to_end(target)
+                else:
+                    del lane[target]
+                return line
+        return None
+
+    def _pack(self, line, lines, limit):
+        # everything up to and including the " :" before the text, which every packed line must share
+        header = line[:line.index(b" :") + 2]
+        parts = [line[:-2]]
+        size = len(line)
+        while lines:
+            queued, following, pack = lines[0]
+            if not pack or not following.startswith(header):
+                break
+            text = following[len(header):-2]
+            if size + 1 + len(text) > limit:
+                break
+            lines.popleft()
+            self._count -= 1
+            parts.append(text)
+            size += 1 + len(text)
+        if len(parts) == 1:
+            return line
+        return b" ".join(parts) + b"\r\n"
+
+    def ready_in(self, window=0.0):
+        """ Return how many seconds to wait before taking the next line, or None if there is nothing queued.
+
+        A line that can be packed is held back until it has been queued for window seconds,
+        so that lines sent straight after it have a chance to be packed into it.
+        """
+        with self._cond:
+            head = self._peek()
+            if head is None:
+                return None
+            if not head[2] or self._closed:
+                return 0.0
+            return head[0] + window - time.monotonic()
+
+    def wait(self, window=0.0):
+        """ Wait until a line is ready to be taken. Returns False once the queue is closed and empty. """
+        with self._cond:
+            while True:
+                delay = self.ready_in(window)
+                if delay is None:
+                    if self._closed:
+                        return False
+                    self._cond.wait()
+                elif delay <= 0:
+                    return True
+                else:
+                    self._cond.wait(delay)
+
+    def get_nowait(self, limit=None):
+        """ Return the next line to send, or None if there is nothing queued.
+
+        If limit is given, packable lines behind it are joined to it up to that many bytes.
+        """
+        with self._cond:
+            return self._pop(limit)
+
+    def get(self, limit=None):
+        """ Wait for and return the next line to send, or None once the queue is closed. """
+        with self._cond:
+            while not self._count and not self._closed:
+                self._cond.wait()
+            return self._pop(limit)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def shutdown(self):
+        """ Close the queue and throw away everything in it, except QUIT lines, which are returned joined together. """
+        with self._cond:
+            quit = b"".join(line for lines in self._lanes[PRIORITY_QUIT].values() for queued, line, pack in lines)
+            for lane in self._lanes:
+                lane.clear()
+            self._count = 0
+            self._closed = True
+            self._cond.notify_all()
+            return quit
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        """ Return a list of (priority, queued lines, seconds the oldest line has been waiting) for each priority. """
+        now = time.monotonic()
+        with self._cond:
+            result = []
+            for priority, lane in enumerate(self._lanes):
+                depth = sum(len(x) for x in lane.values())
+                age = max((now - x[0][0] for x in lane.values()), default=0.0)
+                result.append((priority, depth, age))
+            return result
+
+class LineBuffer:
+    """ Splits data received from the server into lines.
+
+    Data is read straight into a reusable bytearray, and each search for the end of a line
+    resumes where the previous one stopped, so a large burst is neither copied around
+    repeatedly nor rescanned. Lines are returned without the trailing newline.
+    """
+    def __init__(self, size=65536, min_read=4096):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._min_read = min_read
+        self._start = 0 # start of data not yet returned as a line
+        self._scan = 0 # where to resume searching for a newline
+        self._end = 0 # end of the data received so far
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _make_room(self):
+        if len(self._buf) - self._end >= self._min_read:
+            return
+        pending = self._end - self._start
+        if self._start:
+            # move the incomplete line to the front
+            self._buf[:pending] = self._view[self._start:self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, pending
+        if len(self._buf) - self._end < self._min_read:
+            # a single line is longer than the buffer; resizing needs the view released first
+            self._view.release()
+            self._buf.extend(bytes(len(self._buf)))
+            self._view = memoryview(self._buf)
+
+    def recv_from(self, sock):
+        """ Read as much as is available (and fits) from the socket. Returns the number of bytes read. """
+        self._make_room()
+        count = sock.recv_into(self._view[self._end:])
+        self._end += count
+        return count
+
+    def feed(self, data):
+        """ Add already-received data to the buffer. """
+        data = memoryview(data)
+        while data:
+            self._make_room()
+            count = min(len(data), len(self._buf) - self._end)
+            self._buf[self._end:self._end + count] = data[:count]
+            self._end += count
+            data = data[count:]
+
+    def lines(self):
+        """ Return every complete line received so far. """
+        # only the newly received data needs to be searched; everything before it has no newline
+        last = self._buf.rfind(b"\n", self._scan, self._end)
+        if last < 0:
+            self._scan = self._end
+            return []
+        # a single copy of every complete line, split in one go
+        lines = bytes(self._view[self._start:last]).split(b"\n")
+        if last + 1 == self._end:
+            # nothing left over, so start from the beginning of the buffer again
+            self._start = self._scan = self._end = 0
+        else:
+            self._start = self._scan = last + 1
+        return lines
+
 class IRCClient:
     """ IRC Client class. This handles one connection to a server.
     This can be used either with or without IRCApp ( see connect() docs )
@@ -114,6 +463,20 @@ class IRCClient:
         self.stream_handler = lambda output, level=None: print(output)
 
         self.tokenbucket = TokenBucket(23, 1.73)
+        self.rate_control = None
+        self.pack_lines = False
+        self.pack_window = 0.0
+        self.outbound = OutboundQueue()
+        self.tags = {}
+        # open the connection again when it drops, instead of returning from mainLoop()
+        self.reconnect = False
+        self.reconnect_delay = 5
+        self.reconnect_max_delay = 300
+        self.disconnect_cb = None
+        self.quitting = False
+        # how long to wait for a line that is being sent when the connection is closed by us
+        self.flush_timeout = 5
+        self._writer_thread = None
 
         self.__dict__.update(kwargs)
         self.command_handler = cmd_handler
@@ -138,186 +501,315 @@ class IRCClient:
         In python 3, all args must be of type str or bytes, *BUT* if they are
           str they will be converted to bytes with the encoding specified by the
           'encoding' keyword argument (default 'utf8').
+
+        The line is queued and sent by a separate writer as the token bucket
+        allows, so this returns immediately. Pass priority= (one of the
+        PRIORITY_* constants) to override the default chosen by classify_line().
+        Pass pack=True for a PRIVMSG or NOTICE whose text may be joined onto
+        the previous line to the same target (see OutboundQueue).
         """
         with self.lock:
-            # Convert all args to bytes if not already
-            encoding = kwargs.get('encoding') or 'utf_8'
-            bargs = []
-            for i,arg in enumerate(args):
-                if isinstance(arg, str):
-                    bargs.append(bytes(arg, encoding))
-                elif isinstance(arg, bytes):
-                    bargs.append(arg)
-                elif arg is None:
-                    continue
-                else:
-                    raise Exception(('Refusing to send arg at index {1} of the args from '+
-                                     'provided: {0}').format(repr([(type(arg), arg)
-                                                                   for arg in args]), i))
+            self._queue_line(self._encode(args, kwargs), kwargs.get("priority"), kwargs.get("pack", False))
+
+    def _queue_line(self, msg, priority, pack=False):
+        default, target = classify_line(msg)
+        if default == PRIORITY_QUIT:
+            # the server closing the connection after this is what we asked for, don't reconnect
+            self.quitting = True
+        if priority is None:
+            priority = default
+        self.outbound.put(msg + bytes("\r\n", "utf_8"), priority, target, pack and self.pack_lines)
 
-            msg = bytes(" ", "utf_8").join(bargs)
-            logmsg = kwargs.get("log") or str(msg)[1:]
-            self.stream_handler('---> send {0}'.format(logmsg))
+    def _pack_limit(self):
+        """ Return how long a packed line may be, or None if we can't tell yet. """
+        if not self.pack_lines or not self.hostmask:
+            return None
+        # the server relays our lines with ":nick!ident@host " in front, and all of it has to fit into 512 bytes
+        source = ":{0}!{1}@{2} ".format(self.nickname, self.ident, self.hostmask)
+        return 512 - len(source.encode("utf_8"))
 
+    def _write_loop(self, outbound, sock):
+        """ Send queued lines as the token bucket allows; runs in its own thread.
+
+        The queue and socket are those of one connection, so a writer left over from
+        a connection that dropped can never send on the one replacing it.
+        """
+        while True:
+            if not outbound.wait(self.pack_window):
+                return
             while not self.tokenbucket.consume(1):
-                time.sleep(0.3)
-            self.socket.send(msg + bytes("\r\n", "utf_8"))
+                time.sleep(self.tokenbucket.time_until(1))
+            # only the writer takes lines out of the queue, so there is still one waiting for us unless
+            # it was shut down; taking it after getting a token lets anything queued behind it meanwhile be packed in
+            line = outbound.get_nowait(self._pack_limit())
+            if line is None:
+                return
+            try:
+                sock.sendall(line)
+            except OSError:
+                # the reading side will notice the connection is gone and deal with it
+                if not outbound.closed: # otherwise it already has
+                    sys.stderr.write(traceback.format_exc())
+                return
+            if self.rate_control is not None:
+                self.rate_control.sent(line)
 
-    def connect(self):
-        """ initiates the connection to the server set in self.host:self.port
-        and returns a generator object.
+    def _encode(self, args, kwargs):
+        """ Join the arguments to send() into a single line and log it. """
+        # Convert all args to bytes if not already
+        encoding = kwargs.get('encoding') or 'utf_8'
+        bargs = []
+        for i,arg in enumerate(args):
+            if isinstance(arg, str):
+                bargs.append(bytes(arg, encoding))
+            elif isinstance(arg, bytes):
+                bargs.append(arg)
+            elif arg is None:
+                continue
+            else:
+                raise Exception(('Refusing to send arg at index {1} of the args from '+
+                                 'provided: {0}').format(repr([(type(arg), arg)
+                                                               for arg in args]), i))
 
-        >>> cli = IRCClient(my_handler, host="irc.libera.chat", port=6667)
-        >>> g = cli.connect()
-        >>> while 1:
-        ...     next(g)
+        msg = bytes(" ", "utf_8").join(bargs)
+        logmsg = kwargs.get("log") or str(msg)[1:]
+        self.stream_handler('---> send {0}'.format(logmsg))
+        return msg
 
-        """
-        try:
-            retries = 0
-            while True:
-                try:
-                    self.socket = socket.create_connection(
-                        ("{0}".format(self.host), self.port),
-                        source_address=("{0}".format(self.bindhost), 0))
-                    break
-                except socket.error as e:
-                    retries += 1
-                    self.stream_handler('Error: {0}'.format(e), level="warning")
-                    if retries > 3:
-                        sys.exit(1)
+    def _ssl_context(self):
+        """ Build the TLS context to connect with, according to our settings. """
+        ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
 
-            if self.use_ssl:
-                ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        if self.cipher_list:
+            try:
+                ctx.set_ciphers(self.cipher_list)
+            except Exception:
+                self.stream_handler("No ciphers could be selected from the cipher list. TLS is not available.", level="warning")
+                self.stream_handler("Use `openssl ciphers' to see which ciphers are available on this system.", level="warning")
+                raise
 
-                if self.cipher_list:
-                    try:
-                        ctx.set_ciphers(self.cipher_list)
-                    except Exception:
-                        self.stream_handler("No ciphers could be selected from the cipher list. TLS is not available.", level="warning")
-                        self.stream_handler("Use `openssl ciphers' to see which ciphers are available on this system.", level="warning")
-                        raise
+        # explicitly disable old protocols
+        ctx.options |= ssl.OP_NO_SSLv2
+        ctx.options |= ssl.OP_NO_SSLv3
+        ctx.options |= ssl.OP_NO_TLSv1
 
-                # explicitly disable old protocols
-                ctx.options |= ssl.OP_NO_SSLv2
-                ctx.options |= ssl.OP_NO_SSLv3
-                ctx.options |= ssl.OP_NO_TLSv1
+        # explicitly disable compression (CRIME attack)
+        ctx.options |= ssl.OP_NO_COMPRESSION
 
-                # explicitly disable compression (CRIME attack)
-                ctx.options |= ssl.OP_NO_COMPRESSION
+        # TLS session tickets harm forward secrecy
+        ctx.options |= ssl.OP_NO_TICKET
 
-                # TLS session tickets harm forward secrecy
-                ctx.options |= ssl.OP_NO_TICKET
+        if self.cert_verify and not self.cert_fp:
+            ctx.verify_mode = ssl.CERT_REQUIRED
 
-                if self.cert_verify and not self.cert_fp:
-                    ctx.verify_mode = ssl.CERT_REQUIRED
+            if not self.cert_fp:
+                ctx.check_hostname = True
 
-                    if not self.cert_fp:
-                        ctx.check_hostname = True
+            ctx.load_default_certs()
+        elif not self.cert_verify and not self.cert_fp:
+            self.stream_handler("**NOT** validating the server's TLS certificate! Set SSL_VERIFY or SSL_CERTFP in botconfig.py.", level="warning")
 
-                    ctx.load_default_certs()
-                elif not self.cert_verify and not self.cert_fp:
-                    self.stream_handler("**NOT** validating the server's TLS certificate! Set SSL_VERIFY or SSL_CERTFP in botconfig.py.", level="warning")
+        if self.client_certfile:
+            # if client_keyfile is not specified, the ssl module will look to the client_certfile for it.
+            try:
+                # specify blank password to ensure that encrypted certs will outright fail rather than prompting for password on stdin
+                # in a scenario where a user does !update or !restart, they will be unable to type in such a password and effectively kill the bot
+                # until someone can SSH in to restart it via CLI.
+                ctx.load_cert_chain(self.client_certfile, self.client_keyfile, password="")
+                self.stream_handler("Connecting with a TLS client certificate", level="info")
+            except Exception as error:
+                self.stream_handler("Unable to load client cert/key pair: {0}".format(error), level="error")
+                raise
 
-                if self.client_certfile:
-                    # if client_keyfile is not specified, the ssl module will look to the client_certfile for it.
-                    try:
-                        # specify blank password to ensure that encrypted certs will outright fail rather than prompting for password on stdin
-                        # in a scenario where a user does !update or !restart, they will be unable to type in such a password and effectively kill the bot
-                        # until someone can SSH in to restart it via CLI.
-                        ctx.load_cert_chain(self.client_certfile, self.client_keyfile, password="")
-                        self.stream_handler("Connecting with a TLS client certificate", level="info")
-                    except Exception as error:
-                        self.stream_handler("Unable to load client cert/key pair: {0}".format(error), level="error")
+        return ctx
+
+    def _check_cert_fp(self, peercert):
+        """ Make sure the server's certificate matches one of the pinned fingerprints, if any. """
+        if self.cert_fp:
+            valid_fps = set(fp.replace(":", "").lower() for fp in self.cert_fp)
+            h = hashlib.new("sha256")
+            h.update(peercert)
+            peercertfp = h.hexdigest()
+
+            if peercertfp not in valid_fps:
+                self.stream_handler("Certificate fingerprint {0} did not match any expected fingerprints".format(peercertfp), level="error")
+                raise ssl.CertificateError("Certificate fingerprint {0} did not match any expected fingerprints".format(peercertfp))
+            self.stream_handler("Server certificate fingerprint matched {0}".format(peercertfp), level="info")
+
+    def _register(self):
+        """ Send the initial registration commands and run the connect callback. """
+        self.send("CAP LS 302")
+
+        if self.server_pass and "{password}" in self.server_pass and self.password and not self.sasl_auth:
+            # If not using SASL, try to send the NickServ password during connect via PASS
+            message = "PASS :{0}".format(self.server_pass).format(
+                account=self.authname if self.authname else self.nickname,
+                password=self.password)
+            self.send(message, log="PASS :[redacted]")
+        elif self.server_pass and "{password}" not in self.server_pass:
+            # If {password} isn't present, then we likely have a connect password, so send that regardless of SASL
+            message = "PASS :{0}".format(self.server_pass)
+            self.send(message, log="PASS :[redacted]")
+
+        self.send("NICK", self.nickname)
+        self.user(self.ident, self.real_name)
+
+        if self.connect_cb:
+            try:
+                self.connect_cb(self)
+            except Exception as e:
+                sys.stderr.write(traceback.format_exc())
+                raise e
+
+    def _handle_line(self, el):
+        """ Parse a single line received from the server and dispatch it to the command handler.
+
+        While the handler runs, self.tags holds the IRCv3 message tags sent with the line.
+        """
+        tags, prefix, command, fargs = parse_irc_line(el)
+
+        try:
+            self.stream_handler("<--- receive {0} {1} ({2})".format(prefix, command, ", ".join(fargs)), level="debug")
+            self.tags = tags
+            if command in self.command_handler:
+                self.command_handler[command](self, prefix,*fargs)
+            elif "" in self.command_handler:
+                self.command_handler[""](self, prefix, command, *fargs)
+        except Exception as e:
+            sys.stderr.write(traceback.format_exc())
+            raise e  # ?
+        finally:
+            self.tags = {}
+
+    def _open_socket(self):
+        """ Open the connection to the server, trying a few times before giving up. """
+        retries = 0
+        while True:
+            try:
+                self.socket = socket.create_connection(
+                    ("{0}".format(self.host), self.port),
+                    source_address=("{0}".format(self.bindhost), 0))
+                break
+            except socket.error as e:
+                retries += 1
+                self.stream_handler('Error: {0}'.format(e), level="warning")
+                if retries > 3:
+                    if self.reconnect:
                         raise
+                    sys.exit(1)
 
-                try:
-                    self.socket = ctx.wrap_socket(self.socket, server_hostname=self.host)
-                except Exception as error:
-                    self.stream_handler("Could not connect with TLS: {0}".format(error), level="error")
-                    raise
+        if self.use_ssl:
+            ctx = self._ssl_context()
 
-                if self.cert_fp:
-                    valid_fps = set(fp.replace(":", "").lower() for fp in self.cert_fp)
-                    peercert = self.socket.getpeercert(True)
-                    h = hashlib.new("sha256")
-                    h.update(peercert)
-                    peercertfp = h.hexdigest()
+            try:
+                self.socket = ctx.wrap_socket(self.socket, server_hostname=self.host)
+            except Exception as error:
+                self.stream_handler("Could not connect with TLS: {0}".format(error), level="error")
+                raise
 
-                    if peercertfp not in valid_fps:
-                        self.stream_handler("Certificate fingerprint {0} did not match any expected fingerprints".format(peercertfp), level="error")
-                        raise ssl.CertificateError("Certificate fingerprint {0} did not match any expected fingerprints".format(peercertfp))
-                    self.stream_handler("Server certificate fingerprint matched {0}".format(peercertfp), level="info")
+            self._check_cert_fp(self.socket.getpeercert(True))
+            self.stream_handler("Connected with cipher {0}".format(self.socket.cipher()[0]), level="info")
 
-                self.stream_handler("Connected with cipher {0}".format(self.socket.cipher()[0]), level="info")
+        if not self.blocking:
+            self.socket.setblocking(0)
 
-            if not self.blocking:
-                self.socket.setblocking(0)
+    def _can_reconnect(self):
+        return self.reconnect and not self._end and not self.quitting
 
-            self.send("CAP LS 302")
+    def _disconnected(self):
+        """ Clean up after a connection dropped, ready for the next one. """
+        self.outbound.close()
+        # anything queued while we were away was meant for a connection that no longer exists
+        self.outbound = OutboundQueue()
+        self.tokenbucket.fill()
+        if self.disconnect_cb:
+            try:
+                self.disconnect_cb(self)
+            except Exception as e:
+                sys.stderr.write(traceback.format_exc())
+                raise e
 
-            if self.server_pass and "{password}" in self.server_pass and self.password and not self.sasl_auth:
-                # If not using SASL, try to send the NickServ password during connect via PASS
-                message = "PASS :{0}".format(self.server_pass).format(
-                    account=self.authname if self.authname else self.nickname,
-                    password=self.password)
-                self.send(message, log="PASS :[redacted]")
-            elif self.server_pass and "{password}" not in self.server_pass:
-                # If {password} isn't present, then we likely have a connect password, so send that regardless of SASL
-                message = "PASS :{0}".format(self.server_pass)
-                self.send(message, log="PASS :[redacted]")
+    def _backoff(self, delay, opened):
+        """ Return how long to wait before reconnecting, and the wait to use after that. """
+        if time.monotonic() - opened > self.reconnect_max_delay:
+            # the connection had been up for a good while, so this isn't a server refusing us over and over
+            delay = self.reconnect_delay
+        self.stream_handler("Reconnecting in {0} seconds".format(delay), level="warning")
+        return delay, min(delay * 2, self.reconnect_max_delay)
 
-            self.send("NICK", self.nickname)
-            self.user(self.ident, self.real_name)
+    def connect(self):
+        """ initiates the connection to the server set in self.host:self.port
+        and returns a generator object.
 
-            if self.connect_cb:
-                try:
-                    self.connect_cb(self)
-                except Exception as e:
-                    sys.stderr.write(traceback.format_exc())
-                    raise e
+        >>> cli = IRCClient(my_handler, host="irc.libera.chat", port=6667)
+        >>> g = cli.connect()
+        >>> while 1:
+        ...     next(g)
 
-            buffer = bytes()
-            while not self._end:
+        If reconnect is set, a connection that drops (without us having sent
+        QUIT) is opened again, waiting reconnect_delay seconds at first and
+        twice as long after each further attempt, up to reconnect_max_delay.
+        disconnect_cb is called with the client each time before that happens,
+        and connect_cb once the new connection is registering, as usual.
+        """
+        try:
+            delay = self.reconnect_delay
+            while True:
+                opened = time.monotonic()
                 try:
-                    buffer += self.socket.recv(1024)
-                except socket.error as e:
-                    if False and not self.blocking and e.errno == 11:
-                        pass
-                    else:
-                        sys.stderr.write(traceback.format_exc())
-                        raise e
+                    self._open_socket()
+                except OSError as e:
+                    if not self._can_reconnect():
+                        raise
+                    self.stream_handler("Could not connect to the server: {0}".format(e), level="warning")
                 else:
-                    data = buffer.split(bytes("\n", "utf_8"))
-                    buffer = data.pop()
-
-                    for el in data:
-                        prefix, command, args = parse_raw_irc_command(el)
+                    self._writer_thread = threading.Thread(target=self._write_loop, args=(self.outbound, self.socket),
+                                                           name="irc-writer", daemon=True)
+                    self._writer_thread.start()
+                    self._register()
 
+                    buffer = LineBuffer()
+                    while not self._end:
                         try:
-                            enc = "utf8"
-                            fargs = [arg.decode(enc) for arg in args if isinstance(arg,bytes)]
-                        except UnicodeDecodeError:
-                            enc = "latin1"
-                            fargs = [arg.decode(enc) for arg in args if isinstance(arg,bytes)]
+                            count = buffer.recv_from(self.socket)
+                        except socket.error as e:
+                            if False and not self.blocking and e.errno == 11:
+                                pass
+                            elif self._can_reconnect():
+                                self.stream_handler("Lost connection to the server: {0}".format(e), level="warning")
+                                break
+                            else:
+                                sys.stderr.write(traceback.format_exc())
+                                raise e
+                        else:
+                            if not count:
+                                self.stream_handler("Connection closed by the server", level="warning")
+                                break
+                            for el in buffer.lines():
+                                self._handle_line(el)
+                        yield True
 
-                        try:
-                            largs = list(args)
-                            if prefix is not None:
-                                prefix = prefix.decode(enc)
-                            self.stream_handler("<--- receive {0} {1} ({2})".format(prefix, command, ", ".join(fargs)), level="debug")
-                            # for i,arg in enumerate(largs):
-                                # if arg is not None: largs[i] = arg.decode(enc)
-                            if command in self.command_handler:
-                                self.command_handler[command](self, prefix,*fargs)
-                            elif "" in self.command_handler:
-                                self.command_handler[""](self, prefix, command, *fargs)
-                        except Exception as e:
-                            sys.stderr.write(traceback.format_exc())
-                            raise e  # ?
-                yield True
+                if not self._can_reconnect():
+                    break
+                # stop the writer before closing the socket under it
+                self._disconnected()
+                if self.socket:
+                    self.socket.close()
+                wait, delay = self._backoff(delay, opened)
+                time.sleep(wait)
         finally:
+            quit = self.outbound.shutdown()
+            writing = self._writer_thread is not None and self._writer_thread.is_alive()
+            if writing:
+                self._writer_thread.join(self.flush_timeout)
+                writing = self._writer_thread.is_alive()
             if self.socket:
+                if quit and not writing:
+                    # the writer is gone, so this can't end up in the middle of another line
+                    try:
+                        self.socket.sendall(quit)
+                    except OSError:
+                        pass
                 self.stream_handler('closing socket')
                 self.socket.close()
                 yield False
@@ -359,25 +851,25 @@ class IRCClient:
             cmdtext = command.format(account=account, password=passwd)
             logtext = command.format(account=account, password="[redacted]")
             msg = "PRIVMSG {0} :{1}"
-            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext))
+            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext), priority=PRIORITY_URGENT)
     def ns_ghost(self, nick, password, nickserv, command):
         if command:
             cmdtext = command.format(nick=nick, password=password)
             logtext = command.format(nick=nick, password="[redacted]")
             msg = "PRIVMSG {0} :{1}"
-            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext))
+            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext), priority=PRIORITY_URGENT)
     def ns_release(self, nick, password, nickserv="NickServ", command="RELEASE {nick}"):
         if command:
             cmdtext = command.format(nick=nick, password=password)
             logtext = command.format(nick=nick, password="[redacted]")
             msg = "PRIVMSG {0} :{1}"
-            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext))
+            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext), priority=PRIORITY_URGENT)
     def ns_regain(self, nick, password, nickserv="NickServ", command="REGAIN {nick}"):
         if command:
             cmdtext = command.format(nick=nick, password=password)
             logtext = command.format(nick=nick, password="[redacted]")
             msg = "PRIVMSG {0} :{1}"
-            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext))
+            self.send(msg.format(nickserv, cmdtext), log=msg.format(nickserv, logtext), priority=PRIORITY_URGENT)
     def user(self, ident, rname):
         self.send("USER", ident, "0", "*", ":{0}".format(rname or ident))
     def mainLoop(self):
@@ -387,4 +879,165 @@ class IRCClient:
                 self.stream_handler("Calling sys.exit()...", level="warning")
                 sys.exit()
 
+class AsyncIRCClient(IRCClient):
+    """ IRC client which runs its connection on an asyncio event loop.
+
+    This takes the same arguments and calls the command handler the same way as IRCClient,
+    but reading from and writing to the server happen in separate tasks. send() only queues
+    the line, so a command sending a burst of messages no longer stops the bot from reading
+    the socket while it waits for tokens. send() may be called from any thread.
+    """
+
+    # maximum length of a single line we accept from the server, including message tags
+    line_limit = 65536
+
+    def __init__(self, cmd_handler, **kwargs):
+        super().__init__(cmd_handler, **kwargs)
+        self.loop = None
+        self._wakeup = None
+
+    def send(self, *args, **kwargs):
+        with self.lock:
+            self._queue_line(self._encode(args, kwargs), kwargs.get("priority"), kwargs.get("pack", False))
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass # loop is closed; same as a line queued after the blocking client disconnects
+
+    async def _writer(self, writer):
+        while True:
+            delay = self.outbound.ready_in(self.pack_window)
+            if delay is None:
+                # send() sets this after queueing, so nothing can slip in between here and waiting
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            while not self.tokenbucket.consume(1):
+                await asyncio.sleep(self.tokenbucket.time_until(1))
+            line = self.outbound.get_nowait(self._pack_limit())
+            if line is None:
+                continue
+            writer.write(line)
+            try:
+                await writer.drain()
+            except OSError:
+                if not self._can_reconnect():
+                    raise
+                # the reader notices the connection is gone as well and reports it
+                await asyncio.Event().wait()
+            if self.rate_control is not None:
+                self.rate_control.sent(line)
+
+    async def _reader(self, reader):
+        skip = False
+        while not self._end:
+            try:
+                line = await reader.readuntil(bytes("\n", "utf_8"))
+            except asyncio.LimitOverrunError as e:
+                # throw away what we have of the line, and the rest of it once it ends
+                await reader.readexactly(e.consumed)
+                if not skip:
+                    self.stream_handler("Ignoring a line longer than {0} bytes from the server".format(self.line_limit), level="warning")
+                skip = True
+                continue
+            except asyncio.IncompleteReadError:
+                self.stream_handler("Connection closed by the server", level="warning")
+                return
+            except OSError as e: # includes ssl.SSLError
+                if not self._can_reconnect():
+                    raise
+                self.stream_handler("Lost connection to the server: {0}".format(e), level="warning")
+                return
+            if skip:
+                skip = False
+                continue
+            self._handle_line(line[:-1])
+
+    async def _open(self):
+        ctx = None
+        if self.use_ssl:
+            ctx = self._ssl_context()
+
+        retries = 0
+        while True:
+            try:
+                return await asyncio.open_connection(
+                    self.host, self.port,
+                    ssl=ctx,
+                    server_hostname=self.host if ctx else None,
+                    local_addr=(self.bindhost, 0) if self.bindhost else None,
+                    limit=self.line_limit)
+            except ssl.SSLError as error:
+                self.stream_handler("Could not connect with TLS: {0}".format(error), level="error")
+                raise
+            except OSError as e:
+                retries += 1
+                self.stream_handler('Error: {0}'.format(e), level="warning")
+                if retries > 3:
+                    if self.reconnect:
+                        raise
+                    sys.exit(1)
+
+    async def run(self):
+        """ Connect to the server and process messages until the connection is closed.
+
+        If reconnect is set, a dropped connection is opened again the same way as for
+        IRCClient.connect().
+        """
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        delay = self.reconnect_delay
+        while True:
+            opened = time.monotonic()
+            try:
+                reader, writer = await self._open()
+            except OSError as e:
+                if not self._can_reconnect():
+                    raise
+                self.stream_handler("Could not connect to the server: {0}".format(e), level="warning")
+            else:
+                await self._run_connection(reader, writer)
+            if not self._can_reconnect():
+                return
+            self._disconnected()
+            wait, delay = self._backoff(delay, opened)
+            await asyncio.sleep(wait)
+
+    async def _run_connection(self, reader, writer):
+        tasks = []
+        try:
+            self.socket = writer.get_extra_info("socket")
+            if self.use_ssl:
+                self._check_cert_fp(writer.get_extra_info("ssl_object").getpeercert(True))
+                self.stream_handler("Connected with cipher {0}".format(writer.get_extra_info("cipher")[0]), level="info")
+
+            tasks.append(asyncio.ensure_future(self._writer(writer)))
+            self._register()
+            tasks.append(asyncio.ensure_future(self._reader(reader)))
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # re-raise anything that went wrong in either task
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            quit = self.outbound.shutdown() if not self._can_reconnect() else None
+            if quit:
+                writer.write(quit)
+                try:
+                    await asyncio.wait_for(writer.drain(), self.flush_timeout)
+                except (OSError, asyncio.TimeoutError):
+                    pass
+            self.stream_handler('closing socket')
+            writer.close()
+
+    def mainLoop(self):
+        asyncio.run(self.run())
+        self.stream_handler("Calling sys.exit()...", level="warning")
+        sys.exit()
+
 # vim: set sw=4 expandtab:
@@ -18,6 +18,96 @@
 from oyoyo.ircevents import numeric_events
 
 
+# raw command as sent by the server -> name we dispatch it as; numerics are translated, everything
+# else is lowercased. Filled in as new commands are seen, so each line only needs a single lookup
+_command_names = {key.decode("ascii"): value for key, value in numeric_events.items()}
+
+_tag_escapes = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+def _command_name(command):
+    try:
+        return _command_names[command]
+    except KeyError:
+        pass
+    name = command.lower()
+    if len(_command_names) < 1024: # don't let a misbehaving server grow this forever
+        _command_names[command] = name
+    return name
+
+def _unescape_tag_value(value):
+    if "\\" not in value:
+        return value
+    out = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == "\\":
+            i += 1
+            if i < len(value):
+                # unknown escapes just drop the backslash; a trailing lone backslash is dropped entirely
+                out.append(_tag_escapes.get(value[i], value[i]))
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+def parse_tags(raw):
+    """ Parse the IRCv3 message tags part of a line (without the leading @) into a dict.
+
+    Tags without a value are given an empty string as their value.
+    """
+    tags = {}
+    for tag in raw.split(";"):
+        if not tag:
+            continue
+        key, _, value = tag.partition("=")
+        tags[key] = _unescape_tag_value(value)
+    return tags
+
+def parse_irc_line(line):
+    """ Parse a single line from the server in one pass, and return a tuple of
+    (tags, prefix, command, args), all of them decoded.
+
+    The line is decoded as UTF-8 once, falling back to latin-1 if that fails. tags is a
+    (possibly empty) dict of IRCv3 message tags and prefix is None if the line has none.
+    command has numerics translated to their names and is otherwise lowercased, as with
+    parse_raw_irc_command(). The trailing parameter, if any, is the last element of args.
+    Leading spaces and the trailing CR/LF are ignored, and only spaces separate the parameters.
+    """
+    if not isinstance(line, str):
+        try:
+            line = line.decode("utf_8")
+        except UnicodeDecodeError:
+            line = line.decode("latin_1")
+    line = line.rstrip("\r\n").lstrip(" ")
+
+    tags = {}
+    if line.startswith("@"):
+        raw, _, line = line.partition(" ")
+        tags = parse_tags(raw[1:])
+        line = line.lstrip(" ")
+
+    prefix = None
+    if line.startswith(":"):
+        prefix, _, line = line.partition(" ")
+        prefix = prefix[1:]
+        line = line.lstrip(" ")
+
+    if line.startswith(":"):
+        # no command, just a trailing parameter; shouldn't happen but don't misparse it either
+        middle, trailing = "", line[1:]
+    else:
+        middle, sep, trailing = line.partition(" :")
+        if not sep:
+            trailing = None
+
+    args = [arg for arg in middle.split(" ") if arg]
+    command = _command_name(args.pop(0)) if args else ""
+    if trailing is not None:
+        args.append(trailing)
+
+    return tags, prefix, command, args
+
 # avoiding regex
 def parse_raw_irc_command(element):
     """
@@ -78,6 +78,15 @@ def _chan_join(evt, channel, user):
 
 EventListener(_chan_join).install("chan_join")
 
+def _connection_lost(evt, var, cli):
+    # keep who was in the channels, so that rejoining only needs to account for what changed meanwhile
+    for channel in _channels.values():
+        if not channel.is_fake and channel.client is cli:
+            channel.state = _States.NotJoined
+            channel._pending = []
+
+EventListener(_connection_lost).install("irc_disconnected")
+
 class Channel(IRCContext):
 
     is_channel = True
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
 import copy
-from typing import Dict, Generic, List, Set, TypeVar
+from typing import Any, Dict, FrozenSet, Generic, List, Optional, Set, Tuple, TypeVar
 
 from src.users import User
 
-__all__ = ["UserList", "UserSet", "UserDict", "DefaultUserDict"]
+__all__ = ["UserList", "UserSet", "UserDict", "DefaultUserDict", "UserSetDict", "track_state", "state_epoch"]
 
 KT = TypeVar("KT")
 VT = TypeVar("VT")
@@ -37,9 +37,33 @@ files to get an idea of how those containers should be used.
 
 """
 
+# bumped on every change to a container passed to track_state()
+_epoch = 0
+
+def track_state(*containers: Container):
+    """Make changes to the given containers count towards state_epoch().
+
+    Anything derived only from tracked containers can be cached for as long as the epoch stays the same.
+    Tracking stays on for the lifetime of the container, which is fine as they are never overwritten.
+    """
+    for container in containers:
+        container._tracked = True
+
+def state_epoch() -> int:
+    """Return a number which changes whenever a tracked container is modified."""
+    return _epoch
+
 class Container:
     """Base container class for all containers."""
 
+    # whether changes to this container bump the state epoch; see track_state()
+    _tracked = False
+
+    def _changed(self):
+        global _epoch
+        if self._tracked:
+            _epoch += 1
+
     def __enter__(self):
         return self
 
@@ -103,6 +127,8 @@ class UserList(Container, List[User]):
         if self not in value.lists:
             value.lists.append(self)
 
+        self._changed()
+
     def __delitem__(self, index):
         item = self[index]
 
@@ -111,6 +137,8 @@ class UserList(Container, List[User]):
         if item not in self: # there may have been multiple instances
             item.lists.remove(self)
 
+        self._changed()
+
     def append(self, item):
         if not isinstance(item, User):
             raise TypeError("UserList may only contain User instances")
@@ -119,6 +147,7 @@ class UserList(Container, List[User]):
             item.lists.append(self)
 
         super().append(item)
+        self._changed()
 
     def clear(self):
         for item in self:
@@ -126,6 +155,7 @@ class UserList(Container, List[User]):
                 item.lists.remove(self)
 
         super().clear()
+        self._changed()
 
     def extend(self, iterable):
         for item in iterable:
@@ -142,12 +172,15 @@ class UserList(Container, List[User]):
         if self not in item.lists:
             item.lists.append(self)
 
+        self._changed()
+
     def pop(self, index=-1):
         item = super().pop(index)
 
         if item not in self:
             item.lists.remove(self)
 
+        self._changed()
         return item
 
     def remove(self, item):
@@ -156,7 +189,20 @@ class UserList(Container, List[User]):
         if item not in self:
             item.lists.remove(self)
 
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
+
+    def sort(self, *, key=None, reverse=False):
+        super().sort(key=key, reverse=reverse)
+        self._changed()
+
 class UserSet(Container, Set[User]):
+    # (dict, key) if this set is currently a value of a UserSetDict, which needs to hear about changes
+    _owner = None # type: Optional[Tuple[UserSetDict, Any]]
+
     def __init__(self, iterable=()):
         super().__init__()
         try:
@@ -206,12 +252,18 @@ class UserSet(Container, Set[User]):
 
             item.sets.append(self)
             super().add(item)
+            if self._owner is not None:
+                self._owner[0]._key_added(item, self._owner[1])
+            self._changed()
 
     def clear(self):
         for item in self:
             item.sets.remove(self)
+            if self._owner is not None:
+                self._owner[0]._key_removed(item, self._owner[1])
 
         super().clear()
+        self._changed()
 
     def difference(self, iterable):
         return type(self)(super().difference(iterable))
@@ -224,8 +276,10 @@ class UserSet(Container, Set[User]):
     def discard(self, item):
         if item in self:
             item.sets.remove(self)
-
-        super().discard(item)
+            if self._owner is not None:
+                self._owner[0]._key_removed(item, self._owner[1])
+            super().discard(item)
+            self._changed()
 
     def intersection(self, iterable):
         return type(self)(super().intersection(iterable))
@@ -238,12 +292,18 @@ class UserSet(Container, Set[User]):
     def pop(self):
         item = super().pop()
         item.sets.remove(self)
+        if self._owner is not None:
+            self._owner[0]._key_removed(item, self._owner[1])
+        self._changed()
         return item
 
     def remove(self, item):
         super().remove(item)
 
         item.sets.remove(self)
+        if self._owner is not None:
+            self._owner[0]._key_removed(item, self._owner[1])
+        self._changed()
 
     def symmetric_difference(self, iterable):
         return type(self)(super().symmetric_difference(iterable))
@@ -317,6 +377,8 @@ class UserDict(Container, Dict[KT, VT], Generic[KT, VT]):
             if self not in value.dict_values:
                 value.dict_values.append(self)
 
+        self._changed()
+
     def __delitem__(self, item):
         if isinstance(item, slice): # special-case: delete if it exists, otherwise don't
             if item.start is item.step is None: # checks out
@@ -336,6 +398,8 @@ class UserDict(Container, Dict[KT, VT], Generic[KT, VT]):
         if isinstance(value, (UserSet, UserList, UserDict)):
             value.clear()
 
+        self._changed()
+
     def clear(self):
         for key, value in self.items():
             if isinstance(key, User):
@@ -348,6 +412,7 @@ class UserDict(Container, Dict[KT, VT], Generic[KT, VT]):
                 value.clear()
 
         super().clear()
+        self._changed()
 
     @classmethod
     def fromkeys(cls, iterable, value=None):
@@ -361,6 +426,7 @@ class UserDict(Container, Dict[KT, VT], Generic[KT, VT]):
         if isinstance(value, User):
             if value not in self.values():
                 value.dict_values.remove(self)
+        self._changed()
         return value
 
     def popitem(self):
@@ -370,6 +436,7 @@ class UserDict(Container, Dict[KT, VT], Generic[KT, VT]):
         if isinstance(value, User):
             if value not in self.values():
                 value.dict_values.remove(self)
+        self._changed()
         return key, value
 
     def setdefault(self, key, default=None):
@@ -391,3 +458,95 @@ class DefaultUserDict(UserDict[KT, VT], Generic[KT, VT]):
     def __missing__(self, key):
         self[key] = self.factory()
         return self[key]
+
+class UserSetDict(UserDict[KT, UserSet], Generic[KT]):
+    """A UserDict whose values are UserSets, which also tracks the keys every user is found under.
+
+    This makes "which keys contain this user" a single lookup rather than a scan over every value.
+    Values tell the dict about changes made to them, so they can be freely mutated in place, but
+    a UserSet may only be a value of one UserSetDict (under one key) at a time.
+    """
+
+    def __init__(_self, _it=(), **kwargs):
+        _self._reverse = {} # type: Dict[User, FrozenSet[KT]]
+        super().__init__(_it, **kwargs)
+
+    def __copy__(self):
+        # values can't be shared between two of these, so they are copied too
+        return type(self)((key, value.copy()) for key, value in self.items())
+
+    def keys_for(self, user: User) -> FrozenSet[KT]:
+        """Return the keys whose values contain the given user."""
+        return self._reverse.get(user, frozenset())
+
+    def check_index(self):
+        """Raise AssertionError if the reverse index disagrees with the actual contents."""
+        expected = {} # type: Dict[User, Set[KT]]
+        for key, value in self.items():
+            for user in value:
+                expected.setdefault(user, set()).add(key)
+        assert expected == self._reverse, "reverse index out of sync: expected {0}, got {1}".format(expected, self._reverse)
+
+    def _key_added(self, user: User, key: KT):
+        self._reverse[user] = self._reverse.get(user, frozenset()) | {key}
+        self._changed()
+
+    def _key_removed(self, user: User, key: KT):
+        keys = self._reverse[user] - {key}
+        if keys:
+            self._reverse[user] = keys
+        else:
+            del self._reverse[user]
+        self._changed()
+
+    def _check_value(self, value):
+        if not isinstance(value, UserSet):
+            raise TypeError("UserSetDict may only contain UserSet instances")
+        if value._owner is not None:
+            raise ValueError("UserSet is already tracked under key {0!r}".format(value._owner[1]))
+
+    def _attach(self, key: KT, value: UserSet):
+        value._owner = (self, key)
+        for user in value:
+            self._key_added(user, key)
+
+    def _detach(self, value):
+        if isinstance(value, UserSet) and value._owner is not None and value._owner[0] is self:
+            for user in value:
+                self._key_removed(user, value._owner[1])
+            value._owner = None
+
+    def __setitem__(self, item, value):
+        old = self.get(item)
+        if old is value:
+            return
+        self._check_value(value)
+        self._detach(old)
+        self._attach(item, value)
+        super().__setitem__(item, value)
+
+    def __delitem__(self, item):
+        if isinstance(item, slice):
+            if item.start is item.step is None and item.stop not in self:
+                return
+            key = item.stop
+        else:
+            key = item
+        self._detach(self[key])
+        super().__delitem__(item)
+
+    def clear(self):
+        for value in self.values():
+            value._owner = None
+        self._reverse.clear()
+        super().clear()
+
+    def pop(self, key, *default):
+        if key in self:
+            self._detach(self[key])
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._detach(value)
+        return key, value
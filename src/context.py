@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 import sys
-from collections import defaultdict, OrderedDict
+import threading
+import time
+from collections import defaultdict, deque, OrderedDict
 from operator import attrgetter
 from typing import Dict, Any, ClassVar, List, Set, Optional, Tuple
 
 import src.settings as var # FIXME
 from src.messages.message import Message
 from src.logger import debuglog
+from src.timers import Timer
 
 class _NotLoggedIn:
     def __copy__(self):
@@ -21,8 +24,8 @@ class _NotLoggedIn:
 
 NotLoggedIn = _NotLoggedIn()
 
-def _who(cli, target, data=b""):
-    """Handle WHO requests."""
+def _who_data(data) -> bytes:
+    """Normalize the data sent along with a WHOX request to at most 3 bytes."""
 
     if isinstance(data, str):
         data = data.encode(Features["CHARSET"])
@@ -35,6 +38,12 @@ def _who(cli, target, data=b""):
     if len(data) > 3:
         data = b""
 
+    return data
+
+def _who(cli, target, data=b""):
+    """Handle WHO requests."""
+
+    data = _who_data(data)
     if "WHOX" in Features:
         cli.send("WHO", target, b"%tcuihsnfdlar," + data)
     else:
@@ -42,7 +51,7 @@ def _who(cli, target, data=b""):
 
     return int.from_bytes(data, "little")
 
-def _send(data, first, sep, client, send_type, name, chan=None):
+def _send(data, first, sep, client, send_type, name, chan=None, priority=None):
     full_address = "{cli.nickname}!{cli.ident}@{cli.hostmask}".format(cli=client)
 
     # Maximum length of sent data is 512 bytes. However, we have to
@@ -73,48 +82,67 @@ def _send(data, first, sep, client, send_type, name, chan=None):
     else:
         chan = ""
 
-    messages = []
+    # each entry starts on a line of its own, because adding the next part to it would have made it too long
+    messages = [] # type: List[List[str]]
     count = 0
     for line in data:
-        if count and count + len(sep) + len(line) > length:
-            count = len(line)
-            cur_sep = "\n"
-        elif not messages:
+        if count and count + len(sep) + len(line) > length or not messages:
             count = len(line)
-            cur_sep = ""
+            messages.append([line])
         else:
             count += len(sep) + len(line)
-            cur_sep = sep
-
-        messages.append(cur_sep)
-        messages.append(line)
-
-    for line in "".join(messages).split("\n"):
-        while line:
-            extra, line = line[:length], line[length:]
-            client.send("{0} {1} {4}:{2}{3}".format(send_type, name, first, extra, chan))
+            messages[-1].append(sep)
+            messages[-1].append(line)
+
+    # separate calls which would have been joined with a space anyway can share a line on their way out,
+    # but not when each line carries a prefix or the caller asked for a different separator
+    pack = not first and not chan and sep == " "
+
+    for parts in messages:
+        for i, line in enumerate("".join(parts).split("\n")):
+            # a line break the message itself asks for must stay one
+            packable = pack and i == 0
+            while line:
+                extra, line = line[:length], line[length:]
+                client.send("{0} {1} {4}:{2}{3}".format(send_type, name, first, extra, chan), priority=priority, pack=packable)
+                packable = False
+
+# Translation tables for each casemapping we support; anything else is treated as rfc1459
+_CASEMAPPINGS = {
+    "rfc1459": str.maketrans("[]\\^", "{}|~"),
+    "strict-rfc1459": str.maketrans("[]\\", "{}|"),
+    "ascii": {},
+} # type: Dict[str, Dict[int, str]]
+
+_LOWER_CACHE_SIZE = 1024
+
+# (table, memo) for the server's current casemapping; replaced as a whole whenever CASEMAPPING changes
+# so that lower() never pairs a memo with the wrong table
+_lower_state = (_CASEMAPPINGS["rfc1459"], {}) # type: Tuple[Dict[int, str], Dict[str, str]]
+
+def _set_casemapping(casemapping: str):
+    global _lower_state
+    _lower_state = (_CASEMAPPINGS.get(casemapping, _CASEMAPPINGS["rfc1459"]), {})
 
 def lower(nick, *, casemapping=None):
     if nick is None or nick is NotLoggedIn:
         return nick
     if isinstance(nick, IRCContext):
         return nick.lower()
-    if casemapping is None:
-        casemapping = Features["CASEMAPPING"]
-
-    mapping = {
-        "[": "{",
-        "]": "}",
-        "\\": "|",
-        "^": "~",
-    }
+    if casemapping is not None:
+        return nick.lower().translate(_CASEMAPPINGS.get(casemapping, _CASEMAPPINGS["rfc1459"]))
 
-    if casemapping == "strict-rfc1459":
-        mapping.pop("^")
-    elif casemapping == "ascii":
-        mapping.clear()
+    table, memo = _lower_state
+    try:
+        return memo[nick]
+    except KeyError:
+        pass
 
-    return nick.lower().translate(str.maketrans(mapping))
+    value = nick.lower().translate(table)
+    if len(memo) >= _LOWER_CACHE_SIZE:
+        memo.clear()
+    memo[nick] = value
+    return value
 
 def equals(nick1, nick2):
     return nick1 is not None and nick2 is not None and lower(nick1) == lower(nick2)
@@ -187,7 +215,7 @@ class IRCContext:
         self._messages[message].append(self)
 
     @classmethod
-    def send_messages(cls, *, notice=False, privmsg=False):
+    def send_messages(cls, *, notice=False, privmsg=False, priority=None):
         messages = list(cls._messages.items())
         cls._messages.clear()
         for message, targets in messages:
@@ -204,7 +232,7 @@ class IRCContext:
                 max_targets = Features["TARGMAX"][send_type]
                 while targets:
                     using, targets = targets[:max_targets], targets[max_targets:]
-                    _send(message, "", " ", using[0].client, send_type, ",".join([t.nick for t in using]), send_chan)
+                    _send(message, "", " ", using[0].client, send_type, ",".join([t.nick for t in using]), send_chan, priority)
 
     @classmethod
     def get_context_type(cls, *, max_types=1):
@@ -232,9 +260,13 @@ class IRCContext:
         given. If the server supports WHOX, the same integer will be in the
         event.params.data attribute. Otherwise, this attribute will be 0.
 
+        The request goes through WhoQueue, so it may be answered by a query
+        that is already underway, or by a WHO of a channel the user is in;
+        either way, the events above fire once the answer is complete.
+
         """
 
-        return _who(self.client, self.name, data)
+        return WhoQueue.who(self, data)
 
     def use_cprivmsg(self, send_type):
         if not self.is_user or var.DISABLE_CPRIVMSG: # FIXME: uses var
@@ -259,7 +291,7 @@ class IRCContext:
                 return "CNOTICE", cprivmsg_eligible.name
         return send_type, None
 
-    def send(self, *data, first=None, sep=None, notice=False, privmsg=False, prefix=None):
+    def send(self, *data, first=None, sep=None, notice=False, privmsg=False, prefix=None, priority=None):
         new = []
         for line in data:
             if isinstance(line, Message):
@@ -280,7 +312,7 @@ class IRCContext:
             first = ""
         if sep is None:
             sep = " "
-        _send(new, first, sep, self.client, send_type, name, send_chan)
+        _send(new, first, sep, self.client, send_type, name, send_chan, priority)
 
 class IRCFeatures:
     """Class to store features that the ircd supports."""
@@ -295,13 +327,14 @@ class IRCFeatures:
     @property
     def CASEMAPPING(self) -> str:
         value = self._features.get("CASEMAPPING", "rfc1459")
-        if value not in ("rfc1459", "rfc1459-strict", "ascii"):
+        if value not in _CASEMAPPINGS:
             value = "rfc1459"
         return value
 
     @CASEMAPPING.setter
     def CASEMAPPING(self, value: str):
         self._features["CASEMAPPING"] = value
+        _set_casemapping(self.CASEMAPPING)
 
     @property
     def CHANLIMIT(self) -> Dict[str, int]:
@@ -599,6 +632,147 @@ class IRCFeatures:
         # we may get CAP DEL more than once for the same feature
         if key in self._features:
             del self._features[key]
+            if key == "CASEMAPPING":
+                _set_casemapping(self.CASEMAPPING)
+
+class WhoScheduler:
+    """Send WHO and WHOIS queries on behalf of the whole bot.
+
+    A query for a target which is already being looked up (or is waiting to be) is not
+    sent again, since everyone interested gets the "who_result" and "who_end" events for
+    the one already underway. Looking up a single user is sent right away, but any more
+    lookups in the next WHO_COALESCE_DELAY seconds are held back, and if at least
+    WHO_COALESCE_MIN of them share a channel, that channel is looked up instead; the
+    "who_end" event still fires for each of those users. At most WHO_BUDGET queries are
+    sent every WHO_BUDGET_WINDOW seconds, with the rest waiting in line for their turn.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # (lowercased target, data, is WHOIS) -> (time sent, users this query also answers for)
+        self._inflight = {} # type: Dict[Tuple[str, bytes, bool], Tuple[float, List[IRCContext]]]
+        self._queue = OrderedDict() # type: OrderedDict[Tuple[str, bytes, bool], Tuple[IRCContext, List[IRCContext]]]
+        self._sent = deque() # type: deque
+        self._hold_until = 0.0
+        self._timer = Timer(0, self._run)
+        self._timer_at = 0.0
+
+    def who(self, target: IRCContext, data=b"") -> int:
+        """Look up a channel or user with WHO, see IRCContext.who()."""
+        data = _who_data(data)
+        with self._lock:
+            self._request(target, data, False)
+        return int.from_bytes(data, "little")
+
+    def whois(self, target: IRCContext):
+        """Look up a user with WHOIS; the reply fires the same events as WHO does."""
+        with self._lock:
+            self._request(target, b"", True)
+
+    def done(self, name: str, *, whois: bool = False) -> List[IRCContext]:
+        """Mark a query as answered, returning the users it also answered for."""
+        name = lower(name)
+        covered = []
+        with self._lock:
+            for key in [k for k in self._inflight if k[0] == name and k[2] is whois]:
+                covered.extend(self._inflight.pop(key)[1])
+        return covered
+
+    def clear(self):
+        """Forget about every query, such as when reconnecting to the server."""
+        with self._lock:
+            self._inflight.clear()
+            self._queue.clear()
+            self._sent.clear()
+            self._hold_until = 0.0
+            self._timer.cancel()
+
+    def _request(self, target: IRCContext, data: bytes, whois: bool):
+        now = time.monotonic()
+        for key, (sent, _) in list(self._inflight.items()):
+            if sent < now - var.WHO_TIMEOUT: # FIXME: uses var
+                # the server never finished answering, let this be asked again
+                del self._inflight[key]
+
+        key = (lower(target.name), data, whois)
+        if key in self._inflight or key in self._queue:
+            return
+
+        single_user = target.is_user and not whois and not data
+        if single_user:
+            for chan in target.channels:
+                chan_key = (lower(chan.name), b"", False)
+                if chan_key in self._inflight:
+                    self._inflight[chan_key][1].append(target)
+                    return
+                if chan_key in self._queue:
+                    self._queue[chan_key][1].append(target)
+                    return
+
+        self._queue[key] = (target, [])
+        if single_user and now < self._hold_until:
+            self._schedule(self._hold_until)
+            return
+        self._flush()
+        if single_user:
+            # the first lookup of a user after a quiet spell goes out at once, the ones after it are held back
+            self._hold_until = now + var.WHO_COALESCE_DELAY
+
+    def _coalesce(self):
+        while True:
+            counts = defaultdict(list) # type: Dict[IRCContext, List[Tuple[str, bytes, bool]]]
+            for key, (target, covered) in self._queue.items():
+                if target.is_user and key[1:] == (b"", False):
+                    for chan in target.channels:
+                        counts[chan].append(key)
+            if not counts:
+                return
+            chan, keys = max(counts.items(), key=lambda item: len(item[1]))
+            if len(keys) < var.WHO_COALESCE_MIN:
+                return
+            chan_key = (lower(chan.name), b"", False)
+            if chan_key not in self._queue:
+                self._queue[chan_key] = (chan, [])
+            covered = self._queue[chan_key][1]
+            for key in keys:
+                target, also = self._queue.pop(key)
+                covered.append(target)
+                covered.extend(also)
+
+    def _flush(self):
+        now = time.monotonic()
+        holding = now < self._hold_until
+        if not holding:
+            self._coalesce()
+        while self._sent and self._sent[0] <= now - var.WHO_BUDGET_WINDOW:
+            self._sent.popleft()
+
+        for key, (target, covered) in list(self._queue.items()):
+            if holding and target.is_user and key[1:] == (b"", False):
+                self._schedule(self._hold_until)
+                continue
+            if len(self._sent) >= var.WHO_BUDGET:
+                self._schedule(self._sent[0] + var.WHO_BUDGET_WINDOW)
+                break
+            del self._queue[key]
+            self._inflight[key] = (now, covered)
+            self._sent.append(now)
+            if key[2]:
+                target.client.send("WHOIS {0}".format(target))
+            else:
+                _who(target.client, target.name, key[1])
+
+    def _schedule(self, when: float):
+        if self._timer.is_alive() and self._timer_at <= when:
+            return
+        self._timer_at = when
+        self._timer.reschedule(max(0.0, when - time.monotonic()))
+
+    def _run(self):
+        from src.decorators import handle_error
+        with self._lock:
+            handle_error(self._flush)()
 
 class IRCTargMaxFeature:
     def __init__(self, features: IRCFeatures, value: Optional[str] = None):
@@ -622,3 +796,4 @@ class IRCTargMaxFeature:
         return "IRCTargMaxFeature(" + repr(self._commands) + ")"
 
 Features = IRCFeatures()
+WhoQueue = WhoScheduler()
@@ -383,9 +383,11 @@ class command:
         self.func(var, wrapper, message)
 
 class hook:
-    def __init__(self, name, hookid=-1):
+    def __init__(self, name, hookid=-1, *, tags=False):
         self.name = name
         self.hookid = hookid
+        # if True, the IRCv3 message tags sent with the line are passed as the tags keyword argument
+        self.tags = tags
         self.func = None
 
         HOOKS[name].append(self)
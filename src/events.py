@@ -1,12 +1,58 @@
 # event system
 from __future__ import annotations
 
-from collections import defaultdict
+import bisect
+import time
+from collections import deque
 from types import SimpleNamespace
-from typing import Callable, Dict, List, Optional
-EVENT_CALLBACKS: Dict[str, List[EventListener]] = defaultdict(list)
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
 
-__all__ = ["find_listener", "Event", "EventListener"]
+import src.settings as var
+
+# Listeners for each event, already sorted by priority. These tuples are never modified in place;
+# installing or removing a listener swaps in a new tuple, so a dispatch that is in progress keeps
+# iterating over the listeners that were registered when it started.
+EVENT_CALLBACKS: Dict[str, Tuple[EventListener, ...]] = {}
+
+# Timing information for each (event name, listener id), only collected while PROFILE_EVENTS is enabled
+LISTENER_STATS: Dict[Tuple[str, str], ListenerStats] = {}
+
+__all__ = ["find_listener", "Event", "EventListener", "ListenerStats", "get_listener_stats", "reset_listener_stats"]
+
+class ListenerStats:
+    """Call count and timing for a single listener of a single event.
+
+    Times are wall clock and include any events the listener dispatches itself.
+    Percentiles are computed over the most recent PROFILE_EVENTS_SAMPLES calls.
+    """
+    __slots__ = ("event", "listener_id", "calls", "total", "samples")
+
+    def __init__(self, event: str, listener_id: str):
+        self.event = event
+        self.listener_id = listener_id
+        self.calls = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=var.PROFILE_EVENTS_SAMPLES)
+
+    def record(self, elapsed: float):
+        self.calls += 1
+        self.total += elapsed
+        self.samples.append(elapsed)
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "event": self.event,
+            "listener": self.listener_id,
+            "calls": self.calls,
+            "total": self.total,
+            "p99": self.percentile(99),
+        }
 
 class EventListener:
     def __init__(self, callback: Callable, *, listener_id: Optional[str] = None, priority: float = 5):
@@ -20,13 +66,17 @@ class EventListener:
         self.priority = priority
 
     def install(self, event: str):
-        if self in EVENT_CALLBACKS[event]:
+        listeners = EVENT_CALLBACKS.get(event, ())
+        if self in listeners:
             raise ValueError("Callback with id {} already registered for the {} event".format(self.id, event))
-        EVENT_CALLBACKS[event].append(self)
+        # insert after any existing listeners of the same priority, so that ties run in install order
+        index = bisect.bisect_right([x.priority for x in listeners], self.priority)
+        EVENT_CALLBACKS[event] = listeners[:index] + (self,) + listeners[index:]
 
     def remove(self, event: str):
-        if self in EVENT_CALLBACKS[event]:
-            EVENT_CALLBACKS[event].remove(self)
+        listeners = EVENT_CALLBACKS.get(event, ())
+        if self in listeners:
+            EVENT_CALLBACKS[event] = tuple(x for x in listeners if x != self)
 
     def __eq__(self, other):
         if not isinstance(other, EventListener):
@@ -48,11 +98,18 @@ class EventListener:
         raise ValueError("Cannot modify id attribute")
 
 def find_listener(event: str, listener_id: str) -> EventListener:
-    for evt in EVENT_CALLBACKS[event]:
+    for evt in EVENT_CALLBACKS.get(event, ()):
         if evt.id == listener_id:
             return evt
     raise Exception("Could not find listener with id {0}".format(listener_id))
 
+def get_listener_stats() -> Tuple[ListenerStats, ...]:
+    """Retrieve the collected listener timings, slowest (by cumulative time) first."""
+    return tuple(sorted(LISTENER_STATS.values(), key=lambda x: x.total, reverse=True))
+
+def reset_listener_stats():
+    LISTENER_STATS.clear()
+
 class Event:
     def __init__(self, _name, _data, **kwargs):
         self.stop_processing = False
@@ -64,10 +121,18 @@ class Event:
     def dispatch(self, *args, **kwargs):
         self.stop_processing = False
         self.prevent_default = False
-        listeners = list(EVENT_CALLBACKS[self.name])
-        listeners.sort(key=lambda x: x.priority)
-        for listener in listeners:
-            listener(self, *args, **kwargs)
+        profile = var.PROFILE_EVENTS
+        for listener in EVENT_CALLBACKS.get(self.name, ()):
+            if profile:
+                start = time.perf_counter()
+                listener(self, *args, **kwargs)
+                elapsed = time.perf_counter() - start
+                key = (self.name, listener.id)
+                if key not in LISTENER_STATS:
+                    LISTENER_STATS[key] = ListenerStats(self.name, listener.id)
+                LISTENER_STATS[key].record(elapsed)
+            else:
+                listener(self, *args, **kwargs)
             if self.stop_processing:
                 break
 
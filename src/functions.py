@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-from typing import Optional, Set, Iterable
+from typing import Collection, Dict, FrozenSet, Optional, Set, Iterable, Tuple
 from collections import Counter
 import functools
 
+import botconfig  # type: ignore
+
 from src.messages import messages, LocalRole, LocalMode, LocalTotem
-from src.events import Event
+from src.events import Event, EventListener
+from src.containers import state_epoch
 from src.cats import Wolfteam, Neutral, Hidden, All
 from src.match import Match, match_all
 from src import settings as var
@@ -17,10 +20,29 @@ __all__ = [
     "match_role", "match_mode", "match_totem"
     ]
 
+# (function, roles) -> (state epoch, result) for calls made against the actual game state
+_players_cache = {} # type: Dict[Tuple[str, Optional[FrozenSet[str]]], Tuple[int, Collection]]
+
+def _cached(name, roles, build):
+    key = (name, roles)
+    epoch = state_epoch()
+    entry = _players_cache.get(key)
+    if entry is not None and entry[0] == epoch:
+        return entry[1]
+    # the epoch is read before building, so anything changing meanwhile makes the entry stale right away
+    result = build()
+    _players_cache[key] = (epoch, result)
+    return result
+
 def get_players(roles=None, *, mainroles=None):
+    if mainroles is None or mainroles is var.MAIN_ROLES:
+        if roles is not None:
+            roles = frozenset(roles)
+        return list(_cached("players", roles, lambda: tuple(_get_players(roles, var.MAIN_ROLES))))
+    return _get_players(roles, mainroles)
+
+def _get_players(roles, mainroles):
     from src.status import is_dying
-    if mainroles is None:
-        mainroles = var.MAIN_ROLES
     if roles is None:
         roles = set(mainroles.values())
     pl = set()
@@ -35,9 +57,14 @@ def get_players(roles=None, *, mainroles=None):
     return [p for p in var.ALL_PLAYERS if p in pl and not is_dying(var, p)]
 
 def get_all_players(roles=None, *, rolemap=None):
+    if rolemap is None or rolemap is var.ROLES:
+        if roles is not None:
+            roles = frozenset(roles)
+        return set(_cached("all_players", roles, lambda: frozenset(_get_all_players(roles, var.ROLES))))
+    return _get_all_players(roles, rolemap)
+
+def _get_all_players(roles, rolemap):
     from src.status import is_dying
-    if rolemap is None:
-        rolemap = var.ROLES
     if roles is None:
         roles = set(rolemap.keys())
     pl = set()
@@ -51,10 +78,17 @@ def get_all_players(roles=None, *, rolemap=None):
     return {p for p in pl if not is_dying(var, p)}
 
 def get_participants():
-    """List all players who are still able to participate in the game."""
+    """List all players who are still able to participate in the game.
+
+    The result is cached until a container passed to track_state() changes, so
+    get_participants listeners must only depend on tracked containers.
+    """
+    return list(_cached("participants", None, _get_participants))
+
+def _get_participants():
     evt = Event("get_participants", {"players": get_players()})
     evt.dispatch(var)
-    return evt.data["players"]
+    return tuple(evt.data["players"])
 
 def get_target(var, wrapper, message, *, allow_self=False, allow_bot=False, not_self_message=None):
     """Autocomplete a target for an in-game command.
@@ -80,7 +114,7 @@ def get_target(var, wrapper, message, *, allow_self=False, allow_bot=False, not_
     if allow_bot:
         players.append(users.Bot)
 
-    match = users.complete_match(message, players)
+    match = _get_player_index().complete_match(message, players)
     if not match:
         if not len(match) and users.lower(wrapper.source.nick).startswith(users.lower(message)):
             wrapper.pm(messages[not_self_message or "no_target_self"])
@@ -89,7 +123,7 @@ def get_target(var, wrapper, message, *, allow_self=False, allow_bot=False, not_
             wrapper.pm(messages["not_playing"].format(message))
         else:
             # display some helpful suggestions, including account disambiguation if needed
-            nicks = Counter(users.lower(x.nick) for x in match)
+            nicks = Counter(x.lower().nick for x in match)
             suggestions = []
             for nick, count in nicks.items():
                 if count == 1:
@@ -105,6 +139,44 @@ def get_target(var, wrapper, message, *, allow_self=False, allow_bot=False, not_
 
     return match.get()
 
+# Autocompletion index for get_target(); seeded from get_players() at the start of each phase
+# and kept up to date as players die or change nicks/accounts. Users it has not seen yet (the bot,
+# players who joined mid-phase) get added on first lookup, so it never needs to be exact.
+_player_index = None
+
+def _get_player_index():
+    global _player_index
+    if _player_index is None:
+        from src.users import UserIndex
+        _player_index = UserIndex()
+    return _player_index
+
+def _seed_player_index(evt, var):
+    index = _get_player_index()
+    index.clear()
+    for player in get_players():
+        index.add(player)
+
+def _reset_player_index(evt, var):
+    _get_player_index().clear()
+
+def _remove_from_player_index(evt, var, player, all_roles, death_triggers):
+    _get_player_index().discard(player)
+
+def _swap_in_player_index(evt, user, old_value):
+    index = _get_player_index()
+    if evt.params.old in index:
+        index.discard(evt.params.old)
+        index.add(user)
+
+# Can't use @event_listener decorator since src/decorators.py imports us
+EventListener(_seed_player_index).install("transition_day_begin")
+EventListener(_seed_player_index).install("transition_night_begin")
+EventListener(_reset_player_index).install("reset")
+EventListener(_remove_from_player_index).install("del_player")
+EventListener(_swap_in_player_index).install("nick_change")
+EventListener(_swap_in_player_index).install("account_change")
+
 def change_role(var, player, oldrole, newrole, *, inherit_from=None, message="new_role"):
     # in_wolfchat is filled as part of priority 4
     # if you wish to modify evt.data["role"], do so in priority 3 or sooner
@@ -148,7 +220,10 @@ def get_main_role(user):
     return role
 
 def get_all_roles(user):
-    return {role for role, users in var.ROLES.items() if user in users}
+    roles = var.ROLES.keys_for(user)
+    if botconfig.DEBUG_MODE:
+        var.ROLES.check_index()
+    return set(roles)
 
 def get_reveal_role(user):
     evt = Event("get_reveal_role", {"role": get_main_role(user)})
@@ -1,5 +1,4 @@
 import random
-import threading
 import functools
 from collections import Counter
 from src.gamemodes import game_mode, GameMode
@@ -9,6 +8,7 @@ from src.decorators import command, handle_error
 from src.functions import get_players, change_role
 from src.status import add_dying
 from src.events import EventListener
+from src.timers import Timer
 from src import channels
 
 @game_mode("sleepy", minp=10, maxp=24, likelihood=5)
@@ -90,8 +90,7 @@ class SleepyMode(GameMode):
                 with var.WARNING_LOCK:
                     target = random.choice(pl)
                     pl.remove(target)
-                    t = threading.Timer(60, self.do_nightmare, (var, target, var.NIGHT_COUNT))
-                    t.daemon = True
+                    t = Timer(60, self.do_nightmare, (var, target, var.NIGHT_COUNT))
                     t.start()
 
     @handle_error
@@ -231,15 +230,14 @@ class SleepyMode(GameMode):
                     # messages: sleepy_doomsayer_turn, sleepy_succubus_turn, sleepy_demoniac_turn
                     change_role(var, t, old, new, message="sleepy_{0}_turn".format(new))
 
-                newstats = set()
-                for rs in var.ROLE_STATS:
-                    d = Counter(dict(rs))
-                    newstats.add(rs)
+                def turn(d, old=old, new=new):
+                    yield d
                     if old in d and d[old] >= 1:
+                        d = Counter(d)
                         d[old] -= 1
                         d[new] += 1
-                        newstats.add(frozenset(d.items()))
-                var.ROLE_STATS = frozenset(newstats)
+                        yield d
+                var.ROLE_STATS = var.ROLE_STATS.transform(turn)
 
     def on_revealroles(self, evt, var):
         if self.having_nightmare:
@@ -3,9 +3,9 @@
 from __future__ import annotations
 
 import base64
+import json
 import socket
 import sys
-import threading
 import time
 import traceback
 import functools
@@ -20,9 +20,10 @@ from src.messages import messages
 from src.functions import get_participants, get_all_roles, match_role
 from src.dispatcher import MessageDispatcher
 from src.decorators import handle_error, command, hook
-from src.context import Features
+from src.context import Features, NotLoggedIn, WhoQueue
+from src.timers import Timer
 from src.users import User
-from src.events import Event, EventListener
+from src.events import Event, EventListener, get_listener_stats, reset_listener_stats
 
 @handle_error
 def on_privmsg(cli, rawnick, chan, msg, *, notice=False):
@@ -37,6 +38,8 @@ def on_privmsg(cli, rawnick, chan, msg, *, notice=False):
     from src import lagcheck
     allow_bot = lagcheck > 0
     user = users.get(rawnick, allow_none=True, allow_bot=allow_bot)
+    if user is not None and user is not users.Bot and Features.get("account-tag", False):
+        user = _refresh_account(user, cli.tags.get("account"))
 
     ch = chan.lstrip("".join(Features["PREFIX"]))
 
@@ -71,6 +74,31 @@ def on_privmsg(cli, rawnick, chan, msg, *, notice=False):
         return  # channel message but no prefix; ignore
     parse_and_dispatch(var, wrapper, key, message)
 
+def _refresh_account(user: User, account: Optional[str]) -> User:
+    """Bring a user's account up to date from the account tag of a message they sent.
+
+    With account-tag enabled, the server attaches the sender's account to everything they
+    send (and leaves the tag off entirely if they are logged out), so the account data is
+    always fresh by the time a command runs and update_account_data never needs a WHO.
+
+    :param user: User who sent the message
+    :param account: Value of the account tag, or None if the tag was absent
+    :return: The user, swapped for a new instance if the account changed
+    """
+    if account is None:
+        account = NotLoggedIn
+    if users.equals(account, user.account):
+        user.account_timestamp = time.time()
+        return user
+
+    old_account = user.account
+    user.account = account
+    new_user = users.get(user.nick, user.ident, user.host, account, allow_bot=True)
+    # going from an unknown account to a known one is learning it, not a change; and until the
+    # bot is in its channel there is nothing for the listeners to act on
+    if old_account is not None and channels.Main is not None:
+        Event("account_change", {}, old=user).dispatch(new_user, old_account)
+    return new_user
 
 def parse_and_dispatch(var,
                      wrapper: MessageDispatcher,
@@ -201,9 +229,14 @@ def parse_and_dispatch(var,
             fn.caller(var, context, message)
 
 
-def unhandled(cli, prefix, cmd, *args):
+def unhandled(cli, prefix, cmd, *args, tags=None):
+    if tags is None:
+        tags = cli.tags
     for fn in decorators.HOOKS.get(cmd, []):
-        fn.caller(cli, prefix, *args)
+        if fn.tags:
+            fn.caller(cli, prefix, *args, tags=tags)
+        else:
+            fn.caller(cli, prefix, *args)
 
 def ping_server(cli):
     cli.send("PING :{0}".format(time.time()))
@@ -216,11 +249,58 @@ def latency(var, wrapper, message):
     def latency_pong(cli, server, target, ts):
         lat = round(time.time() - float(ts), 3)
         wrapper.reply(messages["latency"].format(lat))
+        ctl = cli.rate_control
+        if ctl is not None and ctl.srtt is not None:
+            wrapper.reply(messages["latency_adaptive"].format(ctl.srtt, ctl.baseline, ctl.bucket.fill_rate,
+                                                              int(ctl.bucket.capacity), ctl.throttled))
+        queue = cli.outbound.stats()
+        wrapper.reply(messages["latency_queue"].format(*(depth for priority, depth, age in queue[:4]),
+                                                       max(age for priority, depth, age in queue)))
         hook.unhook(300)
 
+@hook("pong")
+def on_pong(cli, server, target, ts=""):
+    if cli.rate_control is not None:
+        cli.rate_control.pong(ts)
+
+@command("fprofile", flag="D", pm=True)
+def fprofile(var, wrapper, message):
+    """Profile event listeners. Use on/off to toggle profiling, reset to clear collected data,
+    export to save it as JSON, or a number to show that many of the slowest listeners."""
+    args = message.split()
+    action = args[0].lower() if args else ""
+
+    if action == "on":
+        var.PROFILE_EVENTS = True
+        wrapper.pm(messages["fprofile_on"])
+    elif action == "off":
+        var.PROFILE_EVENTS = False
+        wrapper.pm(messages["fprofile_off"])
+    elif action == "reset":
+        reset_listener_stats()
+        wrapper.pm(messages["fprofile_reset"])
+    elif action == "export":
+        stats = get_listener_stats()
+        with open(var.PROFILE_EVENTS_FILE, "w", encoding="utf-8") as f:
+            json.dump([x.as_dict() for x in stats], f, indent=4)
+        wrapper.pm(messages["fprofile_exported"].format(len(stats), var.PROFILE_EVENTS_FILE))
+    else:
+        count = 10
+        if action.isdigit():
+            count = int(action)
+        stats = get_listener_stats()[:count]
+        if not stats:
+            wrapper.pm(messages["fprofile_none"])
+            return
+        lines = []
+        for x in stats:
+            lines.append(messages["fprofile_entry"].format(x.event, x.listener_id, x.calls, x.total, x.percentile(99) * 1000))
+        wrapper.pm(*lines, sep="\n")
+
 def run_lagcheck(cli):
     from oyoyo.client import TokenBucket
     cli.tokenbucket = TokenBucket(100, 0.1)
+    cli.rate_control = None # we're measuring the limits ourselves
     plog("Lag check in progress. The bot will quit IRC after this is complete. This may take several minutes.")
     plog("The bot may restart a couple of times during the check.")
 
@@ -316,9 +396,30 @@ def _lagcheck_2(cli, timings, max_phases):
 
     cli.quit()
 
+# changes with every connection (and every lost one), so that the ping timers of an old connection stop
+_connection_id = 0
+
+def disconnect_callback(cli):
+    global _connection_id
+    _connection_id += 1
+    plog("Lost connection to the server; keeping users, channels and the game while reconnecting")
+    event = Event("irc_disconnected", {})
+    event.dispatch(var, cli)
+
 def connect_callback(cli):
+    global _connection_id
+    _connection_id += 1
+    connection_id = _connection_id
     regaincount = 0
     releasecount = 0
+    # when the connection was lost and opened again, the bot user and everything we knew is kept
+    reconnecting = users.Bot is not None and users.Bot.client is cli
+    if reconnecting:
+        # these were set up for the previous connection, and are set up again below
+        for hookid in (239, 240, 241, 242):
+            hook.unhook(hookid)
+    # nothing we asked the previous connection will be answered anymore
+    WhoQueue.clear()
 
     @hook("endofmotd", hookid=294)
     @hook("nomotd", hookid=294)
@@ -326,8 +427,10 @@ def connect_callback(cli):
         from src import lagcheck
         plog("Received end of MOTD from {0}".format(prefix))
 
-        # This callback only sets up event listeners
-        wolfgame.connect_callback()
+        rejoining = channels.Main is not None
+        if not rejoining:
+            # This callback only sets up event listeners
+            wolfgame.connect_callback()
 
         # just in case we haven't managed to successfully auth yet
         if botconfig.PASS and not botconfig.SASL_AUTHENTICATION:
@@ -341,7 +444,11 @@ def connect_callback(cli):
         event.dispatch(var, cli)
 
         # don't join any channels if we're just doing a lag check
-        if not lagcheck:
+        if rejoining:
+            # the channels still know who was in them; the WHO sent on joining tells us what changed
+            for chan in channels.channels():
+                chan.join()
+        elif not lagcheck:
             channels.Main = channels.add(botconfig.CHANNEL, cli)
             channels.Dummy = channels.add("*", cli)
 
@@ -361,14 +468,19 @@ def connect_callback(cli):
 
         users.Bot.change_nick(botconfig.NICK)
 
-        if var.SERVER_PING_INTERVAL > 0:
+        interval = var.SERVER_PING_INTERVAL
+        if cli.rate_control is not None:
+            # the rate controller needs regular samples to work from
+            interval = min(interval, var.IRC_TB_PING_INTERVAL) if interval > 0 else var.IRC_TB_PING_INTERVAL
+
+        if interval > 0:
             def ping_server_timer(cli):
+                if connection_id != _connection_id:
+                    return
                 ping_server(cli)
+                timer.start()
 
-                t = threading.Timer(var.SERVER_PING_INTERVAL, ping_server_timer, args=(cli,))
-                t.daemon = True
-                t.start()
-
+            timer = Timer(interval, ping_server_timer, (cli,))
             ping_server_timer(cli)
 
         hook.unhook(294)
@@ -425,16 +537,21 @@ def connect_callback(cli):
         hook("unavailresource", hookid=240)(mustrelease)
         hook("nicknameinuse", hookid=241)(mustregain)
 
-    request_caps = {"account-notify", "chghost", "extended-join", "multi-prefix"}
+    request_caps = {"account-notify", "account-tag", "chghost", "extended-join", "multi-prefix"}
 
     if botconfig.SASL_AUTHENTICATION:
         request_caps.add("sasl")
 
+    if reconnecting:
+        # capabilities are negotiated again from scratch
+        for cap in request_caps:
+            Features.unset(cap)
+
     supported_caps = set()
     supported_sasl = None
     selected_sasl = None
 
-    @hook("cap")
+    @hook("cap", hookid=242)
     def on_cap(cli, svr, mynick, cmd, *caps):
         nonlocal supported_sasl, selected_sasl
         # caps is a star because we might receive multiline in LS
@@ -515,7 +632,7 @@ def connect_callback(cli):
                 Features.unset(item)
 
     if botconfig.SASL_AUTHENTICATION:
-        @hook("authenticate")
+        @hook("authenticate", hookid=242)
         def auth_plus(cli, something, plus):
             if plus == "+":
                 if selected_sasl == "EXTERNAL":
@@ -526,15 +643,15 @@ def connect_callback(cli):
                     auth_token = base64.b64encode(b"\0".join((account, account, password))).decode("utf-8")
                     cli.send("AUTHENTICATE " + auth_token, log="AUTHENTICATE [redacted]")
 
-        @hook("saslsuccess")
+        @hook("saslsuccess", hookid=242)
         def on_successful_auth(cli, blah, blahh, blahhh):
             nonlocal selected_sasl
             Features["sasl"] = selected_sasl
             cli.send("CAP END")
 
-        @hook("saslfail")
-        @hook("sasltoolong")
-        @hook("saslaborted")
+        @hook("saslfail", hookid=242)
+        @hook("sasltoolong", hookid=242)
+        @hook("saslaborted", hookid=242)
         def on_failure_auth(cli, *etc):
             nonlocal selected_sasl
             if selected_sasl == "EXTERNAL" and (supported_sasl is None or "PLAIN" in supported_sasl):
@@ -548,4 +665,5 @@ def connect_callback(cli):
                 cli.quit()
                 sys.exit(1)
 
-    users.Bot = users.BotUser(cli, botconfig.NICK)
+    if not reconnecting:
+        users.Bot = users.BotUser(cli, botconfig.NICK)
@@ -6,7 +6,7 @@ further in the relevant hook functions.
 
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, List, Set, Tuple
 
 from src.decorators import event_listener, hook
 from src.context import Features, NotLoggedIn
@@ -18,6 +18,47 @@ from src import context, channels, users
 ### WHO/WHOX responses handling
 
 _who_old = {} # type: Dict[str, users.User]
+# channels we rejoined after the connection was lost -> (users not seen in the WHO reply yet, users new to the channel)
+_reconciling = {} # type: Dict[channels.Channel, Tuple[Set[users.User], List[users.User]]]
+
+def _who_channel(ch, user, modes):
+    """Record a user as being in a channel, as given by a WHO reply."""
+
+    if ch is None:
+        return
+    if ch in _reconciling:
+        missing, joined = _reconciling[ch]
+        if user in missing:
+            missing.discard(user)
+        elif ch not in user.channels:
+            joined.append(user)
+    elif ch in user.channels:
+        return
+
+    user.channels[ch] = modes
+    ch.users.add(user)
+    for mode in modes:
+        if mode not in ch.modes:
+            ch.modes[mode] = set()
+        ch.modes[mode].add(user)
+
+def _end_reconcile(ch):
+    """Catch up on who left or joined a channel while we were disconnected."""
+
+    missing, joined = _reconciling.pop(ch)
+    for user in missing:
+        if ch in user.channels: # they may have been seen leaving since
+            Event("chan_part", {}).dispatch(ch, user, "")
+            ch.remove_user(user)
+    for user in joined:
+        Event("chan_join", {}).dispatch(ch, user)
+
+@event_listener("irc_disconnected")
+def on_disconnected(evt, var, cli):
+    # the replies we were collecting will never be completed
+    _who_old.clear()
+    _whois_pending.clear()
+    _reconciling.clear()
 
 @hook("whoreply")
 def who_reply(cli, bot_server, bot_nick, chan, ident, host, server, nick, status, hopcount_gecos):
@@ -54,13 +95,7 @@ def who_reply(cli, bot_server, bot_nick, chan, ident, host, server, nick, status
         user = users.add(cli, nick=nick, ident=ident, host=host)
 
     ch = channels.get(chan, allow_none=True)
-    if ch is not None and ch not in user.channels:
-        user.channels[ch] = modes
-        ch.users.add(user)
-        for mode in modes:
-            if mode not in ch.modes:
-                ch.modes[mode] = set()
-            ch.modes[mode].add(user)
+    _who_channel(ch, user, modes)
 
     _who_old[user.nick] = user
     event = Event("who_result", {}, away=is_away, data=0, old=user)
@@ -125,13 +160,7 @@ def extended_who_reply(cli, bot_server, bot_nick, data, chan, ident, ip_address,
         Event("account_change", {}, old=user).dispatch(new_user, old_account)
 
     ch = channels.get(chan, allow_none=True)
-    if ch is not None and ch not in user.channels:
-        user.channels[ch] = modes
-        ch.users.add(user)
-        for mode in modes:
-            if mode not in ch.modes:
-                ch.modes[mode] = set()
-            ch.modes[mode].add(user)
+    _who_channel(ch, user, modes)
 
     _who_old[new_user.nick] = user
     event = Event("who_result", {}, away=is_away, data=data, old=user)
@@ -151,10 +180,14 @@ def end_who(cli, bot_server, bot_nick, target, rest):
 
     This fires off the "who_end" event, and dispatches it with one
     argument: The channel or user the request was made to, or None
-    if it could not be resolved.
+    if it could not be resolved. If the request was a channel WHO that
+    stood in for looking up some of its users one by one, the event is
+    also fired for each of those users.
 
     """
 
+    covered = context.WhoQueue.done(target)
+
     try:
         target = channels.get(target)
     except KeyError:
@@ -164,8 +197,21 @@ def end_who(cli, bot_server, bot_nick, target, rest):
             target = None
     else:
         target.dispatch_queue()
+        if target in _reconciling:
+            _end_reconcile(target)
 
     old = _who_old.get(target.name, target)
+    replied = {context.lower(nick): user for nick, user in _who_old.items()}
+    for user in covered:
+        if context.lower(user.nick) not in replied:
+            # they weren't in the channel by the time the server answered, look them up directly
+            user = users.get(user.nick, allow_none=True)
+            if user is not None:
+                user.who()
+            continue
+        new_user = users.get(user.nick, allow_bot=True, allow_none=True)
+        if new_user is not None:
+            Event("who_end", {}, old=replied[context.lower(user.nick)]).dispatch(new_user)
     _who_old.clear()
     Event("who_end", {}, old=old).dispatch(target)
 
@@ -281,6 +327,7 @@ def on_whois_end(cli, bot_server, bot_nick, nick, message):
 
     """
 
+    context.WhoQueue.done(nick, whois=True)
     values = _whois_pending.pop(nick)
     # check for account change
     new_user = user = values["user"]
@@ -701,6 +748,15 @@ def join_chan(cli, rawnick, chan, account=None, realname=None):
         # ensure we work for the case when user left, changed accounts, then rejoined as a different account
         user.account = account
         user = users.get(nick=rawnick, account=account)
+    if user is users.Bot and ch.users:
+        # we were here before losing the connection; rather than starting over, the WHO
+        # sent below tells us who is still around, and their modes are filled in again
+        _reconciling[ch] = (set(ch.users) - {users.Bot}, [])
+        ch.modes.clear()
+        for member in ch.users:
+            member.channels[ch] = set()
+    elif ch in _reconciling:
+        _reconciling[ch][0].discard(user)
     ch.users.add(user)
     user.channels[ch] = set()
     # mark the user as here, in case they used to be connected before but left
@@ -0,0 +1,56 @@
+""" Check that the native and ANTLR message parsers agree on the whole message catalog.
+
+Every message (and every variant of list messages) is compiled with both parsers, and
+the resulting node trees must be identical, or both parsers must fail with the same
+type of error. Run this after changing either parser or the grammar:
+
+    python -m src.messages.compare
+
+The ANTLR parser needs the antlr4 runtime to be installed. Exits with status 1 and
+lists the differing messages if there are any.
+"""
+
+import sys
+from typing import List, Tuple
+
+from src.messages import messages, message_formatter
+from src.messages.message import Message
+from src.messages.native import NativeParser
+
+__all__ = ["compare_parsers"]
+
+def _compile(key: str, value: str, native: bool):
+    try:
+        if native:
+            return "ok", NativeParser(key, value, message_formatter).parse().root
+        from src.messages.listener import compile_message
+        return "ok", compile_message(Message(key, value)).root
+    except Exception as e:
+        return "error", type(e).__name__
+
+def compare_parsers() -> Tuple[int, List[str]]:
+    """ Compile the catalog with both parsers.
+
+    :return: The number of messages checked, and a description of each one the parsers disagree on
+    """
+    strings = [] # type: List[Tuple[str, str]]
+    for key, value in messages.messages.items():
+        if isinstance(value, str):
+            strings.append((key, value))
+        elif isinstance(value, list):
+            strings.extend((key, x) for x in value if isinstance(x, str))
+
+    mismatches = []
+    for key, value in strings:
+        antlr = _compile(key, value, native=False)
+        native = _compile(key, value, native=True)
+        if antlr != native:
+            mismatches.append("{0}: {1!r}\n  antlr:  {2!r}\n  native: {3!r}".format(key, value, antlr, native))
+    return len(strings), mismatches
+
+if __name__ == "__main__":
+    total, mismatches = compare_parsers()
+    for mismatch in mismatches:
+        print(mismatch)
+    print("{0} messages checked, {1} mismatched".format(total, len(mismatches)))
+    sys.exit(1 if mismatches else 0)
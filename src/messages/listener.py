@@ -1,51 +1,77 @@
-from antlr4 import TerminalNode
+from antlr4 import InputStream, CommonTokenStream, ParseTreeWalker, TerminalNode
+from antlr4.error.ErrorListener import ErrorListener
+from src.messages.lexer import Lexer
+from src.messages.parser import Parser
 from src.messages.message_parserListener import message_parserListener
 from src.messages.message_parser import message_parser
+from src.messages.template import Template, Text, Tag, Sub, Spec, simplify
+
+__all__ = ["Listener", "MessageErrorListener", "compile_message"]
+
+def compile_message(message) -> Template:
+    """ Compile a message into a Template using the ANTLR lexer and parser. """
+    error_listener = MessageErrorListener()
+    input_stream = InputStream(message.value)
+    lexer = Lexer(message.key, input_stream)
+    lexer.addErrorListener(error_listener)
+    token_stream = CommonTokenStream(lexer)
+    parser = Parser(message.key, token_stream)
+    parser.addErrorListener(error_listener)
+    tree = parser.main()
+    listener = Listener(message)
+    walker = ParseTreeWalker()
+    walker.walk(listener, tree)
+    return listener.value()
+
+class MessageErrorListener(ErrorListener):
+    """Raise exceptions whenever a lexer or parser error occurs.
+
+    By default, errors are printed to stderr (kinda useless), and parsing continues as if nothing happened.
+    Then it tries to call our tree listener with bad parse state, which causes things to blow up down the line.
+    The exception messages from that are less-than intuitive, when we really just want to know the message itself
+    is bad."""
+    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+        raise RuntimeError("Ill-formed message \"{0}\" (offset {1}): {2}".format(recognizer.message_key, column, msg))
 
 class Listener(message_parserListener):
-    def __init__(self, message, args, kwargs):
+    """ Compile a parse tree into a reusable Template.
+
+    Values are only resolved once the resulting template is formatted; this merely
+    builds the tree of nodes that describes how to resolve them.
+    """
+    def __init__(self, message):
         super().__init__()
         self._value = None
         self.nest_level = 0
-        self.used_args = set()
         self.message = message
-        self.args = args
-        self.kwargs = kwargs
 
-    def value(self):
+    def value(self) -> Template:
         if self._value is None:
             raise ValueError("Parse error: {}: Unexpected end of message".format(self.message.key))
         return self._value
 
     def _join_fragments(self, fragments, *, enforce_string=False):
-        # fragments is typically a generator function but we need to access values multiple times
-        fragment_list = list(fragments)
-
-        bits = []
-        for node in fragment_list:
+        parts = []
+        for node in fragments:
             if isinstance(node, TerminalNode):
-                bits.append(node.getText())
+                parts.append(Text(node.getText()))
             else:
-                bits.append(node.value)
-
-        if not enforce_string and len(bits) == 1:
-            return bits[0]
+                parts.append(node.value)
 
-        return "".join(str(x) for x in bits)
+        return simplify(tuple(parts), enforce_string=enforce_string)
 
     def _coalesce(self, *args, default=None):
         for thing in args:
             if thing is None:
                 continue
             if isinstance(thing, TerminalNode):
-                return thing.getText()
+                return Text(thing.getText())
             return thing.value
 
         return default
 
     def exitMain(self, ctx: message_parser.MainContext):
-        self._value = ctx.string().value
-        self.message.formatter.check_unused_args(self.used_args, self.args, self.kwargs)
+        self._value = Template(self.message.key, ctx.string().value)
 
     def exitString(self, ctx: message_parser.StringContext):
         ctx.value = self._join_fragments(ctx.getChildren(), enforce_string=True)
@@ -68,7 +94,7 @@ class Listener(message_parserListener):
             raise ValueError("Parse error: {}: Unknown tag {} ({})".format(
                              self.message.key, tag_name, ctx.open_tag().OPEN_TAG().getSymbol().column))
 
-        ctx.value = tag_func(content, param)
+        ctx.value = Tag(tag_name, param, content)
 
     def exitOpen_tag(self, ctx: message_parser.Open_tagContext):
         ctx.value = (ctx.TAG_NAME().getText(), self._coalesce(ctx.tag_param()))
@@ -89,24 +115,10 @@ class Listener(message_parserListener):
         self.nest_level -= 1
         flatten_lists = self.nest_level == 0
 
-        field_name = ctx.sub_field().value
+        field = ctx.sub_field().value
         convert = self._coalesce(ctx.sub_convert())
-        spec = dict(x.value for x in ctx.sub_spec())
-        # if spec is empty, change it to None. Makes us more consistent with built in format method
-        # (since formatter can be used for both this parse tree as well as normal formatting)
-        if not spec:
-            spec = None
-
-        # get_field internally calls get_value(), and then resolves attributes/indexes like 0.foo or 1[2]
-        # the returned obj is end result of resolving all of that
-        obj, key = self.message.formatter.get_field(field_name, self.args, self.kwargs)
-        self.used_args.add(key)
-        obj = self.message.formatter.convert_field(obj, convert)
-        obj = self.message.formatter.format_field(obj, spec, flatten_lists=flatten_lists)
-
-        # obj is not necessarily a string here; we support passing objects through until the point where we need
-        # to concatenate them with other things (at which point we coerce to string)
-        ctx.value = obj
+        specs = tuple(x.value for x in ctx.sub_spec())
+        ctx.value = Sub(field, convert, specs, flatten_lists)
 
     def exitSub_field(self, ctx: message_parser.Sub_fieldContext):
         ctx.value = self._join_fragments(ctx.sub_field_frag())
@@ -124,13 +136,13 @@ class Listener(message_parserListener):
         ctx.value = self._coalesce(ctx.spec_func(), ctx.spec_literal())
 
     def exitSpec_literal(self, ctx: message_parser.Spec_literalContext):
-        ctx.value = (self._join_fragments(ctx.spec_literal_frag(), enforce_string=True), None)
+        ctx.value = Spec(self._join_fragments(ctx.spec_literal_frag(), enforce_string=True), None)
 
     def exitSpec_literal_frag(self, ctx: message_parser.Spec_literal_fragContext):
         ctx.value = self._coalesce(ctx.sub(), ctx.SPEC_VALUE())
 
     def exitSpec_func(self, ctx: message_parser.Spec_funcContext):
-        ctx.value = (ctx.SPEC_VALUE().getText(), ctx.spec_func_arg().value)
+        ctx.value = Spec(Text(ctx.SPEC_VALUE().getText()), ctx.spec_func_arg().value)
 
     def exitSpec_func_arg(self, ctx: message_parser.Spec_func_argContext):
         ctx.value = self._join_fragments(ctx.spec_func_arg_frag())
@@ -1,13 +1,15 @@
 import random
-from antlr4 import InputStream, CommonTokenStream, ParseTreeWalker
-from antlr4.error.ErrorListener import ErrorListener
+from typing import Dict, Tuple
+import src.settings as var
 from src.messages import message_formatter
-from src.messages.lexer import Lexer
-from src.messages.parser import Parser
-from src.messages.listener import Listener
+from src.messages.native import NativeParser
+from src.messages.template import Template
 
 __all__ = ["Message"]
 
+# Compiled templates, keyed by message key and the (possibly list-indexed) template string
+compiled_cache = {} # type: Dict[Tuple[str, str], Template]
+
 
 class Message:
     def __init__(self, key, value, index=None):
@@ -37,35 +39,27 @@ class Message:
     def __radd__(self, other):
         return other + str(self)
 
+    def compile(self) -> Template:
+        """Retrieve the compiled template for this message, parsing it if it hasn't been seen before."""
+        cache_key = (self.key, self.value)
+        template = compiled_cache.get(cache_key)
+        if template is None:
+            if var.MESSAGE_PARSER == "native":
+                template = NativeParser(self.key, self.value, self.formatter).parse()
+            else:
+                # only pull in the antlr4 runtime if we actually need it
+                from src.messages.listener import compile_message
+                template = compile_message(self)
+            compiled_cache[cache_key] = template
+        return template
+
     def format(self, *args, **kwargs):
         try:
-            error_listener = MessageErrorListener()
-            input_stream = InputStream(self.value)
-            lexer = Lexer(self.key, input_stream)
-            lexer.addErrorListener(error_listener)
-            token_stream = CommonTokenStream(lexer)
-            parser = Parser(self.key, token_stream)
-            parser.addErrorListener(error_listener)
-            tree = parser.main()
-            listener = Listener(self, args, kwargs)
-            walker = ParseTreeWalker()
-            walker.walk(listener, tree)
-            return listener.value()
+            return self.compile().format(self.formatter, args, kwargs)
         except Exception as e:
             import botconfig
-            import src.settings as var
             if not botconfig.DEBUG_MODE or not var.DEBUG_MODE_NOTHROW_MESSAGES:
                 raise
 
             return "ERROR: {0!s} ({1}: {2!r}, {3!r})".format(e, self.key, args, kwargs)
 
-
-class MessageErrorListener(ErrorListener):
-    """Raise exceptions whenever a lexer or parser error occurs.
-
-    By default, errors are printed to stderr (kinda useless), and parsing continues as if nothing happened.
-    Then it tries to call our tree listener with bad parse state, which causes things to blow up down the line.
-    The exception messages from that are less-than intuitive, when we really just want to know the message itself
-    is bad."""
-    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
-        raise RuntimeError("Ill-formed message \"{0}\" (offset {1}): {2}".format(recognizer.message_key, column, msg))
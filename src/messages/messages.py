@@ -1,19 +1,32 @@
+import hashlib
 import json
 import os
-from typing import Dict, Set
+import pickle
+from typing import Dict, Optional, Set, Tuple
 
 import src.settings as var
-from src.messages.message import Message
+from src.messages.message import Message, compiled_cache
+from src.messages.template import Template
 
 MESSAGES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "messages")
 ROOT_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+CACHE_FILE = os.path.join(ROOT_DIR, "messages.cache")
+# Bump this whenever the layout of the cache file changes, to invalidate existing caches
+CACHE_VERSION = 1
+# The code that compiled templates depend on (node classes, parsers and formatter tags). These are
+# hashed into the cache digest, so editing any of them invalidates the cache without bumping CACHE_VERSION.
+COMPILER_FILES = ("template.py", "formatter.py", "native.py", "listener.py",
+                  "lexer.py", "parser.py", "message_lexer.py", "message_parser.py")
 
 
 class Messages:
     def __init__(self):
         self.lang = var.LANGUAGE
         self.cache = {}
+        self._digest = hashlib.sha256()
         self._load_messages()
+        if var.PRECOMPILE_MESSAGES:
+            self.precompile()
 
     def get(self, key, index=None):
         if key not in self.messages:
@@ -122,9 +135,70 @@ class Messages:
         self.cache[cache_key] = totems
         return totems
 
+    def precompile(self):
+        """ Compile every message in the catalog, reporting all ill-formed messages at once.
+
+        If the message files have not changed since the last time this was run, the compiled
+        messages are loaded from the on-disk cache instead.
+        """
+        digest = self._digest.hexdigest()
+        templates = self._load_cache(digest)
+        if templates is not None:
+            compiled_cache.update(templates)
+            return
+
+        errors = []
+        for key, value in self.messages.items():
+            if isinstance(value, str):
+                indices = [None] # type: list
+            elif isinstance(value, list) and all(isinstance(x, str) for x in value):
+                indices = list(range(len(value)))
+            else:
+                continue
+            for index in indices:
+                try:
+                    Message(key, value, index).compile()
+                except Exception as e:
+                    errors.append(str(e))
+
+        if errors:
+            raise ValueError("{0} ill-formed message(s):\n{1}".format(len(errors), "\n".join(errors)))
+
+        self._save_cache(digest, compiled_cache)
+
+    def _load_cache(self, digest: str) -> Optional[Dict[Tuple[str, str], Template]]:
+        try:
+            with open(CACHE_FILE, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION or data.get("digest") != digest:
+            return None
+        return data["templates"]
+
+    def _save_cache(self, digest: str, templates: Dict[Tuple[str, str], Template]):
+        data = {"version": CACHE_VERSION, "digest": digest, "templates": dict(templates)}
+        try:
+            with open(CACHE_FILE, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # the cache is purely an optimization; if we can't write it, we just compile again next time
+            pass
+
+    def _read_json(self, path: str):
+        with open(path, "rb") as f:
+            raw = f.read()
+        # anything that changes which compiled messages we would end up with needs to go into the digest
+        self._digest.update(path.encode("utf-8") + b"\0" + raw + b"\0")
+        return json.loads(raw.decode("utf-8"))
+
     def _load_messages(self):
-        with open(os.path.join(MESSAGES_DIR, self.lang + ".json"), encoding="utf-8") as f:
-            self.messages = json.load(f)
+        self._digest.update(var.MESSAGE_PARSER.encode("utf-8") + b"\0")
+        for name in COMPILER_FILES:
+            with open(os.path.join(os.path.dirname(__file__), name), "rb") as f:
+                self._digest.update(name.encode("utf-8") + b"\0" + f.read() + b"\0")
+        self.messages = self._read_json(os.path.join(MESSAGES_DIR, self.lang + ".json"))
 
         fallback = self.messages["_metadata"]["fallback"]
         seen = {self.lang}
@@ -132,17 +206,15 @@ class Messages:
             if fallback in seen:
                 raise TypeError("Fallback loop detected")
             seen.add(fallback)
-            with open(os.path.join(MESSAGES_DIR, fallback + ".json"), encoding="utf-8") as f:
-                fallback_msgs = json.load(f)
-                fallback = fallback_msgs["_metadata"]["fallback"]
-                for key, message in fallback_msgs.items():
-                    if key not in self.messages:
-                        self.messages[key] = message
+            fallback_msgs = self._read_json(os.path.join(MESSAGES_DIR, fallback + ".json"))
+            fallback = fallback_msgs["_metadata"]["fallback"]
+            for key, message in fallback_msgs.items():
+                if key not in self.messages:
+                    self.messages[key] = message
 
         if not os.path.isfile(os.path.join(ROOT_DIR, "messages.json")):
             return
-        with open(os.path.join(ROOT_DIR, "messages.json"), encoding="utf-8") as f:
-            custom_msgs = json.load(f)
+        custom_msgs = self._read_json(os.path.join(ROOT_DIR, "messages.json"))
 
         if not custom_msgs:
             return
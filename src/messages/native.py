@@ -0,0 +1,231 @@
+import re
+from typing import List, Optional, Tuple
+
+from src.messages.template import Template, Node, Text, Tag, Sub, Spec, simplify
+
+__all__ = ["NativeParser"]
+
+_TEXT = re.compile(r"[^\[\]{}]+")
+_TAG_NAME = re.compile(r"[a-zA-Z]+")
+_TAG_PARAM = re.compile(r"[^\[\]{}]+")
+_SUB_FIELD = re.compile(r"[^!:{}]+")
+_IDENTIFIER = re.compile(r"[a-zA-Z]+")
+_SPEC_VALUE = re.compile(r"[^:{}()]+")
+_ARGLIST_VALUE = re.compile(r"[^{}()]+")
+
+class NativeParser:
+    """ Hand-written recursive descent parser for message templates.
+
+    This accepts exactly the language described by message_lexer.g4 and message_parser.g4
+    and builds the same Template that the ANTLR parse tree listener does, without needing
+    the antlr4 runtime. Syntax errors raise RuntimeError, while semantic errors (mismatched
+    or unknown tags) raise ValueError once the whole message has been parsed, same as the
+    ANTLR pipeline.
+    """
+    def __init__(self, key: str, value: str, formatter):
+        self.key = key
+        self.text = value
+        self.formatter = formatter
+        self.pos = 0
+        self._errors = [] # type: List[str]
+
+    def parse(self) -> Template:
+        root = self._string()
+        if self.pos < len(self.text):
+            # the only way _string() stops early without raising is at a close tag
+            self._error("extraneous input '[/' expecting <EOF>")
+        if self._errors:
+            raise ValueError(self._errors[0])
+        return Template(self.key, root)
+
+    def _column(self, pos: int) -> int:
+        return pos - (self.text.rfind("\n", 0, pos) + 1)
+
+    def _error(self, msg: str, pos: Optional[int] = None):
+        if pos is None:
+            pos = self.pos
+        raise RuntimeError("Ill-formed message \"{0}\" (offset {1}): {2}".format(self.key, self._column(pos), msg))
+
+    def _peek(self, offset: int = 0) -> str:
+        pos = self.pos + offset
+        if pos < len(self.text):
+            return self.text[pos]
+        return ""
+
+    def _expect(self, c: str):
+        if self._peek() != c:
+            if self.pos >= len(self.text):
+                self._error("missing {0!r} at <EOF>".format(c))
+            self._error("mismatched input {0!r} expecting {1!r}".format(self._peek(), c))
+        self.pos += 1
+
+    def _match(self, regex) -> Optional[str]:
+        m = regex.match(self.text, self.pos)
+        if m is None:
+            return None
+        self.pos = m.end()
+        return m.group()
+
+    def _escape(self, allowed: str) -> Optional[str]:
+        """ Consume a doubled-up escape character, if present and one of the allowed characters. """
+        c = self._peek()
+        if c and c in allowed and self._peek(1) == c:
+            self.pos += 2
+            return c
+        return None
+
+    def _string(self) -> Node:
+        parts = [] # type: List[Node]
+        while self.pos < len(self.text):
+            run = self._match(_TEXT)
+            if run is not None:
+                parts.append(Text(run))
+                continue
+            escaped = self._escape("[]{}")
+            if escaped is not None:
+                parts.append(Text(escaped))
+                continue
+            c = self._peek()
+            if c == "[":
+                if self._peek(1) == "/":
+                    break
+                parts.append(self._tag())
+            elif c == "{":
+                parts.append(self._sub(0))
+            else:
+                self._error("token recognition error at: {0!r}".format(c))
+
+        return simplify(tuple(parts), enforce_string=True)
+
+    def _tag(self) -> Node:
+        open_pos = self.pos
+        self._expect("[")
+        tag_name = self._match(_TAG_NAME)
+        if tag_name is None:
+            self._error("mismatched input {0!r} expecting TAG_NAME".format(self._peek()))
+        param = None
+        if self._peek() == "=":
+            self.pos += 1
+            param = self._tag_param()
+        self._expect("]")
+
+        content = self._string()
+
+        if self.pos >= len(self.text):
+            self._error("missing '[' at <EOF>")
+        self._expect("[")
+        self._expect("/")
+        close_name = self._match(_TAG_NAME)
+        if close_name is None:
+            self._error("mismatched input {0!r} expecting TAG_NAME".format(self._peek()))
+        close_pos = self.pos
+        self._expect("]")
+
+        if tag_name != close_name:
+            self._errors.append("Parse error: {}: Opening tag {} ({}) does not match closing tag {} ({})".format(
+                                self.key, tag_name, self._column(open_pos), close_name, self._column(close_pos)))
+
+        tag_func = getattr(self.formatter, "tag_" + tag_name, None)
+        if not tag_func or not callable(tag_func):
+            self._errors.append("Parse error: {}: Unknown tag {} ({})".format(self.key, tag_name, self._column(open_pos)))
+
+        return Tag(tag_name, param, content)
+
+    def _tag_param(self) -> Node:
+        parts = [] # type: List[Node]
+        while True:
+            run = self._match(_TAG_PARAM)
+            if run is not None:
+                parts.append(Text(run))
+                continue
+            escaped = self._escape("{}")
+            if escaped is not None:
+                parts.append(Text(escaped))
+                continue
+            c = self._peek()
+            if c == "{":
+                parts.append(self._sub(0))
+            elif c == "]" and parts:
+                break
+            elif not c:
+                self._error("mismatched input '<EOF>' expecting ']'")
+            else:
+                self._error("token recognition error at: {0!r}".format(c))
+
+        return simplify(tuple(parts), enforce_string=False)
+
+    def _sub(self, depth: int) -> Node:
+        self._expect("{")
+        parts = [] # type: List[Node]
+        while True:
+            run = self._match(_SUB_FIELD)
+            if run is not None:
+                parts.append(Text(run))
+            elif self._peek() == "{":
+                parts.append(self._sub(depth + 1))
+            else:
+                break
+        if not parts:
+            self._error("mismatched input {0!r} expecting SUB_FIELD".format(self._peek() or "<EOF>"))
+        field = simplify(tuple(parts), enforce_string=False)
+
+        convert = None
+        if self._peek() == "!":
+            self.pos += 1
+            convert = self._match(_IDENTIFIER)
+            if convert is None:
+                self._error("mismatched input {0!r} expecting SUB_IDENTIFIER".format(self._peek() or "<EOF>"))
+
+        specs = [] # type: List[Spec]
+        while self._peek() == ":":
+            self.pos += 1
+            specs.append(self._spec(depth))
+
+        if self.pos >= len(self.text):
+            self._error("missing '}' at <EOF>")
+        self._expect("}")
+        return Sub(field, convert, tuple(specs), depth == 0)
+
+    def _spec(self, depth: int) -> Spec:
+        parts = [] # type: List[Node]
+        while True:
+            run = self._match(_SPEC_VALUE)
+            if run is not None:
+                parts.append(Text(run))
+            elif self._peek() == "{":
+                parts.append(self._sub(depth + 1))
+            else:
+                break
+
+        if self._peek() == "(" and len(parts) == 1 and isinstance(parts[0], Text):
+            self.pos += 1
+            arg = self._arglist(depth)
+            self._expect(")")
+            return Spec(parts[0], arg)
+
+        if not parts:
+            self._error("mismatched input {0!r} expecting SPEC_VALUE".format(self._peek() or "<EOF>"))
+        return Spec(simplify(tuple(parts), enforce_string=True), None)
+
+    def _arglist(self, depth: int) -> Node:
+        parts = [] # type: List[Node]
+        while True:
+            run = self._match(_ARGLIST_VALUE)
+            if run is not None:
+                parts.append(Text(run))
+                continue
+            escaped = self._escape("{}")
+            if escaped is not None:
+                parts.append(Text(escaped))
+                continue
+            c = self._peek()
+            if c == "{":
+                parts.append(self._sub(depth + 1))
+            elif c == ")" and parts:
+                break
+            elif c == ")" or not c:
+                self._error("mismatched input {0!r} expecting ARGLIST_VALUE".format(c or "<EOF>"))
+            else:
+                self._error("token recognition error at: {0!r}".format(c))
+
+        return simplify(tuple(parts), enforce_string=False)
@@ -0,0 +1,183 @@
+from typing import Any, Optional, Tuple
+
+__all__ = ["Template", "Text", "String", "Concat", "Tag", "Sub", "Spec", "simplify"]
+
+class Node:
+    """ Base class for compiled message nodes.
+
+    A message template is parsed once into a tree of nodes; formatting then only needs to evaluate
+    that tree against the given args and kwargs. Evaluation order mirrors the order the parse tree
+    listener used to resolve things in, so side effects (used args, :random) behave identically.
+    """
+    __slots__ = ()
+
+    def evaluate(self, formatter, args, kwargs, used_args) -> Any:
+        raise NotImplementedError
+
+class Text(Node):
+    """ Literal text, with escapes already resolved. """
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return "Text({0!r})".format(self.text)
+
+    def __eq__(self, other):
+        return isinstance(other, Text) and self.text == other.text
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        return self.text
+
+class String(Node):
+    """ A sequence of fragments that is always coerced into a string. """
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: Tuple[Node, ...]):
+        self.parts = parts
+
+    def __repr__(self):
+        return "String({0!r})".format(self.parts)
+
+    def __eq__(self, other):
+        return isinstance(other, String) and self.parts == other.parts
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        return "".join([str(x.evaluate(formatter, args, kwargs, used_args)) for x in self.parts])
+
+class Concat(Node):
+    """ A sequence of fragments; a single fragment is passed through without being coerced into a string. """
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: Tuple[Node, ...]):
+        self.parts = parts
+
+    def __repr__(self):
+        return "Concat({0!r})".format(self.parts)
+
+    def __eq__(self, other):
+        return isinstance(other, Concat) and self.parts == other.parts
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        if len(self.parts) == 1:
+            return self.parts[0].evaluate(formatter, args, kwargs, used_args)
+        return "".join([str(x.evaluate(formatter, args, kwargs, used_args)) for x in self.parts])
+
+class Tag(Node):
+    """ A [tag] or [tag=param] block, resolved by calling tag_<name> on the formatter. """
+    __slots__ = ("name", "param", "content")
+
+    def __init__(self, name: str, param: Optional[Node], content: Node):
+        self.name = name
+        self.param = param
+        self.content = content
+
+    def __repr__(self):
+        return "Tag({0!r}, {1!r}, {2!r})".format(self.name, self.param, self.content)
+
+    def __eq__(self, other):
+        return (isinstance(other, Tag) and self.name == other.name
+                and self.param == other.param and self.content == other.content)
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        param = None
+        if self.param is not None:
+            param = self.param.evaluate(formatter, args, kwargs, used_args)
+        # content is always evaluated, even if the tag ends up discarding it (e.g. a false [if]),
+        # so that any substitutions inside of it are still marked as used
+        content = self.content.evaluate(formatter, args, kwargs, used_args)
+        return getattr(formatter, "tag_" + self.name)(content, param)
+
+class Spec(Node):
+    """ A single :spec or :spec(arg) on a substitution. Evaluates to a (name, arg) tuple. """
+    __slots__ = ("name", "arg")
+
+    def __init__(self, name: Node, arg: Optional[Node]):
+        self.name = name
+        self.arg = arg
+
+    def __repr__(self):
+        return "Spec({0!r}, {1!r})".format(self.name, self.arg)
+
+    def __eq__(self, other):
+        return isinstance(other, Spec) and self.name == other.name and self.arg == other.arg
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        name = self.name.evaluate(formatter, args, kwargs, used_args)
+        if self.arg is None:
+            return name, None
+        return name, self.arg.evaluate(formatter, args, kwargs, used_args)
+
+class Sub(Node):
+    """ A {field!convert:spec} substitution. """
+    __slots__ = ("field", "convert", "specs", "flatten_lists")
+
+    def __init__(self, field: Node, convert: Optional[str], specs: Tuple[Spec, ...], flatten_lists: bool):
+        self.field = field
+        self.convert = convert
+        self.specs = specs
+        self.flatten_lists = flatten_lists
+
+    def __repr__(self):
+        return "Sub({0!r}, {1!r}, {2!r}, {3!r})".format(self.field, self.convert, self.specs, self.flatten_lists)
+
+    def __eq__(self, other):
+        return (isinstance(other, Sub) and self.field == other.field and self.convert == other.convert
+                and self.specs == other.specs and self.flatten_lists == other.flatten_lists)
+
+    def evaluate(self, formatter, args, kwargs, used_args):
+        field_name = self.field.evaluate(formatter, args, kwargs, used_args)
+        # if spec is empty, leave it as None. Makes us more consistent with built in format method
+        # (since formatter can be used for both this parse tree as well as normal formatting)
+        spec = None
+        if self.specs:
+            spec = dict(x.evaluate(formatter, args, kwargs, used_args) for x in self.specs)
+
+        # get_field internally calls get_value(), and then resolves attributes/indexes like 0.foo or 1[2]
+        # the returned obj is end result of resolving all of that
+        obj, key = formatter.get_field(field_name, args, kwargs)
+        used_args.add(key)
+        obj = formatter.convert_field(obj, self.convert)
+        # obj is not necessarily a string here; we support passing objects through until the point where we need
+        # to concatenate them with other things (at which point we coerce to string)
+        return formatter.format_field(obj, spec, flatten_lists=self.flatten_lists)
+
+class Template:
+    """ A compiled message, ready to be formatted any number of times. """
+    __slots__ = ("key", "root", "constant")
+
+    def __init__(self, key: str, root: Node):
+        self.key = key
+        self.root = root
+        # messages without any substitutions or tags don't need to be evaluated at all
+        self.constant = root.text if isinstance(root, Text) else None
+
+    def __repr__(self):
+        return "Template({0!r}, {1!r})".format(self.key, self.root)
+
+    def format(self, formatter, args, kwargs) -> str:
+        used_args = set() # type: set
+        if self.constant is not None:
+            value = self.constant
+        else:
+            value = self.root.evaluate(formatter, args, kwargs, used_args)
+        formatter.check_unused_args(used_args, args, kwargs)
+        return value
+
+def simplify(parts: Tuple[Node, ...], *, enforce_string: bool) -> Node:
+    """ Build a String or Concat out of the given fragments, folding literal text where possible. """
+    merged = []
+    for part in parts:
+        if isinstance(part, Text) and merged and isinstance(merged[-1], Text):
+            merged[-1] = Text(merged[-1].text + part.text)
+        else:
+            merged.append(part)
+
+    if not merged and enforce_string:
+        return Text("")
+    if len(merged) == 1 and isinstance(merged[0], Text):
+        return merged[0]
+    if enforce_string:
+        return String(tuple(merged))
+    return Concat(tuple(merged))
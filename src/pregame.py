@@ -4,7 +4,6 @@ from collections import defaultdict, Counter
 from datetime import datetime, timedelta
 
 import threading
-import itertools
 import random
 import time
 import math
@@ -17,6 +16,8 @@ from src.functions import get_players
 from src.warnings import decrement_stasis
 from src.messages import messages
 from src.events import Event
+from src.rolestats import RoleStats
+from src.timers import Timer
 from src.cats import Wolfchat, All
 from src import channels
 
@@ -198,9 +199,8 @@ def start(var, wrapper, *, forced=False, restart=""):
 
                     # If this was the first vote
                     if len(START_VOTES) == 1:
-                        t = threading.Timer(60, expire_start_votes, (var, wrapper.target))
+                        t = Timer(60, expire_start_votes, (var, wrapper.target))
                         var.TIMERS["start_votes"] = (t, time.time(), 60)
-                        t.daemon = True
                         t.start()
                     return
 
@@ -269,39 +269,25 @@ def start(var, wrapper, *, forced=False, restart=""):
         addroles = event.data["addroles"]
 
     # convert roleset aliases into the appropriate roles
-    possible_rolesets = [Counter()]
+    fixed_roles = Counter()
+    active_rolesets = []
     roleset_roles = defaultdict(int)
     var.CURRENT_GAMEMODE.ACTIVE_ROLE_SETS = {}
     for role, amt in list(addroles.items()):
         # not a roleset? add a fixed amount of them
         if role not in var.CURRENT_GAMEMODE.ROLE_SETS:
-            for pr in possible_rolesets:
-                pr[role] += amt
+            fixed_roles[role] += amt
             continue
         # if a roleset, ensure we don't try to expose the roleset name in !stats or future attribution
         # but do keep track of the sets in use so we can have !stats reflect proper information
         var.CURRENT_GAMEMODE.ACTIVE_ROLE_SETS[role] = amt
         del addroles[role]
-        # init !stats with all 0s so that it can number things properly; the keys need to exist in the Counter
-        # across every possible roleset so that !stats works right
         rs = Counter(var.CURRENT_GAMEMODE.ROLE_SETS[role])
-        for r in rs:
-            for pr in possible_rolesets:
-                pr[r] += 0
         toadd = random.sample(list(rs.elements()), amt)
         for r in toadd:
             addroles[r] += 1
             roleset_roles[r] += 1
-        add_rolesets = []
-        temp_rolesets = []
-        for c in itertools.combinations(rs.elements(), amt):
-            add_rolesets.append(Counter(c))
-        for pr in possible_rolesets:
-            for ar in add_rolesets:
-                temp = Counter(pr)
-                temp.update(ar)
-                temp_rolesets.append(temp)
-        possible_rolesets = temp_rolesets
+        active_rolesets.append((rs, amt))
 
     if var.ADMIN_TO_PING is not None and not restart:
         for decor in (COMMANDS["join"] + COMMANDS["start"]):
@@ -354,7 +340,7 @@ def start(var, wrapper, *, forced=False, restart=""):
         if count == 0 or role in var.CURRENT_GAMEMODE.SECONDARY_ROLES:
             continue
 
-        selected = random.sample(vils, count)
+        selected = random.sample(list(vils), count)
         for x in selected:
             var.MAIN_ROLES[x] = role
             var.ORIGINAL_MAIN_ROLES[x] = role
@@ -367,20 +353,9 @@ def start(var, wrapper, *, forced=False, restart=""):
         var.MAIN_ROLES[x] = var.DEFAULT_ROLE
         var.ORIGINAL_MAIN_ROLES[x] = var.DEFAULT_ROLE
     if vils:
-        for pr in possible_rolesets:
-            pr[var.DEFAULT_ROLE] += len(vils)
-
-    # Collapse possible_rolesets into var.ROLE_STATS
-    # which is a FrozenSet[FrozenSet[Tuple[str, int]]]
-    possible_rolesets_set = set()
-    event = Event("reconfigure_stats", {"new": []})
-    for pr in possible_rolesets:
-        event.data["new"] = [pr]
-        event.dispatch(var, pr, "start")
-        for v in event.data["new"]:
-            if min(v.values()) >= 0:
-                possible_rolesets_set.add(frozenset(v.items()))
-    var.ROLE_STATS = frozenset(possible_rolesets_set)
+        fixed_roles[var.DEFAULT_ROLE] += len(vils)
+
+    var.ROLE_STATS = RoleStats.from_rolesets(fixed_roles, active_rolesets).reconfigure(var, "start")
 
     # Now for the secondary roles
     for role, dfn in var.CURRENT_GAMEMODE.SECONDARY_ROLES.items():
@@ -518,9 +493,7 @@ def start(var, wrapper, *, forced=False, restart=""):
     if not (botconfig.DEBUG_MODE and var.DISABLE_DEBUG_MODE_REAPER):
         # DEATH TO IDLERS!
         from src.wolfgame import reaper
-        reapertimer = threading.Thread(None, reaper, args=(wrapper.client, var.GAME_ID))
-        reapertimer.daemon = True
-        reapertimer.start()
+        reaper(wrapper.client, var.GAME_ID)
 
 def _command_disabled(var, wrapper, message):
     wrapper.send(messages["command_disabled_admin"])
@@ -5,6 +5,8 @@ import math
 from collections import defaultdict
 from typing import List, Optional
 
+from oyoyo.client import PRIORITY_LOW
+
 from src.functions import get_main_role, get_players, get_all_roles, get_all_players, get_target
 from src.decorators import event_listener, command
 from src.containers import UserList, UserSet, UserDict, DefaultUserDict
@@ -367,7 +369,7 @@ def send_wolfchat_message(var, user, message, roles, *, role=None, command=None)
     for player in var.SPECTATING_WOLFCHAT:
         player.queue_message(messages["relay_command_wolfchat"].format(message))
     if player is not None:
-        player.send_messages()
+        player.send_messages(priority=PRIORITY_LOW)
 
 def get_wolflist(var,
                  player: users.User,
@@ -95,16 +95,14 @@ def on_chk_win(evt, var, rolemap, mainroles, lpl, lwolves, lrealwolves):
         if var.PHASE in var.GAME_PHASES:
             channels.Main.send(messages["traitor_turn_channel"])
             # fix !stats to show that traitor turned as well
-            newstats = set()
-            for rs in var.ROLE_STATS:
-                d = dict(rs)
+            def turn(d):
                 # traitor count of 0 is not possible since we for-sure turned traitors into wolves earlier
-                # as such, exclude such cases from newstats entirely.
+                # as such, exclude such cases from the stats entirely.
                 if d["traitor"] >= 1:
-                    d["wolf"] = d.get("wolf", 0) + d["traitor"]
+                    d["wolf"] += d["traitor"]
                     d["traitor"] = 0
-                    newstats.add(frozenset(d.items()))
-            var.ROLE_STATS = frozenset(newstats)
+                    yield d
+            var.ROLE_STATS = var.ROLE_STATS.transform(turn)
 
         evt.prevent_default = True
         evt.stop_processing = True
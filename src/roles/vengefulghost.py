@@ -6,16 +6,18 @@ from src.utilities import *
 from src import channels, users, debuglog, errlog, plog
 from src.functions import get_players, get_target, get_main_role, get_all_roles
 from src.decorators import command, event_listener
-from src.containers import UserList, UserSet, UserDict, DefaultUserDict
+from src.containers import UserList, UserSet, UserDict, DefaultUserDict, track_state
 from src.messages import messages
 from src.status import try_misdirection, try_exchange, add_silent, is_silent
 from src.cats import All, Wolfteam
 
 KILLS = UserDict() # type: UserDict[users.User, users.User]
 GHOSTS = UserDict() # type: UserDict[users.User, str]
+track_state(GHOSTS) # who is a ghost changes get_participants()
 
 # temporary holding variable, only non-empty during transition_day
 drivenoff = UserDict() # type: UserDict[users.User, str]
+track_state(drivenoff) # banished ghosts are participants until the day begins
 
 @command("kill", chan=False, pm=True, playing=False, silenced=True, phases=("night",), users=GHOSTS)
 def vg_kill(var, wrapper, message):
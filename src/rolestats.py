@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from collections import Counter
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from src.events import Event
+
+__all__ = ["RoleStats"]
+
+World = FrozenSet[Tuple[str, int]]
+
+def _choices(roleset: Mapping[str, int], amount: int) -> List[Counter]:
+    """Return every distinct way of picking amount roles out of roleset.
+
+    Picking 2 out of {"gunner": 8, "sharpshooter": 4} gives 3 results, where going
+    through every combination of the 12 individual roles would give 66.
+
+    """
+
+    roles = [role for role, count in roleset.items() if count > 0]
+    results = [] # type: List[Counter]
+
+    def pick(index: int, left: int, chosen: Counter):
+        if left == 0:
+            results.append(Counter(chosen))
+            return
+        if index == len(roles):
+            return
+        role = roles[index]
+        for n in range(min(left, roleset[role]), -1, -1):
+            chosen[role] = n
+            pick(index + 1, left - n, chosen)
+        del chosen[role]
+
+    pick(0, amount, Counter())
+    return results
+
+class RoleStats:
+    """The role distributions still possible from what players were told, as used by !stats.
+
+    Each distribution maps roles to how many players have them. Distributions
+    are only kept once each, no matter how many ways there are to arrive at
+    them. Instances are immutable; the methods changing the distributions
+    return a new instance, to be stored back into var.ROLE_STATS.
+
+    Iterating yields each distribution as a frozenset of (role, count) pairs.
+
+    """
+
+    __slots__ = ("_worlds", "_ranges")
+
+    def __init__(self, worlds: Iterable[World] = ()):
+        self._worlds = frozenset(worlds) # type: FrozenSet[World]
+        self._ranges = None # type: Optional[Dict[str, Tuple[int, int]]]
+
+    @classmethod
+    def from_rolesets(cls, fixed: Mapping[str, int], rolesets: Iterable[Tuple[Mapping[str, int], int]]) -> RoleStats:
+        """Build the stats for a game starting with the fixed roles and a number of roles out of each roleset."""
+        worlds = {frozenset(fixed.items())}
+        for roleset, amount in rolesets:
+            # every role of the set is listed, even with a count of 0, so that !stats can number it properly
+            base = {role: 0 for role in roleset}
+            choices = _choices(roleset, amount)
+            new = set()
+            for world in worlds:
+                for choice in choices:
+                    d = Counter(base)
+                    d.update(dict(world))
+                    d.update(choice)
+                    new.add(frozenset(d.items()))
+            worlds = new
+        return cls(worlds)
+
+    def __iter__(self) -> Iterator[World]:
+        return iter(self._worlds)
+
+    def __len__(self) -> int:
+        return len(self._worlds)
+
+    def __bool__(self) -> bool:
+        return bool(self._worlds)
+
+    def __repr__(self) -> str:
+        return "{self.__class__.__name__}({0} distributions)".format(len(self._worlds), self=self)
+
+    def transform(self, func: Callable[[Counter], Iterable[Counter]]) -> RoleStats:
+        """Return the stats with func applied to every distribution.
+
+        func is given each distribution (as a Counter it may modify) and returns
+        the ones it can turn into, if any; those with negative counts are dropped.
+
+        """
+
+        worlds = set()
+        for world in self._worlds:
+            for new in func(Counter(dict(world))):
+                if all(count >= 0 for count in new.values()):
+                    worlds.add(frozenset(new.items()))
+        return RoleStats(worlds)
+
+    def reconfigure(self, var, reason: str) -> RoleStats:
+        """Let roles adjust the distributions through the "reconfigure_stats" event."""
+        event = Event("reconfigure_stats", {"new": []})
+
+        def dispatch(roleset: Counter) -> List[Counter]:
+            event.data["new"] = [roleset]
+            event.dispatch(var, roleset, reason)
+            return event.data["new"]
+
+        return self.transform(dispatch)
+
+    def remove_one(self, possible: Iterable[str]) -> RoleStats:
+        """Account for a player having died, whose role is one of possible.
+
+        Distributions without any player left in one of these roles can't be right, so they are dropped.
+
+        """
+
+        possible = set(possible)
+
+        def remove(roleset: Counter) -> Iterator[Counter]:
+            for role in possible:
+                if roleset[role] >= 1:
+                    d = Counter(roleset)
+                    d[role] -= 1
+                    yield d
+
+        return self.transform(remove)
+
+    def ranges(self) -> Dict[str, Tuple[int, int]]:
+        """Return the smallest and largest count of each role across all distributions.
+
+        The result is computed once and shared; callers must not modify it.
+
+        """
+        if self._ranges is None:
+            ranges = {} # type: Dict[str, Tuple[int, int]]
+            for world in self._worlds:
+                for role, count in world:
+                    if role not in ranges:
+                        ranges[role] = (count, count)
+                    else:
+                        mn, mx = ranges[role]
+                        if count < mn:
+                            ranges[role] = (count, mx)
+                        elif count > mx:
+                            ranges[role] = (mn, count)
+            self._ranges = ranges
+        return self._ranges
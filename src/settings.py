@@ -7,6 +7,13 @@ from collections import OrderedDict
 from typing import Any, Dict, FrozenSet
 
 LANGUAGE = 'en'
+# Which parser to use for message templates: "antlr" for the generated ANTLR parser,
+# or "native" for the hand-written parser (does not require the antlr4 runtime).
+# python -m src.messages.compare checks that both build the same templates for every message.
+MESSAGE_PARSER = "antlr"
+# Compile (and validate) every message when the bot starts instead of when each one is first used.
+# The compiled messages are cached to disk and reused as long as the message files do not change.
+PRECOMPILE_MESSAGES = False
 
 MINIMUM_WAIT = 60
 EXTRA_WAIT = 30
@@ -17,6 +24,37 @@ WAIT_AFTER_JOIN = 25 # Wait at least this many seconds after the last join
 IRC_TB_INIT = 23 # initial number of tokens
 IRC_TB_DELAY = 1.73 # wait time between adding tokens
 IRC_TB_BURST = 23 # maximum number of tokens that can be accumulated
+# Keep tuning the token bucket while connected, based on how long the server takes to answer our pings.
+# The IRC_TB_* values above are the starting point, and the bucket is kept within the limits below.
+IRC_TB_ADAPTIVE = False
+IRC_TB_MIN_DELAY = 0.5 # never send faster than one message every this many seconds
+IRC_TB_MAX_DELAY = 4 # never back off further than one message every this many seconds
+IRC_TB_MIN_BURST = 4
+IRC_TB_MAX_BURST = 30
+IRC_TB_PING_INTERVAL = 30 # how often to ping the server (in seconds) for a new sample; overrides SERVER_PING_INTERVAL if lower
+# Which IRC client to use: "blocking" for the socket-based client, or "asyncio" to read and
+# write on an asyncio event loop (sending a burst of messages then doesn't hold up reading)
+IRC_CLIENT = "blocking"
+# Connect again if the connection to the server drops, instead of exiting. Users, channels and the game
+# in progress are kept: game timers are paused until the bot is back in the game channel.
+RECONNECT = False
+RECONNECT_DELAY = 5 # seconds to wait before the first attempt; doubles after each failed one
+RECONNECT_MAX_DELAY = 300
+# Stop the game in progress if the bot isn't back in the game channel this many seconds after losing the
+# connection (or straight away if joining it fails), instead of leaving the game frozen. 0 to wait forever.
+RECONNECT_GAME_TIMEOUT = 600
+# Join short messages to the same target into a single line where they fit, so they only use one token.
+# Messages are held back for up to IRC_PACK_WINDOW seconds to give the ones following them a chance to catch up.
+IRC_PACK_LINES = False
+IRC_PACK_WINDOW = 0.05
+# WHO and WHOIS queries are never sent for something which is already being looked up. After looking up a user,
+# further lookups are held back for WHO_COALESCE_DELAY seconds, and if WHO_COALESCE_MIN or more of them are in the
+# same channel, that channel is looked up instead. No more than WHO_BUDGET queries are sent every WHO_BUDGET_WINDOW seconds.
+WHO_COALESCE_DELAY = 0.5
+WHO_COALESCE_MIN = 3
+WHO_BUDGET = 8
+WHO_BUDGET_WINDOW = 10
+WHO_TIMEOUT = 60 # allow asking again if the server hasn't finished answering after this many seconds
 # !wait uses a token bucket
 WAIT_TB_INIT  = 2   # initial number of tokens
 WAIT_TB_DELAY = 240 # wait time between adding tokens
@@ -218,6 +256,12 @@ TRACEBACK_VERBOSITY = 2  # 0 = no locals at all, 1 = innermost frame's locals, 2
 USER_DATA_LEVEL = 0  # 0 = fully anonymize users, 1 = expose nick only, 2 = expose full hostmask, account, and channel membership
 CHANNEL_DATA_LEVEL = 0  # 0 = fully anonymize channels, 1 = expose channel name
 
+# Record how long each event listener takes to run; see the fprofile command.
+# This adds a small amount of overhead to every event, so only enable it when needed.
+PROFILE_EVENTS = False
+PROFILE_EVENTS_SAMPLES = 1000 # how many recent calls per listener to keep for percentile calculations
+PROFILE_EVENTS_FILE = "event_profile.json" # where fprofile export writes its data
+
 # How often to ping the server (in seconds) to detect unclean disconnection
 SERVER_PING_INTERVAL = 120
 
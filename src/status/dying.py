@@ -1,8 +1,7 @@
 import time
-from collections import Counter
 from typing import Tuple
 
-from src.containers import UserDict
+from src.containers import UserDict, track_state
 from src.decorators import event_listener
 from src.functions import get_players, get_main_role, get_all_roles, get_reveal_role
 from src.messages import messages
@@ -14,6 +13,7 @@ __all__ = ["add_dying", "is_dying", "kill_players"]
 DyingEntry = Tuple[str, str, bool]
 
 DYING = UserDict() # type: UserDict[User, DyingEntry]
+track_state(DYING)
 
 def add_dying(var, player: User, killer_role: str, reason: str, *, death_triggers: bool = True) -> bool:
     """
@@ -94,16 +94,7 @@ def kill_players(var, *, end_game: bool = True) -> bool:
             evt.dispatch(var, player, all_roles, evt_death_triggers)
 
         # give roles/modes an opportunity to adjust !stats now that all deaths have resolved
-        evt = Event("reconfigure_stats", {"new": []})
-        newstats = set()
-        for rs in var.ROLE_STATS:
-            d = Counter(dict(rs))
-            evt.data["new"] = [d]
-            evt.dispatch(var, d, "del_player")
-            for v in evt.data["new"]:
-                if min(v.values()) >= 0:
-                    newstats.add(frozenset(v.items()))
-        var.ROLE_STATS = frozenset(newstats)
+        var.ROLE_STATS = var.ROLE_STATS.reconfigure(var, "del_player")
 
         # notify listeners that all deaths have resolved
         # FIXME: end_game is a temporary hack until we move state transitions into the event loop
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.logger import errlog
+
+__all__ = ["Timer"]
+
+""" Every timer the bot sets goes through here.
+
+Rather than starting a thread for each one like threading.Timer does, all timers are kept in
+a single heap ordered by when they are due, and one thread sleeps until the earliest of them
+and runs it. This means callbacks run one after another, so they must not block; anything
+which needs to wait should set a timer of its own instead. Errors raised by a callback are
+reported like errors in commands, and don't stop the other timers from going off.
+
+"""
+
+_Entry = Tuple[float, int, "Timer"]
+
+_cond = threading.Condition()
+_heap = [] # type: List[_Entry]
+_counter = itertools.count()
+_stale = 0 # entries in the heap for timers which were cancelled or moved since
+_thread = None # type: Optional[threading.Thread]
+
+class Timer:
+    """Call a function after a number of seconds have passed.
+
+    This takes the same arguments as threading.Timer, and timers are started and cancelled
+    the same way. On top of that, a timer can tell how long it has left and be moved to a
+    different time, without having to make a new one.
+
+    :param interval: Seconds to wait once started
+    :param function: Function to call
+    :param args: Positional arguments to call function with
+    :param kwargs: Keyword arguments to call function with
+    """
+
+    def __init__(self, interval: float, function: Callable[..., Any], args: Iterable[Any] = (), kwargs: Optional[Dict[str, Any]] = None):
+        self.interval = interval
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self._entry = None # type: Optional[_Entry]
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.function!r}, remaining={0:.3f})".format(self.remaining(), self=self)
+
+    def start(self):
+        """Schedule the timer to go off in interval seconds."""
+        self.reschedule(self.interval)
+
+    def reschedule(self, interval: float):
+        """Make the timer go off interval seconds from now instead.
+
+        This works whether the timer is pending, cancelled, or already went off.
+        """
+        global _thread
+        with _cond:
+            self._discard()
+            self.interval = interval
+            self._entry = (time.monotonic() + interval, next(_counter), self)
+            heapq.heappush(_heap, self._entry)
+            if _thread is None:
+                _thread = threading.Thread(target=_run, name="timers", daemon=True)
+                _thread.start()
+            _cond.notify()
+
+    def cancel(self):
+        """Stop the timer from going off, if it hasn't already."""
+        with _cond:
+            self._discard()
+
+    def is_alive(self) -> bool:
+        """Return whether the timer is waiting to go off."""
+        return self._entry is not None
+
+    def remaining(self) -> float:
+        """Return how many seconds are left until the timer goes off, or 0 if it isn't pending."""
+        entry = self._entry
+        if entry is None:
+            return 0.0
+        return max(0.0, entry[0] - time.monotonic())
+
+    def _discard(self):
+        global _stale
+        if self._entry is not None:
+            self._entry = None
+            _stale += 1
+            if _stale > 64 and _stale > len(_heap) // 2:
+                _compact()
+
+def _compact():
+    global _stale
+    _heap[:] = [entry for entry in _heap if entry[2]._entry is entry]
+    heapq.heapify(_heap)
+    _stale = 0
+
+def _next_due() -> Timer:
+    global _stale
+    with _cond:
+        while True:
+            while _heap and _heap[0][2]._entry is not _heap[0]:
+                heapq.heappop(_heap)
+                _stale -= 1
+            now = time.monotonic()
+            if _heap and _heap[0][0] <= now:
+                timer = heapq.heappop(_heap)[2]
+                timer._entry = None
+                return timer
+            _cond.wait(_heap[0][0] - now if _heap else None)
+
+def _run():
+    from src.decorators import handle_error # src.decorators imports modules which import this one
+    while True:
+        timer = _next_due()
+        try:
+            handle_error(timer.function)(*timer.args, **timer.kwargs)
+        except BaseException:
+            # handle_error deals with anything deriving from Exception; the rest (such as SystemExit)
+            # still must not end this thread, as every timer depends on it
+            errlog(traceback.format_exc())
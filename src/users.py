@@ -3,9 +3,10 @@ from __future__ import annotations
 import fnmatch
 import time
 import re
-from typing import Callable, List, Optional, Set
+import bisect
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-from src.context import IRCContext, Features, NotLoggedIn, lower, equals
+from src.context import IRCContext, Features, NotLoggedIn, WhoQueue, lower, equals
 from src import settings as var
 from src import db
 from src.events import EventListener
@@ -14,8 +15,8 @@ from src.match import Match
 
 import botconfig  # type: ignore
 
-__all__ = ["Bot", "predicate", "get", "add", "users", "disconnected", "complete_match",
-           "parse_rawnick", "parse_rawnick_as_dict", "User", "FakeUser", "BotUser"]
+__all__ = ["Bot", "predicate", "get", "add", "users", "disconnected", "complete_match", "UserIndex",
+           "parse_rawnick", "parse_rawnick_as_dict", "User", "LowerUser", "FakeUser", "BotUser"]
 
 Bot: BotUser = None # type: ignore[assignment]
 
@@ -23,6 +24,18 @@ _users: CheckedSet[User] = CheckedSet("users._users")
 _ghosts: CheckedSet[User] = CheckedSet("users._ghosts")
 _pending_account_updates: CheckedDict[User, CheckedDict[str, Callable]] = CheckedDict("users._pending_account_updates")
 
+# Secondary indexes over _users, so that lookups don't need to scan every user we know about.
+# Users are never mutated while they are in _users (changing a property swaps in a new instance),
+# so these only need to be updated when users are added to or removed from _users.
+# Fake users have no ident or host, and any user may lack an account; since missing properties
+# match anything in partial_match(), those users are tracked separately and included in every lookup
+_nick_index: Dict[str, Set[User]] = {} # casefolded nick -> users
+_nick_index_casemapping: Optional[str] = None
+_host_index: Dict[Tuple[str, str], Set[User]] = {} # (ident, host) -> users
+_no_host: Set[User] = set()
+_account_index: Dict[str, Set[User]] = {} # account -> users
+_no_account: Set[User] = set()
+
 _arg_msg = "(user={0:for_tb}, allow_bot={1})"
 
 # This is used to tell if this is a fake nick or not. If this function
@@ -66,7 +79,11 @@ def get(nick=None, ident=None, host=None, account=None, *, allow_multiple=False,
         return [temp] if allow_multiple else temp
 
     potential = []
-    users = set(_users)
+    if update and have_raw_nick:
+        # the case-insensitive check below can only make use of the (casefolded) nick index
+        users = _candidates(nick, None, None, None)
+    else:
+        users = _candidates(nick, ident, host, account)
     if not allow_ghosts:
         users.difference_update(_ghosts)
     if allow_bot:
@@ -123,10 +140,72 @@ def add(cli, *, nick, ident=None, host=None, account=NotLoggedIn):
         except ValueError:
             pass
         else:
-            _users.add(new)
+            _add_user(new)
 
     return new
 
+def _add_user(user):
+    _users.add(user)
+    if _nick_index_casemapping is not None:
+        _nick_index.setdefault(lower(user.nick, casemapping=_nick_index_casemapping), set()).add(user)
+    if user.ident is None or user.host is None:
+        _no_host.add(user)
+    else:
+        _host_index.setdefault((user.ident, user.host), set()).add(user)
+    if user.account is None:
+        _no_account.add(user)
+    else:
+        _account_index.setdefault(user.account, set()).add(user)
+
+def _discard_user(user):
+    if user not in _users:
+        return
+    _users.discard(user)
+    if _nick_index_casemapping is not None:
+        _discard_from_index(_nick_index, lower(user.nick, casemapping=_nick_index_casemapping), user)
+    _no_host.discard(user)
+    _discard_from_index(_host_index, (user.ident, user.host), user)
+    _no_account.discard(user)
+    _discard_from_index(_account_index, user.account, user)
+
+def _discard_from_index(index, key, user):
+    bucket = index.get(key)
+    if bucket is not None:
+        bucket.discard(user)
+        if not bucket:
+            del index[key]
+
+def _candidates(nick, ident, host, account) -> Set[User]:
+    """Return a new set of the users which could partially match the given properties.
+
+    This is a superset of the actual matches, drawn from the smallest applicable index;
+    the caller is still responsible for checking each candidate.
+    """
+    global _nick_index_casemapping
+    options = []
+    if nick is not None:
+        casemapping = Features["CASEMAPPING"]
+        if casemapping != _nick_index_casemapping:
+            # nicks were casefolded under a different casemapping (or never indexed at all), so rebuild
+            _nick_index.clear()
+            for user in _users:
+                _nick_index.setdefault(lower(user.nick, casemapping=casemapping), set()).add(user)
+            _nick_index_casemapping = casemapping
+        options.append((_nick_index.get(lower(nick, casemapping=casemapping), ()),))
+    if ident is not None and host is not None:
+        options.append((_host_index.get((ident, host), ()), _no_host))
+    if account is not None:
+        options.append((_account_index.get(account, ()), _no_account))
+
+    if not options:
+        return set(_users)
+
+    smallest = min(options, key=lambda x: sum(len(y) for y in x))
+    candidates = set() # type: Set[User]
+    for bucket in smallest:
+        candidates.update(bucket)
+    return candidates
+
 def users():
     """Iterate over the users in the registry."""
     yield from _users
@@ -156,7 +235,7 @@ def complete_match(pattern: str, scope=None):
 
     direct_match = False
     for user in scope:
-        nick = lower(user.nick)
+        nick = user.lower().nick
         stripped_nick = nick.lstrip("[{\\^_`|}]")
         if nick_search:
             if nick == nick_search:
@@ -176,7 +255,7 @@ def complete_match(pattern: str, scope=None):
         for user in scope:
             if not user.account:
                 continue # fakes don't have accounts, so this search won't be able to find them
-            acct = lower(user.account)
+            acct = user.lower().account
             stripped_acct = acct.lstrip("[{\\^_`|}]")
             if acct == acct_search:
                 if not direct_match:
@@ -188,6 +267,148 @@ def complete_match(pattern: str, scope=None):
 
     return Match(matches)
 
+class _SortedKeys:
+    """ Parallel sorted arrays of keys and ids of the users they belong to, searched by bisection. """
+    __slots__ = ("keys", "ids")
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.ids: List[int] = []
+
+    def add(self, key: str, uid: int):
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.ids.insert(i, uid)
+
+    def remove(self, key: str, uid: int):
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.ids[i] == uid:
+                del self.keys[i]
+                del self.ids[i]
+                return
+            i += 1
+
+    def exact(self, key: str) -> Set[int]:
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return set(self.ids[lo:hi])
+
+    def prefix(self, key: str) -> Set[int]:
+        found = set()
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key):
+            found.add(self.ids[i])
+            i += 1
+        return found
+
+class UserIndex:
+    """ Sorted index over casefolded nicks and accounts, for repeated complete_match() calls.
+
+    Users are added as they are first seen in a searched scope, so the index can be seeded
+    once (e.g. from get_players() at the start of a phase) and then only needs to be told
+    about users leaving it. Results are always restricted to the scope being searched, so
+    stale entries cost a little memory but never change the outcome.
+
+    Entries are keyed on object identity rather than User.__hash__, which is comparatively
+    expensive; this is safe since users are never mutated (changing a property swaps in a
+    new instance), and the index holds a reference to every user it knows about.
+    """
+    def __init__(self, users=()):
+        self._entries: Dict[int, Tuple[User, List[Optional[str]]]] = {}
+        self._casemapping: Optional[str] = None
+        self.clear()
+        for user in users:
+            self.add(user)
+
+    def __contains__(self, user) -> bool:
+        return id(user) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._casemapping = Features["CASEMAPPING"]
+        self._nicks = _SortedKeys()
+        self._stripped_nicks = _SortedKeys()
+        self._accounts = _SortedKeys()
+        self._stripped_accounts = _SortedKeys()
+        self._indexes = (self._nicks, self._stripped_nicks, self._accounts, self._stripped_accounts)
+
+    def add(self, user: User):
+        uid = id(user)
+        if uid in self._entries:
+            return
+        luser = user.lower()
+        keys = [luser.nick, luser.nick.lstrip("[{\\^_`|}]"), None, None]
+        # fakes don't have accounts, so an account search won't be able to find them
+        if user.account:
+            keys[2] = luser.account
+            keys[3] = luser.account.lstrip("[{\\^_`|}]")
+        self._entries[uid] = (user, keys)
+        for index, key in zip(self._indexes, keys):
+            if key is not None:
+                index.add(key, uid)
+
+    def discard(self, user: User):
+        uid = id(user)
+        entry = self._entries.pop(uid, None)
+        if entry is None:
+            return
+        for index, key in zip(self._indexes, entry[1]):
+            if key is not None:
+                index.remove(key, uid)
+
+    def complete_match(self, pattern: str, scope=None) -> Match[User]:
+        """ Find a user or users who match the given pattern.
+
+        This has the same semantics as the module-level complete_match(); see there for details.
+
+        :param pattern: Pattern to match on, in the format "[nick][:account]".
+        :param Optional[Iterable[User]] scope: Users to match pattern against. Any of them
+            not already in the index are added to it. If None, search the whole index.
+        :returns: A Match object describing whether or not the match succeeded.
+        :rtype: Match[User]
+        """
+        if self._casemapping != Features["CASEMAPPING"]:
+            # every key we have is potentially wrong now
+            users = [user for user, keys in self._entries.values()]
+            self.clear()
+            for user in users:
+                self.add(user)
+
+        if scope is None:
+            scope = [user for user, keys in self._entries.values()]
+            ids = list(self._entries)
+        else:
+            scope = list(scope)
+            ids = list(map(id, scope))
+            if not self._entries.keys() >= set(ids):
+                for user in scope:
+                    self.add(user)
+
+        nick_search, _, acct_search = lower(pattern).partition(":")
+        if not nick_search and not acct_search:
+            return Match([])
+
+        found = set(ids)
+        if nick_search:
+            exact = found & self._nicks.exact(nick_search)
+            if exact:
+                found = exact
+            else:
+                found &= self._nicks.prefix(nick_search) | self._stripped_nicks.prefix(nick_search)
+        if acct_search:
+            exact = found & self._accounts.exact(acct_search)
+            if exact:
+                found = exact
+            else:
+                found &= self._accounts.prefix(acct_search) | self._stripped_accounts.prefix(acct_search)
+
+        # preserve scope order, like the linear search does
+        return Match([user for user, uid in zip(scope, ids) if uid in found])
+
 _raw_nick_pattern = re.compile(r"^(?P<nick>.+?)(?:!(?P<ident>.+?)@(?P<host>.+))?$")
 
 def parse_rawnick(rawnick, *, default=None):
@@ -209,13 +430,13 @@ def _cleanup_user(evt, var, user):
         user.disconnected = True
     else:
         user.disconnected = False
-        _users.discard(user)
+        _discard_user(user)
 
 def _reset(evt, var):
     """Cleans up users that left during game during game end."""
     for user in _ghosts:
         if not user.channels:
-            _users.discard(user)
+            _discard_user(user)
     _ghosts.clear()
 
 def _update_account(evt, user):
@@ -257,6 +478,7 @@ class User(IRCContext):
         self.dict_keys = []
         self.dict_values = []
         self.account_timestamp = time.time()
+        self._lower = None # type: Optional[LowerUser]
 
         if Bot is not None and nick is not None and Bot.nick.rstrip("_") == nick.rstrip("_") and None in {Bot.ident, Bot.host}:
             # Bot ident/host being None means that this user isn't hashable, so it cannot be in any containers
@@ -268,6 +490,7 @@ class User(IRCContext):
             if host is not None:
                 self._host = host
             self._account = account
+            self._lower = None
             self.timestamp = time.time()
             self.account_timestamp = time.time()
 
@@ -282,7 +505,7 @@ class User(IRCContext):
             self = Bot
 
         elif nick is not None and ident is not None and host is not None and account is not None:
-            users = set(_users)
+            users = _candidates(nick, ident, host, account)
             users.add(Bot)
             if self in users:
                 for user in users:
@@ -324,7 +547,7 @@ class User(IRCContext):
             # and instead opt for the sake of clarity that this separation provides.
 
             potential = None
-            users = set(_users)
+            users = _candidates(nick, ident, host, account)
             users.add(Bot)
             for user in users:
                 if self.partial_match(user):
@@ -404,7 +627,7 @@ class User(IRCContext):
 
         _ghosts.discard(self)
         if not self.channels or same_user:
-            _users.discard(self) # Goodbye, my old friend
+            _discard_user(self) # Goodbye, my old friend
 
         for l in self.lists[:]:
             while self in l:
@@ -433,7 +656,7 @@ class User(IRCContext):
                         channel.modes[mode].discard(self)
                         channel.modes[mode].add(self)
             if not isinstance(new, BotUser):
-                _users.add(new)
+                _add_user(new)
             elif self is Bot:
                 Bot = new
 
@@ -442,10 +665,12 @@ class User(IRCContext):
         assert not self.lists + self.sets + self.dict_keys + self.dict_values
 
     def lower(self):
-        temp = type(self)(self.client, lower(self.nick), lower(self.ident), lower(self.host, casemapping="ascii"), lower(self.account))
-        if temp is not self: # If everything is already lowercase, we'll get back the same instance
-            temp.channels = self.channels
-            temp.ref = self.ref or self
+        casemapping = Features["CASEMAPPING"]
+        temp = self._lower
+        # users never change their properties (a new user is swapped in instead),
+        # so the cached value is only ever made stale by a change in casemapping
+        if temp is None or temp.casemapping != casemapping:
+            temp = self._lower = LowerUser(self, casemapping)
         return temp
 
     def is_owner(self):
@@ -557,6 +782,12 @@ class User(IRCContext):
             callback(self)
             return
 
+        if self.account is not None and Features.get("account-tag", False) and self.account_timestamp > time.time() - 900:
+            # account-tag is enabled, so the message that prompted this call carried our current account
+            # (this also covers users who are not logged in, since they send no tag at all)
+            callback(self)
+            return
+
         if self.account and self.account_timestamp > time.time() - 900:
             # account data is less than 15 minutes old, use existing data instead of refreshing
             callback(self)
@@ -577,7 +808,7 @@ class User(IRCContext):
             self.who()
         else:
             # Fallback to WHOIS
-            self.client.send("WHOIS {0}".format(self))
+            WhoQueue.whois(self)
 
     @property
     def nick(self): # name should be the same as nick (for length calculation)
@@ -642,7 +873,37 @@ class User(IRCContext):
             _ghosts.discard(self)
             # ensure dangling users aren't left around in our tracking var
             if not self.channels:
-                _users.discard(self)
+                _discard_user(self)
+
+class LowerUser:
+    """Casefolded view of a user's nick, ident, host, and account, as returned by User.lower()."""
+
+    __slots__ = ("nick", "ident", "host", "account", "ref", "casemapping")
+
+    def __init__(self, user: User, casemapping: str):
+        self.nick = lower(user.nick, casemapping=casemapping)
+        self.ident = lower(user.ident, casemapping=casemapping)
+        self.host = lower(user.host, casemapping="ascii")
+        self.account = lower(user.account, casemapping=casemapping)
+        self.ref = user.ref or user
+        self.casemapping = casemapping
+
+    def __repr__(self):
+        return "{self.__class__.__name__}({self.nick!r}, {self.ident!r}, {self.host!r}, {self.account!r})".format(self=self)
+
+    def __eq__(self, other):
+        return (isinstance(other, LowerUser)
+                and self.nick == other.nick
+                and self.ident == other.ident
+                and self.host == other.host
+                and self.account == other.account)
+
+    def __hash__(self):
+        return hash((self.nick, self.ident, self.host, self.account))
+
+    @property
+    def channels(self):
+        return self.ref.channels
 
 class FakeUser(User):
 
@@ -36,15 +36,15 @@ import socket
 import string
 import subprocess
 import sys
-import threading
 import time
 import traceback
 import urllib.request
 
 from collections import defaultdict, deque, Counter
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Set, Optional, Callable, Tuple
+from typing import TYPE_CHECKING, Dict, Set, Optional, Callable, Tuple
 
+from oyoyo.client import PRIORITY_LOW
 from oyoyo.parse import parse_nick
 
 import botconfig  # type: ignore
@@ -55,12 +55,14 @@ from src import db, events, dispatcher, channels, users, hooks, logger, debuglog
 from src.users import User
 
 from src.lineparse import LineParser, LineParseError, WantsHelp
-from src.containers import UserList, UserSet, UserDict, DefaultUserDict
+from src.containers import UserList, UserSet, UserDict, DefaultUserDict, UserSetDict, track_state
 from src.decorators import command, hook, handle_error, event_listener, COMMANDS
 from src.dispatcher import MessageDispatcher
 from src.messages import messages, LocalMode
 from src.warnings import *
 from src.context import IRCContext
+from src.rolestats import RoleStats
+from src.timers import Timer
 from src.status import try_protection, add_dying, is_dying, kill_players, get_absent, is_silent
 from src.votes import chk_decision
 from src.cats import (
@@ -100,13 +102,15 @@ var.TIMERS = {}  # type: ignore
 var.PHASE = "none"  # type: ignore
 var.OLD_MODES = defaultdict(set)  # type: ignore
 
-var.ROLES = UserDict() # type: ignore # actually UserDict[str, UserSet]
+var.ROLES = UserSetDict() # type: ignore # actually UserSetDict[str]
 var.ORIGINAL_ROLES = UserDict() # type: ignore # actually UserDict[str, UserSet]
 var.MAIN_ROLES = UserDict() # type: ignore # actually UserDict[users.User, str]
 var.ORIGINAL_MAIN_ROLES = UserDict() # type: ignore # actually UserDict[users.User, str]
 var.FINAL_ROLES = UserDict() # type: ignore # actually UserDict[users.User, str]
 var.ALL_PLAYERS = UserList() # type: ignore
 var.FORCE_ROLES = DefaultUserDict(UserSet) # type: ignore
+# get_players() and friends are cached until one of these changes
+track_state(var.ROLES, var.MAIN_ROLES, var.ALL_PLAYERS)
 var.ORIGINAL_ACCS = UserDict() # type: ignore # actually UserDict[users.User, str]
 
 var.IDLE_WARNED = UserSet() # type: ignore
@@ -293,7 +297,7 @@ def reset():
     var.PINGED_ALREADY_ACCS = set()
     var.FGAMED = False
     var.GAMEMODE_VOTES.clear()
-    var.ROLE_STATS = frozenset() # type: FrozenSet[FrozenSet[Tuple[str, int]]]
+    var.ROLE_STATS = RoleStats()
 
     reset_settings()
 
@@ -848,9 +852,8 @@ def _join_player(var, wrapper, who=None, forced=False):
 
         # Set join timer
         if var.JOIN_TIME_LIMIT > 0:
-            t = threading.Timer(var.JOIN_TIME_LIMIT, kill_join, [var, wrapper])
+            t = Timer(var.JOIN_TIME_LIMIT, kill_join, [var, wrapper])
             var.TIMERS["join"] = (t, time.time(), var.JOIN_TIME_LIMIT)
-            t.daemon = True
             t.start()
 
     elif wrapper.source in pl:
@@ -909,9 +912,8 @@ def _join_player(var, wrapper, who=None, forced=False):
         if "join_pinger" in var.TIMERS:
             var.TIMERS["join_pinger"][0].cancel()
 
-        t = threading.Timer(10, join_timer_handler, (var,))
+        t = Timer(10, join_timer_handler, (var,))
         var.TIMERS["join_pinger"] = (t, time.time(), 10)
-        t.daemon = True
         t.start()
 
     if not wrapper.source.is_fake or not botconfig.DEBUG_MODE:
@@ -1056,6 +1058,64 @@ def parted_modes(evt, chan, user, reason): # FIXME: This uses var
         chan.join()
     var.OLD_MODES.pop(user, None)
 
+def _get_start_roles(var):
+    start_roles = set(var.ORIGINAL_MAIN_ROLES.values())
+    for roleset, amount in var.CURRENT_GAMEMODE.ACTIVE_ROLE_SETS.items():
+        if amount == 0:
+            continue
+        for role, count in var.CURRENT_GAMEMODE.ROLE_SETS[roleset].items():
+            if count == 0:
+                continue
+            start_roles.add(role)
+    return start_roles
+
+# (var.ROLE_STATS, phase, reply) of the last !stats with the default STATS_TYPE
+_stats_reply = None # type: Optional[Tuple[RoleStats, str, str]]
+
+def _default_stats_reply(var):
+    """Return the !stats reply for the default STATS_TYPE.
+
+    The reply only depends on var.ROLE_STATS and the phase. As the former is replaced
+    rather than modified whenever the role counts change, it is only rebuilt then.
+
+    """
+
+    global _stats_reply
+    if _stats_reply is not None and _stats_reply[0] is var.ROLE_STATS and _stats_reply[1] == var.PHASE:
+        return _stats_reply[2]
+
+    entries = []
+    first_count = 0
+    start_roles = _get_start_roles(var)
+
+    # remove any 0/0 entries if they weren't starting roles, otherwise we may have bad grammar in !stats
+    role_stats = {r: v for r, v in var.ROLE_STATS.ranges().items() if r in start_roles or v != (0, 0)}
+    order = [r for r in role_order() if r in role_stats]
+    if var.DEFAULT_ROLE in order:
+        order.remove(var.DEFAULT_ROLE)
+        order.append(var.DEFAULT_ROLE)
+    first = role_stats[order[0]]
+    if first[0] == first[1] == 1:
+        first_count = 1
+
+    for role in order:
+        if role in var.CURRENT_GAMEMODE.SECONDARY_ROLES:
+            continue
+        count = role_stats.get(role, (0, 0))
+        if count[0] == count[1]:
+            if count[0] == 0:
+                if role not in start_roles:
+                    continue
+                entries.append(messages["stats_reply_entry_none"].format(role))
+            else:
+                entries.append(messages["stats_reply_entry_single"].format(role, count[0]))
+        else:
+            entries.append(messages["stats_reply_entry_range"].format(role, count[0], count[1]))
+
+    reply = messages["stats_reply"].format(var.PHASE, first_count, entries)
+    _stats_reply = (var.ROLE_STATS, var.PHASE, reply)
+    return reply
+
 @command("stats", pm=True, phases=("join", "day", "night"))
 def stats(var, wrapper, message):
     """Displays the player statistics."""
@@ -1081,56 +1141,18 @@ def stats(var, wrapper, message):
     if var.PHASE == "join" or var.STATS_TYPE == "disabled":
         return
 
-    entries = []
-    first_count = 0
-
-    start_roles = set(var.ORIGINAL_MAIN_ROLES.values())
-    for roleset, amount in var.CURRENT_GAMEMODE.ACTIVE_ROLE_SETS.items():
-        if amount == 0:
-            continue
-        for role, count in var.CURRENT_GAMEMODE.ROLE_SETS[roleset].items():
-            if count == 0:
-                continue
-            start_roles.add(role)
-
     # Uses events in order to enable roles to modify logic
     # The events are fired off as part of transition_day and del_player, and are not calculated here
     if var.STATS_TYPE == "default":
-        # Collapse var.ROLE_STATS into a Dict[str, Tuple[int, int]]
-        role_stats = {}
-        for stat_set in var.ROLE_STATS:
-            for r, a in stat_set:
-                if r not in role_stats:
-                    role_stats[r] = (a, a)
-                else:
-                    mn, mx = role_stats[r]
-                    role_stats[r] = (min(mn, a), max(mx, a))
-        # remove any 0/0 entries if they weren't starting roles, otherwise we may have bad grammar in !stats
-        role_stats = {r: v for r, v in role_stats.items() if r in start_roles or v != (0, 0)}
-        order = [r for r in role_order() if r in role_stats]
-        if var.DEFAULT_ROLE in order:
-            order.remove(var.DEFAULT_ROLE)
-            order.append(var.DEFAULT_ROLE)
-        first = role_stats[order[0]]
-        if first[0] == first[1] == 1:
-            first_count = 1
+        wrapper.reply(_default_stats_reply(var))
+        return
 
-        for role in order:
-            if role in var.CURRENT_GAMEMODE.SECONDARY_ROLES:
-                continue
-            count = role_stats.get(role, (0, 0))
-            if count[0] == count[1]:
-                if count[0] == 0:
-                    if role not in start_roles:
-                        continue
-                    entries.append(messages["stats_reply_entry_none"].format(role))
-                else:
-                    entries.append(messages["stats_reply_entry_single"].format(role, count[0]))
-            else:
-                entries.append(messages["stats_reply_entry_range"].format(role, count[0], count[1]))
+    entries = []
+    first_count = 0
 
     # Show everything as-is, with no hidden information
-    elif var.STATS_TYPE == "accurate":
+    if var.STATS_TYPE == "accurate":
+        start_roles = _get_start_roles(var)
         l1 = [k for k in var.ROLES.keys() if var.ROLES[k]]
         l2 = [k for k in var.ORIGINAL_ROLES.keys() if var.ORIGINAL_ROLES[k]]
         rs = set(l1+l2)
@@ -1516,17 +1538,10 @@ def on_del_player(evt: Event, var, player: User, all_roles: Set[str], death_trig
         possible = {evt.params.main_role}
     else:
         possible = set(event.data["possible"])
-    newstats = set()
     # For every possible role this person is, try to deduct 1 from that role's count in our stat sets
     # if a stat set doesn't contain the role, then that would lead to an impossible condition and therefore
-    # that set is not added to newstats to indicate that set is no longer possible
-    for p in possible:
-        for rs in var.ROLE_STATS:
-            d = Counter(dict(rs))
-            if p in d and d[p] >= 1:
-                d[p] -= 1
-                newstats.add(frozenset(d.items()))
-    var.ROLE_STATS = frozenset(newstats)
+    # that set is dropped to indicate that set is no longer possible
+    var.ROLE_STATS = var.ROLE_STATS.remove_one(possible)
 
     if var.PHASE == "join":
         if player in var.GAMEMODE_VOTES:
@@ -1589,123 +1604,275 @@ def on_kill_players(evt: Event, var, players: Set[User]):
         # HACK: notify kill_players that game is ending so it can pass it to its caller
         evt.prevent_default = True
 
+# while the connection to the server is lost, when that happened and how long each game timer had left
+_paused_at = None # type: Optional[datetime]
+_paused_timers = {} # type: Dict[str, Tuple[Timer, float]]
+
+@event_listener("irc_disconnected")
+def pause_timers(evt, var, cli):
+    """Stop the game clock until we're back in the channel, so nobody runs out of time while unable to act."""
+    global _paused_at
+    with var.GRAVEYARD_LOCK:
+        if _paused_at is not None:
+            return # lost the connection again before getting back into the channel
+        _paused_at = datetime.now()
+        for name, (timer, start, limit) in var.TIMERS.items():
+            if not timer.is_alive():
+                continue # already went off (e.g. day_warn); resuming it would fire it again
+            _paused_timers[name] = (timer, timer.remaining())
+            timer.cancel()
+        if (var.PHASE == "join" or var.PHASE in var.GAME_PHASES) and var.RECONNECT_GAME_TIMEOUT:
+            _give_up_timer.reschedule(var.RECONNECT_GAME_TIMEOUT)
+
 @handle_error
+def _give_up_game():
+    """Stop the game if we still aren't back in the channel, rather than leave it frozen forever."""
+    with var.GRAVEYARD_LOCK:
+        _give_up_timer.cancel()
+        if _paused_at is None or (var.PHASE != "join" and var.PHASE not in var.GAME_PHASES):
+            return
+        plog("Could not get back into {0}; stopping the game".format(botconfig.CHANNEL))
+        if var.PHASE == "join":
+            reset_modes_timers(var)
+            reset()
+        else:
+            stop_game(var, log=False)
+
+_give_up_timer = Timer(0, _give_up_game)
+
+@hook("channelisfull")
+@hook("inviteonlychan")
+@hook("bannedfromchan")
+@hook("badchannelkey")
+def on_join_failed(cli, server, bot_nick, chan, message=""):
+    if _paused_at is not None and users.equals(chan, botconfig.CHANNEL):
+        _give_up_game()
+
+@event_listener("who_end")
+def resume_timers(evt, target):
+    global _paused_at
+    if target is not channels.Main or _paused_at is None:
+        return
+    with var.GRAVEYARD_LOCK:
+        outage = datetime.now() - _paused_at
+        for name, (timer, remaining) in _paused_timers.items():
+            if name not in var.TIMERS or var.TIMERS[name][0] is not timer:
+                continue # replaced or removed while catching up on who left
+            timer.reschedule(remaining)
+            var.TIMERS[name] = (timer, var.TIMERS[name][1] + outage.total_seconds(), var.TIMERS[name][2])
+
+        # the idle and grace time checks don't count the outage either
+        for user in var.LAST_SAID_TIME:
+            var.LAST_SAID_TIME[user] += outage
+        for user, (timeofdc, what) in list(var.DISCONNECTED.items()):
+            if timeofdc < _paused_at: # and not because they were gone when we came back
+                var.DISCONNECTED[user] = (timeofdc + outage, what)
+        var.GAME_START_TIME += outage
+        if var.DAY_START_TIME is not None:
+            var.DAY_START_TIME += outage
+        if var.NIGHT_START_TIME is not None:
+            var.NIGHT_START_TIME += outage
+
+        _paused_at = None
+        _paused_timers.clear()
+        _give_up_timer.cancel()
+        _reaper_schedule()
+
+@event_listener("reset")
+def on_reset_pause(evt, var):
+    global _paused_at
+    _paused_at = None
+    _paused_timers.clear()
+    _give_up_timer.cancel()
+
+# when each player next needs looking at by the reaper, be it for idling or for not coming back in time
+_reaper_due = UserDict() # type: UserDict[users.User, datetime]
+_reaper_gameid = 0.0
+
+def _reaper_deadline(user: User) -> Optional[datetime]:
+    """Return when the reaper next has something to do about this player, if ever (until they do something)."""
+    if user not in get_players():
+        return None
+
+    deadlines = []
+    if user in var.DISCONNECTED:
+        timeofdc, what = var.DISCONNECTED[user]
+        grace = {"quit": var.QUIT_GRACE_TIME, "part": var.PART_GRACE_TIME, "account": var.ACC_GRACE_TIME}.get(what)
+        if grace is not None:
+            deadlines.append(timeofdc + timedelta(seconds=grace))
+
+    # nighttime doesn't count towards idling when players can't speak anyway
+    if not user.is_fake and not (var.DEVOICE_DURING_NIGHT and var.PHASE == "night"):
+        # these mirror the checks in _reap, each with the earliest time it can pass as things stand
+        lst = var.LAST_SAID_TIME.get(user, var.GAME_START_TIME)
+        if var.WARN_IDLE_TIME and user not in var.IDLE_WARNED:
+            deadlines.append(lst + timedelta(seconds=var.WARN_IDLE_TIME))
+        if var.PM_WARN_IDLE_TIME and user not in var.IDLE_WARNED_PM:
+            deadlines.append(lst + timedelta(seconds=var.PM_WARN_IDLE_TIME))
+        if (var.KILL_IDLE_TIME and (not var.WARN_IDLE_TIME or user in var.IDLE_WARNED) and
+                (not var.PM_WARN_IDLE_TIME or user in var.IDLE_WARNED_PM)):
+            deadlines.append(lst + timedelta(seconds=var.KILL_IDLE_TIME))
+
+    return min(deadlines, default=None)
+
+def _reaper_schedule(*players: User):
+    """Work out when the given players (or everyone, if none are given) next need checking on.
+
+    Speaking up usually only pushes a player's deadline back, so this isn't needed then; the
+    check already pending for them will find nothing to do yet and move on to the new deadline.
+    """
+    with var.GRAVEYARD_LOCK:
+        if not _reaper_gameid or _reaper_gameid != var.GAME_ID:
+            return
+        if not players:
+            players = tuple(set(get_players()) | set(_reaper_due))
+        for user in players:
+            when = _reaper_deadline(user)
+            if when is None:
+                _reaper_due.pop(user, None)
+            else:
+                _reaper_due[user] = when
+
+        if _reaper_due:
+            delay = (min(_reaper_due.values()) - datetime.now()).total_seconds()
+            _reaper_timer.reschedule(max(0.0, delay))
+        else:
+            _reaper_timer.cancel()
+
 def reaper(cli, gameid):
-    # check to see if idlers need to be killed.
-    last_day_id = var.DAY_COUNT
-    num_night_iters = 0
-    short = False
-
-    while gameid == var.GAME_ID:
-        skip = False
-        time.sleep(1 if short else 10)
-        short = False
-        with var.GRAVEYARD_LOCK:
-            # Terminate reaper when game ends
-            if var.PHASE not in var.GAME_PHASES:
-                return
-            if var.PHASE != var.GAMEPHASE:
-                # in a phase transition, so don't run the reaper here or else things may break
-                # flag to re-run sooner than usual though
-                short = True
+    """Start checking on idlers and on players who left, until the game ends."""
+    global _reaper_gameid
+    with var.GRAVEYARD_LOCK:
+        _reaper_gameid = gameid
+        _reaper_schedule()
+
+@handle_error
+def _reap():
+    with var.GRAVEYARD_LOCK:
+        # Terminate reaper when game ends
+        if _reaper_gameid != var.GAME_ID or var.PHASE not in var.GAME_PHASES:
+            return
+        if _paused_at is not None:
+            # the connection to the server is lost; nobody can speak up or come back meanwhile
+            # resume_timers reschedules everyone once we're back
+            return
+        if var.PHASE != var.GAMEPHASE:
+            # in a phase transition, so don't run the reaper here or else things may break
+            # re-run shortly though
+            _reaper_timer.reschedule(1)
+            return
+
+        now = datetime.now()
+        due = {user for user, when in _reaper_due.items() if when <= now}
+
+        if not (var.DEVOICE_DURING_NIGHT and var.PHASE == "night") and (var.WARN_IDLE_TIME or var.PM_WARN_IDLE_TIME or var.KILL_IDLE_TIME):  # only if enabled
+            to_warn    = set() # type: Set[users.User]
+            to_warn_pm = set() # type: Set[users.User]
+            to_kill    = set() # type: Set[users.User]
+            for user in get_players():
+                if user.is_fake or user not in due:
+                    continue
+                lst = var.LAST_SAID_TIME.get(user, var.GAME_START_TIME)
+                tdiff = now - lst
+                if var.WARN_IDLE_TIME and (tdiff >= timedelta(seconds=var.WARN_IDLE_TIME) and
+                                        user not in var.IDLE_WARNED):
+                    to_warn.add(user)
+                    var.IDLE_WARNED.add(user)
+                    var.LAST_SAID_TIME[user] = (datetime.now() - timedelta(seconds=var.WARN_IDLE_TIME))  # Give them a chance
+                elif var.PM_WARN_IDLE_TIME and (tdiff >= timedelta(seconds=var.PM_WARN_IDLE_TIME) and
+                                        user not in var.IDLE_WARNED_PM):
+                    to_warn_pm.add(user)
+                    var.IDLE_WARNED_PM.add(user)
+                    var.LAST_SAID_TIME[user] = (datetime.now() - timedelta(seconds=var.PM_WARN_IDLE_TIME))
+                elif var.KILL_IDLE_TIME and (tdiff >= timedelta(seconds=var.KILL_IDLE_TIME) and
+                                        (not var.WARN_IDLE_TIME or user in var.IDLE_WARNED) and
+                                        (not var.PM_WARN_IDLE_TIME or user in var.IDLE_WARNED_PM)):
+                    to_kill.add(user)
+                elif (tdiff < timedelta(seconds=var.WARN_IDLE_TIME) and
+                                        (user in var.IDLE_WARNED or user in var.IDLE_WARNED_PM)):
+                    var.IDLE_WARNED.discard(user)  # player saved themselves from death
+                    var.IDLE_WARNED_PM.discard(user)
+            for user in to_kill:
+                if var.ROLE_REVEAL in ("on", "team"):
+                    channels.Main.send(messages["idle_death"].format(user, get_reveal_role(user)))
+                else:
+                    channels.Main.send(messages["idle_death_no_reveal"].format(user))
+                if var.PHASE in var.GAME_PHASES:
+                    var.DCED_LOSERS.add(user)
+                if var.IDLE_PENALTY:
+                    var.NIGHT_IDLED.discard(user) # don't double-dip if they idled out night as well
+                    add_warning(user, var.IDLE_PENALTY, users.Bot, messages["idle_warning"], expires=var.IDLE_EXPIRY)
+                add_dying(var, user, "bot", "idle", death_triggers=False)
+            pl = get_players()
+            x = [a for a in to_warn if a in pl]
+            if x:
+                channels.Main.send(messages["channel_idle_warning"].format(x))
+            msg_targets = [p for p in to_warn_pm if p in pl]
+            for p in msg_targets:
+                p.queue_message(messages["player_idle_warning"].format(channels.Main))
+            if msg_targets:
+                p.send_messages()
+        for dcedplayer, (timeofdc, what) in list(var.DISCONNECTED.items()):
+            if dcedplayer not in due:
                 continue
-            elif var.DEVOICE_DURING_NIGHT:
-                if var.PHASE == "night":
-                    # don't count nighttime towards idling
-                    # this doesn't do an exact count, but is good enough
-                    num_night_iters += 1
-                    skip = True
-                elif var.PHASE == "day" and var.DAY_COUNT != last_day_id:
-                    last_day_id = var.DAY_COUNT
-                    num_night_iters += 1
-                    for user in var.LAST_SAID_TIME:
-                        var.LAST_SAID_TIME[user] += timedelta(seconds=10 * num_night_iters)
-                    num_night_iters = 0
-
-            if not skip and (var.WARN_IDLE_TIME or var.PM_WARN_IDLE_TIME or var.KILL_IDLE_TIME):  # only if enabled
-                to_warn    = set() # type: Set[users.User]
-                to_warn_pm = set() # type: Set[users.User]
-                to_kill    = set() # type: Set[users.User]
-                for user in get_players():
-                    if user.is_fake:
-                        continue
-                    lst = var.LAST_SAID_TIME.get(user, var.GAME_START_TIME)
-                    tdiff = datetime.now() - lst
-                    if var.WARN_IDLE_TIME and (tdiff > timedelta(seconds=var.WARN_IDLE_TIME) and
-                                            user not in var.IDLE_WARNED):
-                        to_warn.add(user)
-                        var.IDLE_WARNED.add(user)
-                        var.LAST_SAID_TIME[user] = (datetime.now() - timedelta(seconds=var.WARN_IDLE_TIME))  # Give them a chance
-                    elif var.PM_WARN_IDLE_TIME and (tdiff > timedelta(seconds=var.PM_WARN_IDLE_TIME) and
-                                            user not in var.IDLE_WARNED_PM):
-                        to_warn_pm.add(user)
-                        var.IDLE_WARNED_PM.add(user)
-                        var.LAST_SAID_TIME[user] = (datetime.now() - timedelta(seconds=var.PM_WARN_IDLE_TIME))
-                    elif var.KILL_IDLE_TIME and (tdiff > timedelta(seconds=var.KILL_IDLE_TIME) and
-                                            (not var.WARN_IDLE_TIME or user in var.IDLE_WARNED) and
-                                            (not var.PM_WARN_IDLE_TIME or user in var.IDLE_WARNED_PM)):
-                        to_kill.add(user)
-                    elif (tdiff < timedelta(seconds=var.WARN_IDLE_TIME) and
-                                            (user in var.IDLE_WARNED or user in var.IDLE_WARNED_PM)):
-                        var.IDLE_WARNED.discard(user)  # player saved themselves from death
-                        var.IDLE_WARNED_PM.discard(user)
-                for user in to_kill:
-                    if var.ROLE_REVEAL in ("on", "team"):
-                        channels.Main.send(messages["idle_death"].format(user, get_reveal_role(user)))
-                    else:
-                        channels.Main.send(messages["idle_death_no_reveal"].format(user))
-                    if var.PHASE in var.GAME_PHASES:
-                        var.DCED_LOSERS.add(user)
-                    if var.IDLE_PENALTY:
-                        var.NIGHT_IDLED.discard(user) # don't double-dip if they idled out night as well
-                        add_warning(user, var.IDLE_PENALTY, users.Bot, messages["idle_warning"], expires=var.IDLE_EXPIRY)
-                    add_dying(var, user, "bot", "idle", death_triggers=False)
-                pl = get_players()
-                x = [a for a in to_warn if a in pl]
-                if x:
-                    channels.Main.send(messages["channel_idle_warning"].format(x))
-                msg_targets = [p for p in to_warn_pm if p in pl]
-                for p in msg_targets:
-                    p.queue_message(messages["player_idle_warning"].format(channels.Main))
-                if msg_targets:
-                    p.send_messages()
-            for dcedplayer, (timeofdc, what) in list(var.DISCONNECTED.items()):
-                mainrole = get_main_role(dcedplayer)
-                revealrole = get_reveal_role(dcedplayer)
-                if what == "quit" and (datetime.now() - timeofdc) > timedelta(seconds=var.QUIT_GRACE_TIME):
-                    if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
-                        channels.Main.send(messages["quit_death"].format(dcedplayer, revealrole))
-                    else: # FIXME: Merge those two
-                        channels.Main.send(messages["quit_death_no_reveal"].format(dcedplayer))
-                    if var.PHASE != "join" and var.PART_PENALTY:
-                        var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
-                        add_warning(dcedplayer, var.PART_PENALTY, users.Bot, messages["quit_warning"], expires=var.PART_EXPIRY)
-                    if var.PHASE in var.GAME_PHASES:
-                        var.DCED_LOSERS.add(dcedplayer)
-                    add_dying(var, dcedplayer, "bot", "quit", death_triggers=False)
-                elif what == "part" and (datetime.now() - timeofdc) > timedelta(seconds=var.PART_GRACE_TIME):
-                    if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
-                        channels.Main.send(messages["part_death"].format(dcedplayer, revealrole))
-                    else: # FIXME: Merge those two
-                        channels.Main.send(messages["part_death_no_reveal"].format(dcedplayer))
-                    if var.PHASE != "join" and var.PART_PENALTY:
-                        var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
-                        add_warning(dcedplayer, var.PART_PENALTY, users.Bot, messages["part_warning"], expires=var.PART_EXPIRY)
-                    if var.PHASE in var.GAME_PHASES:
-                        var.DCED_LOSERS.add(dcedplayer)
-                    add_dying(var, dcedplayer, "bot", "part", death_triggers=False)
-                elif what == "account" and (datetime.now() - timeofdc) > timedelta(seconds=var.ACC_GRACE_TIME):
-                    if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
-                        channels.Main.send(messages["account_death"].format(dcedplayer, revealrole))
-                    else:
-                        channels.Main.send(messages["account_death_no_reveal"].format(dcedplayer))
-                    if var.PHASE != "join" and var.ACC_PENALTY:
-                        var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
-                        add_warning(dcedplayer, var.ACC_PENALTY, users.Bot, messages["acc_warning"], expires=var.ACC_EXPIRY)
-                    if var.PHASE in var.GAME_PHASES:
-                        var.DCED_LOSERS.add(dcedplayer)
-                    add_dying(var, dcedplayer, "bot", "account", death_triggers=False)
-            kill_players(var)
+            mainrole = get_main_role(dcedplayer)
+            revealrole = get_reveal_role(dcedplayer)
+            if what == "quit" and (now - timeofdc) >= timedelta(seconds=var.QUIT_GRACE_TIME):
+                if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
+                    channels.Main.send(messages["quit_death"].format(dcedplayer, revealrole))
+                else: # FIXME: Merge those two
+                    channels.Main.send(messages["quit_death_no_reveal"].format(dcedplayer))
+                if var.PHASE != "join" and var.PART_PENALTY:
+                    var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
+                    add_warning(dcedplayer, var.PART_PENALTY, users.Bot, messages["quit_warning"], expires=var.PART_EXPIRY)
+                if var.PHASE in var.GAME_PHASES:
+                    var.DCED_LOSERS.add(dcedplayer)
+                add_dying(var, dcedplayer, "bot", "quit", death_triggers=False)
+            elif what == "part" and (now - timeofdc) >= timedelta(seconds=var.PART_GRACE_TIME):
+                if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
+                    channels.Main.send(messages["part_death"].format(dcedplayer, revealrole))
+                else: # FIXME: Merge those two
+                    channels.Main.send(messages["part_death_no_reveal"].format(dcedplayer))
+                if var.PHASE != "join" and var.PART_PENALTY:
+                    var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
+                    add_warning(dcedplayer, var.PART_PENALTY, users.Bot, messages["part_warning"], expires=var.PART_EXPIRY)
+                if var.PHASE in var.GAME_PHASES:
+                    var.DCED_LOSERS.add(dcedplayer)
+                add_dying(var, dcedplayer, "bot", "part", death_triggers=False)
+            elif what == "account" and (now - timeofdc) >= timedelta(seconds=var.ACC_GRACE_TIME):
+                if mainrole != "person" and var.ROLE_REVEAL in ("on", "team"):
+                    channels.Main.send(messages["account_death"].format(dcedplayer, revealrole))
+                else:
+                    channels.Main.send(messages["account_death_no_reveal"].format(dcedplayer))
+                if var.PHASE != "join" and var.ACC_PENALTY:
+                    var.NIGHT_IDLED.discard(dcedplayer) # don't double-dip if they idled out night as well
+                    add_warning(dcedplayer, var.ACC_PENALTY, users.Bot, messages["acc_warning"], expires=var.ACC_EXPIRY)
+                if var.PHASE in var.GAME_PHASES:
+                    var.DCED_LOSERS.add(dcedplayer)
+                add_dying(var, dcedplayer, "bot", "account", death_triggers=False)
+        kill_players(var)
+
+        # also moves on to whoever is next, even if nobody was actually due (such as after speaking up)
+        _reaper_schedule(*due)
+
+_reaper_timer = Timer(0, _reap)
+
+@event_listener("transition_day_begin")
+def on_transition_day_begin(evt, var):
+    if var.DEVOICE_DURING_NIGHT and var.NIGHT_START_TIME is not None:
+        # don't count nighttime towards idling
+        night = var.DAY_START_TIME - var.NIGHT_START_TIME
+        for user in get_players():
+            var.LAST_SAID_TIME[user] = var.LAST_SAID_TIME.get(user, var.GAME_START_TIME) + night
+        _reaper_schedule()
+
+@event_listener("reset")
+def on_reset_reaper(evt, var):
+    global _reaper_gameid
+    with var.GRAVEYARD_LOCK:
+        _reaper_gameid = 0.0
+        _reaper_due.clear()
+        _reaper_timer.cancel()
 
 @command("")  # update last said
 def update_last_said(var, wrapper, message):
@@ -1714,6 +1881,11 @@ def update_last_said(var, wrapper, message):
 
     if var.PHASE not in ("join", "none"):
         var.LAST_SAID_TIME[wrapper.source] = datetime.now()
+        if var.WARN_IDLE_TIME and (wrapper.source in var.IDLE_WARNED or wrapper.source in var.IDLE_WARNED_PM):
+            var.IDLE_WARNED.discard(wrapper.source)  # player saved themselves from death
+            var.IDLE_WARNED_PM.discard(wrapper.source)
+            # they can be warned again before the deadline the reaper has for them
+            _reaper_schedule(wrapper.source)
 
 @event_listener("chan_join", priority=1)
 def on_join(evt, chan, user): # FIXME: This uses var
@@ -1905,6 +2077,7 @@ def leave(var, what, user, why=None):
         kill_players(var)
     else:
         var.DISCONNECTED[user] = (datetime.now(), what)
+        _reaper_schedule(user)
 
 @command("leave", pm=True, phases=("join", "day", "night"))
 def leave_game(var, wrapper, message):
@@ -1956,24 +2129,22 @@ def begin_day():
     var.DAY_ID = time.time()
     if var.DAY_TIME_WARN > 0:
         if var.STARTED_DAY_PLAYERS <= var.SHORT_DAY_PLAYERS:
-            t1 = threading.Timer(var.SHORT_DAY_WARN, hurry_up, [var.DAY_ID, False])
+            t1 = Timer(var.SHORT_DAY_WARN, hurry_up, [var.DAY_ID, False])
             l = var.SHORT_DAY_WARN
         else:
-            t1 = threading.Timer(var.DAY_TIME_WARN, hurry_up, [var.DAY_ID, False])
+            t1 = Timer(var.DAY_TIME_WARN, hurry_up, [var.DAY_ID, False])
             l = var.DAY_TIME_WARN
         var.TIMERS["day_warn"] = (t1, var.DAY_ID, l)
-        t1.daemon = True
         t1.start()
 
     if var.DAY_TIME_LIMIT > 0:  # Time limit enabled
         if var.STARTED_DAY_PLAYERS <= var.SHORT_DAY_PLAYERS:
-            t2 = threading.Timer(var.SHORT_DAY_LIMIT, hurry_up, [var.DAY_ID, True])
+            t2 = Timer(var.SHORT_DAY_LIMIT, hurry_up, [var.DAY_ID, True])
             l = var.SHORT_DAY_LIMIT
         else:
-            t2 = threading.Timer(var.DAY_TIME_LIMIT, hurry_up, [var.DAY_ID, True])
+            t2 = Timer(var.DAY_TIME_LIMIT, hurry_up, [var.DAY_ID, True])
             l = var.DAY_TIME_LIMIT
         var.TIMERS["day"] = (t2, var.DAY_ID, l)
-        t2.daemon = True
         t2.start()
 
     if var.DEVOICE_DURING_NIGHT:
@@ -2211,17 +2382,8 @@ def transition_day(gameid=0):
 
     # chilling howl message was played, give roles the opportunity to update !stats
     # to account for this
-    event = Event("reconfigure_stats", {"new": []})
     for i in range(revt2.data["howl"]):
-        newstats = set()
-        for rs in var.ROLE_STATS:
-            d = Counter(dict(rs))
-            event.data["new"] = [d]
-            event.dispatch(var, d, "howl")
-            for v in event.data["new"]:
-                if min(v.values()) >= 0:
-                    newstats.add(frozenset(v.items()))
-        var.ROLE_STATS = frozenset(newstats)
+        var.ROLE_STATS = var.ROLE_STATS.reconfigure(var, "howl")
 
     killer_role = {}
     for deadperson in dead:
@@ -2393,7 +2555,7 @@ def relay(var, wrapper, message):
                 for user in var.SPECTATING_DEADCHAT:
                     user.queue_message(messages["relay_message_deadchat"].format(wrapper.source, message))
 
-            user.send_messages()
+            user.send_messages(priority=PRIORITY_LOW)
 
     elif wrapper.source in badguys and len(badguys) > 1:
         # handle wolfchat toggles
@@ -2421,7 +2583,7 @@ def relay(var, wrapper, message):
             for player in var.SPECTATING_WOLFCHAT:
                 player.queue_message(messages["relay_message_wolfchat"].format(wrapper.source, message))
         if badguys or var.SPECTATING_WOLFCHAT:
-            player.send_messages()
+            player.send_messages(priority=PRIORITY_LOW)
 
 @handle_error
 def transition_night():
@@ -2458,15 +2620,13 @@ def transition_night():
 
     var.NIGHT_ID = time.time()
     if var.NIGHT_TIME_LIMIT > 0:
-        t = threading.Timer(var.NIGHT_TIME_LIMIT, night_timeout, kwargs={"gameid": var.NIGHT_ID})
+        t = Timer(var.NIGHT_TIME_LIMIT, night_timeout, kwargs={"gameid": var.NIGHT_ID})
         var.TIMERS["night"] = (t, var.NIGHT_ID, var.NIGHT_TIME_LIMIT)
-        t.daemon = True
         t.start()
 
     if var.NIGHT_TIME_WARN > 0:
-        t2 = threading.Timer(var.NIGHT_TIME_WARN, night_warn, kwargs={"gameid": var.NIGHT_ID})
+        t2 = Timer(var.NIGHT_TIME_WARN, night_warn, kwargs={"gameid": var.NIGHT_ID})
         var.TIMERS["night_warn"] = (t2, var.NIGHT_ID, var.NIGHT_TIME_WARN)
-        t2.daemon = True
         t2.start()
 
     # game ended from bitten / amnesiac turning, narcolepsy totem expiring, or other weirdness
@@ -2525,6 +2685,8 @@ def cgamemode(arg):
 
 @hook("error")
 def on_error(cli, pfx, msg):
+    if cli.reconnect and not cli.quitting and not var.RESTARTING:
+        return # the connection is opened again, carrying on with the game
     if var.RESTARTING or msg.lower().endswith("(excess flood)"):
         import src
         if src.lagcheck > 0:
@@ -2744,10 +2906,10 @@ def get_help(var, wrapper, message):
             for fn in functions:
                 if fn.flag and name not in fn.aliases:
                     admin_commands.add(name)
-    wrapper.pm(messages["commands_list"].format(sorted(commands)))
+    wrapper.pm(messages["commands_list"].format(sorted(commands)), priority=PRIORITY_LOW)
     if admin_commands:
-        wrapper.pm(messages["admin_commands_list"].format(sorted(admin_commands)))
-    wrapper.pm(messages["commands_further_help"])
+        wrapper.pm(messages["admin_commands_list"].format(sorted(admin_commands)), priority=PRIORITY_LOW)
+    wrapper.pm(messages["commands_further_help"], priority=PRIORITY_LOW)
 
 def get_wiki_page(URI):
     try:
@@ -2934,7 +3096,7 @@ def timeleft(var, wrapper, message):
         elif var.PHASE == "join":
             what = "the game is canceled if it's not started"
 
-        remaining = int((var.TIMERS[var.PHASE][1] + var.TIMERS[var.PHASE][2]) - time.time())
+        remaining = int(var.TIMERS[var.PHASE][0].remaining())
         msg = "There is \u0002{0[0]:0>2}:{0[1]:0>2}\u0002 remaining until {1}.".format(divmod(remaining, 60), what)
     else:
         msg = messages["timers_disabled"].format(var.PHASE.capitalize())
@@ -3679,17 +3841,14 @@ def py(var, wrapper, message):
 
 @command("freceive", owner_only=True, flag="d", pm=True)
 def freceive(var, wrapper: MessageDispatcher, message: str):
-    from oyoyo.parse import parse_raw_irc_command
+    from oyoyo.parse import parse_irc_line
     try:
-        line = message.encode("utf-8")
-        prefix, cmd, args = parse_raw_irc_command(line)
-        prefix = prefix.decode("utf-8")
-        args = [arg.decode("utf-8") for arg in args if isinstance(arg, bytes)]
+        tags, prefix, cmd, args = parse_irc_line(message)
         if cmd in ("privmsg", "notice"):
             is_notice = cmd == "notice"
             handler.on_privmsg(wrapper.client, prefix, *args, notice=is_notice)
         else:
-            handler.unhandled(wrapper.client, prefix, cmd, *args)
+            handler.unhandled(wrapper.client, prefix, cmd, *args, tags=tags)
     except Exception as e:
         wrapper.send("{e.__class__.__name__}: {e}".format(e=e))
 
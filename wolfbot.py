@@ -45,7 +45,7 @@ except ImportError:
           "- The lykos developers"]))
     sys.exit(1)
 
-from oyoyo.client import IRCClient, TokenBucket
+from oyoyo.client import IRCClient, AsyncIRCClient, TokenBucket, RateController
 
 import src
 from src import handler
@@ -56,7 +56,10 @@ def main():
     evt = Event("init", {})
     evt.dispatch()
     src.plog("Connecting to {0}:{1}{2}".format(botconfig.HOST, "+" if botconfig.USE_SSL else "", botconfig.PORT))
-    cli = IRCClient(
+    client_class = IRCClient
+    if var.IRC_CLIENT == "asyncio":
+        client_class = AsyncIRCClient
+    cli = client_class(
                       {"privmsg": lambda *s: None,
                        "notice": lambda *s: None,
                        "": handler.unhandled},
@@ -77,9 +80,21 @@ def main():
                      client_keyfile=var.SSL_KEYFILE,
                      cipher_list=var.SSL_CIPHERS,
                      tokenbucket=TokenBucket(var.IRC_TB_BURST, var.IRC_TB_DELAY, init=var.IRC_TB_INIT),
+                     pack_lines=var.IRC_PACK_LINES,
+                     pack_window=var.IRC_PACK_WINDOW,
+                     reconnect=var.RECONNECT and not src.lagcheck,
+                     reconnect_delay=var.RECONNECT_DELAY,
+                     reconnect_max_delay=var.RECONNECT_MAX_DELAY,
                      connect_cb=handler.connect_callback,
+                     disconnect_cb=handler.disconnect_callback,
                      stream_handler=src.stream,
     )
+    if var.IRC_TB_ADAPTIVE:
+        cli.rate_control = RateController(cli.tokenbucket,
+                                          min_delay=var.IRC_TB_MIN_DELAY,
+                                          max_delay=var.IRC_TB_MAX_DELAY,
+                                          min_burst=var.IRC_TB_MIN_BURST,
+                                          max_burst=var.IRC_TB_MAX_BURST)
     cli.mainLoop()
 
 